@@ -7,8 +7,7 @@ import db_functions
 
 def get_adl_tab_layout(resident_name):
     existing_data = db_functions.fetch_adl_data_for_resident(resident_name)
-    resident_care_levels = db_functions.get_resident_care_level()
-    is_supervisory_care = resident_care_levels.get(resident_name, '') == 'Supervisory Care'
+    is_supervisory_care = db_functions.resident_has_care_level(resident_name, 'Supervisory Care')
 
     # Fields to auto-populate for self-care residents
     auto_self_fields = [
@@ -0,0 +1,169 @@
+"""
+Monthly archives for the audit log.
+
+Closed months are moved out of audit_logs into audit_YYYY_MM.db files next to the
+database, keeping the hot table small. Rows are copied as stored, so archived
+descriptions stay encrypted under the same key and format, and keep their log_id.
+fetch_audit_log_page() attaches an archive only when a search's date range reaches
+into its month.
+
+    python audit_archive.py [--database PATH] [--hot-days N]
+
+Archiving also runs from the app's startup routine. Each month is copied in one
+transaction and deleted from the main database in a second one, so an interrupted
+run never loses rows and the next run finishes the month.
+"""
+import argparse
+import os
+import re
+from datetime import datetime, timedelta
+
+import database_setup
+import db_connection
+
+
+# Months that end before the last HOT_DAYS days are archived; the viewer's default window stays hot
+HOT_DAYS = 10
+
+ARCHIVE_NAME = re.compile(r'^audit_(\d{4})_(\d{2})\.db$')
+
+# Schema name archives are attached under while they are read or written
+ARCHIVE_SCHEMA = 'audit_archive'
+
+
+def archive_folder():
+    return os.path.dirname(os.path.abspath(db_connection.DATABASE_PATH))
+
+
+def archive_path(year_month):
+    """ Path of the archive for a 'YYYY-MM' month. """
+    return os.path.join(archive_folder(), f"audit_{year_month.replace('-', '_')}.db")
+
+
+def month_bounds(year_month):
+    """ First day of a 'YYYY-MM' month and of the month after it, as 'YYYY-MM-DD'. """
+    year, month = (int(part) for part in year_month.split('-'))
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return f'{year:04d}-{month:02d}-01', f'{next_year:04d}-{next_month:02d}-01'
+
+
+def list_archives():
+    """
+    Return the archives next to the database, oldest first.
+
+    Returns:
+    list: ('YYYY-MM', path) tuples.
+    """
+    folder = archive_folder()
+    archives = []
+    for name in os.listdir(folder):
+        match = ARCHIVE_NAME.match(name)
+        if match:
+            archives.append((f'{match.group(1)}-{match.group(2)}', os.path.join(folder, name)))
+    return sorted(archives)
+
+
+def archives_for_range(start=None, end=None):
+    """
+    Return the archives whose month overlaps a timestamp range.
+
+    Args:
+    start (str): Inclusive lower bound ('YYYY-MM-DD' or a full timestamp), None for no bound.
+    end (str): Inclusive upper bound, None for no bound.
+
+    Returns:
+    list: ('YYYY-MM', path) tuples, newest month first.
+    """
+    reached = []
+    for year_month, path in reversed(list_archives()):
+        first_day, next_month = month_bounds(year_month)
+        if (start is None or start < next_month) and (end is None or end >= first_day):
+            reached.append((year_month, path))
+    return reached
+
+
+def attach_archive(conn, path):
+    conn.execute(f'ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}', (path,))
+
+
+def detach_archive(conn):
+    conn.execute(f'DETACH DATABASE {ARCHIVE_SCHEMA}')
+
+
+def archivable_months(hot_days=HOT_DAYS):
+    """ 'YYYY-MM' months still in audit_logs that ended more than `hot_days` days ago, oldest first. """
+    cutoff = (datetime.now() - timedelta(days=hot_days)).strftime('%Y-%m-01')
+    months = []
+    with db_connection.transaction() as conn:
+        # Walk the timestamp index one month at a time instead of grouping the whole table
+        row = conn.execute('SELECT MIN(timestamp) FROM audit_logs').fetchone()
+        while row[0] is not None and row[0] < cutoff:
+            year_month = row[0][:7]
+            months.append(year_month)
+            row = conn.execute('SELECT MIN(timestamp) FROM audit_logs WHERE timestamp >= ?',
+                               (month_bounds(year_month)[1],)).fetchone()
+    return months
+
+
+def archive_month(year_month):
+    """
+    Move one month of audit logs into its archive file.
+
+    Returns:
+    int: Rows moved out of the main database.
+    """
+    first_day, next_month = month_bounds(year_month)
+    path = archive_path(year_month)
+    database_setup.initialize_audit_archive(path)
+
+    conn = db_connection.get_connection()
+    attach_archive(conn, path)
+    try:
+        # Copy first; rows a previous, interrupted run already copied are skipped by log_id
+        with db_connection.transaction():
+            conn.execute(f'''
+                INSERT OR IGNORE INTO {ARCHIVE_SCHEMA}.audit_logs (log_id, username, action, description, timestamp)
+                SELECT log_id, username, action, description, timestamp FROM main.audit_logs
+                WHERE timestamp >= ? AND timestamp < ?
+            ''', (first_day, next_month))
+        # Then delete only what the archive now holds, in a separate commit
+        with db_connection.transaction():
+            moved = conn.execute(f'''
+                DELETE FROM main.audit_logs
+                WHERE timestamp >= ? AND timestamp < ?
+                  AND log_id IN (SELECT log_id FROM {ARCHIVE_SCHEMA}.audit_logs WHERE timestamp >= ? AND timestamp < ?)
+            ''', (first_day, next_month, first_day, next_month)).rowcount
+    finally:
+        detach_archive(conn)
+    return moved
+
+
+def archive_closed_months(hot_days=HOT_DAYS, report=None):
+    """
+    Archive every month of audit logs that ended more than `hot_days` days ago.
+
+    Returns:
+    dict: Rows moved per 'YYYY-MM' month.
+    """
+    moved = {}
+    for year_month in archivable_months(hot_days):
+        moved[year_month] = archive_month(year_month)
+        if report:
+            report(f'{year_month}: {moved[year_month]} rows archived to {archive_path(year_month)}')
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Move closed months of audit logs into monthly archive files.')
+    parser.add_argument('--database', default=db_connection.DATABASE_PATH, help='Database file (default: %(default)s)')
+    parser.add_argument('--hot-days', type=int, default=HOT_DAYS, help='Recent days kept in the main database (default: %(default)s)')
+    args = parser.parse_args()
+
+    db_connection.set_database_path(args.database)
+    database_setup.initialize_database()
+    moved = archive_closed_months(args.hot_days, report=print)
+    print(f'{sum(moved.values())} rows archived from {len(moved)} months.')
+
+
+if __name__ == '__main__':
+    main()
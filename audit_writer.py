@@ -0,0 +1,347 @@
+"""
+Background writer for the audit log.
+
+log_action() only queues an entry; a single writer thread encrypts queued entries and
+inserts them in batches, one transaction per batch, so the UI thread never waits on
+encryption or a commit. The queue is bounded: when it is full, submit() blocks until
+the writer catches up.
+
+A batch that still fails after MAX_ATTEMPTS is written one entry at a time. Entries that
+fail on their own are set aside, so one bad entry cannot hold up every later one. They
+are logged and kept, encrypted, in a spool database next to the main one, and written
+to the audit log when the writer next starts.
+
+flush() waits until everything queued so far is written or set aside. The app calls
+it, with a bounded timeout, on logout, before reading the log and before backups. An
+atexit hook drains the queue on a normal shutdown and spools whatever it could not write.
+"""
+import atexit
+import collections
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import crypto_context
+import db_connection
+
+
+# Audit descriptions longer than this (in bytes) are compressed before they are encrypted.
+# Short ones such as logins would only grow from the zlib header.
+AUDIT_COMPRESS_THRESHOLD = 128
+
+QUEUE_SIZE = 1000
+BATCH_SIZE = 200
+
+# Seconds to wait before retrying a batch that failed to commit, doubling up to the maximum
+RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 10
+
+# Attempts at a batch, about 15 seconds of retrying, before its entries are tried one by one
+MAX_ATTEMPTS = 6
+
+# Entries that failed on their own, kept in memory for inspection
+SET_ASIDE_LIMIT = 1000
+
+# Seconds flushes wait: the UI at logout and before reading the log, backups, and the exit hook
+UI_FLUSH_TIMEOUT = 5
+BACKUP_FLUSH_TIMEOUT = 30
+SHUTDOWN_TIMEOUT = 60
+
+INSERT_SQL = 'INSERT INTO audit_logs (username, action, description, timestamp) VALUES (?, ?, ?, ?)'
+
+# Sidecar database, next to the main one, holding encrypted entries that could not be written
+SPOOL_SUFFIX = '-audit-spool'
+SPOOL_TABLE = '''CREATE TABLE IF NOT EXISTS audit_spool (
+    username TEXT,
+    action TEXT,
+    description,
+    timestamp TEXT)'''
+
+_queue = queue.Queue(maxsize=QUEUE_SIZE)
+_thread = None
+_thread_lock = threading.Lock()
+_progress = threading.Condition()
+_submitted = 0  # Entries queued so far, guarded by _progress
+_committed = 0  # Entries committed or set aside so far, guarded by _progress
+_stats = {'entries': 0, 'batches': 0, 'errors': 0, 'set_aside': 0, 'blocked_submits': 0, 'max_queue_depth': 0,
+          'batch_seconds': 0.0, 'max_batch_seconds': 0.0, 'latency_seconds': 0.0, 'max_latency_seconds': 0.0}
+_last_error = None
+_set_aside = collections.deque(maxlen=SET_ASIDE_LIMIT)
+_in_flight = []  # The batch the writer is working on, guarded by _progress
+_spool_lock = threading.Lock()
+
+
+def encode_audit_payload(description):
+    """ Encrypt an audit description, compressing the long, repetitive change lists first. """
+    return crypto_context.get_context().encrypt(description, compress_over=AUDIT_COMPRESS_THRESHOLD)
+
+
+def start():
+    """ Start the writer thread if it is not already running. """
+    global _thread
+    with _thread_lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_run, name='audit-writer', daemon=True)
+            _thread.start()
+
+
+def submit(username, action, description, timestamp):
+    """
+    Queue one audit entry. Blocks only while the queue is full.
+
+    The timestamp is taken by the caller, so entries keep the time of the event and
+    not the time they were written. Values are coerced to text here, so a stray None
+    or number cannot fail the batch it lands in.
+    """
+    global _submitted
+    username = None if username is None else str(username)
+    action = None if action is None else str(action)
+    description = '' if description is None else str(description)
+    timestamp = str(timestamp) if timestamp else datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    start()
+    entry = (username, action, description, timestamp, time.perf_counter())
+    try:
+        _queue.put_nowait(entry)
+    except queue.Full:
+        with _progress:
+            _stats['blocked_submits'] += 1
+        _queue.put(entry)
+    with _progress:
+        _submitted += 1
+        _stats['max_queue_depth'] = max(_stats['max_queue_depth'], _queue.qsize())
+
+
+def flush(timeout=None):
+    """
+    Wait until every entry queued before the call has been committed.
+
+    Returns:
+    bool: True once flushed, False if the timeout ran out first.
+    """
+    with _progress:
+        target = _submitted
+        if _committed >= target:
+            return True
+        start()  # A writer that died must not leave flush() waiting forever
+        return _progress.wait_for(lambda: _committed >= target, timeout)
+
+
+def _take_batch():
+    """ Block for one entry, then take whatever else is already queued, up to BATCH_SIZE. """
+    batch = [_queue.get()]
+    while len(batch) < BATCH_SIZE:
+        try:
+            batch.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+def _write_batch(batch):
+    rows = [(username, action, encode_audit_payload(description), timestamp)
+            for username, action, description, timestamp, _ in batch]
+    with db_connection.transaction() as conn:
+        conn.executemany(INSERT_SQL, rows)
+
+
+def _record_error(e):
+    global _last_error
+    with _progress:
+        _stats['errors'] += 1
+        _last_error = repr(e)
+
+
+def spool_path():
+    return db_connection.DATABASE_PATH + SPOOL_SUFFIX
+
+
+def _spool(entries):
+    """ Keep entries the audit log would not take in the spool, encrypted. Returns the number kept. """
+    rows = []
+    for username, action, description, timestamp, _ in entries:
+        try:
+            rows.append((username, action, encode_audit_payload(description), timestamp))
+        except Exception as e:
+            # Never stored in plaintext, it may hold resident details
+            print(f'Audit log: lost {action!r} by {username!r} at {timestamp}, it could not be encrypted: {e!r}')
+    if not rows:
+        return 0
+    with _spool_lock:
+        conn = sqlite3.connect(spool_path())
+        try:
+            with conn:
+                conn.execute(SPOOL_TABLE)
+                conn.executemany('INSERT INTO audit_spool (username, action, description, timestamp) VALUES (?, ?, ?, ?)', rows)
+        finally:
+            conn.close()
+    return len(rows)
+
+
+def replay_spool():
+    """
+    Write spooled entries into the audit log, then drop them from the spool.
+
+    The writer calls this when it starts. Entries that still fail stay spooled for the
+    next start. An exit between the insert and the removal writes those entries a second
+    time on the next start, rather than losing them.
+
+    Returns:
+    int: The number of entries written.
+    """
+    path = spool_path()
+    with _spool_lock:
+        if not os.path.exists(path):
+            return 0
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute(SPOOL_TABLE)
+            rows = conn.execute('SELECT rowid, username, action, description, timestamp FROM audit_spool ORDER BY rowid').fetchall()
+            try:
+                with db_connection.transaction() as main:
+                    main.executemany(INSERT_SQL, [row[1:] for row in rows])
+                written = [row[0] for row in rows]
+            except Exception:
+                written = []
+                for row in rows:
+                    try:
+                        with db_connection.transaction() as main:
+                            main.execute(INSERT_SQL, row[1:])
+                        written.append(row[0])
+                    except Exception as e:
+                        _record_error(e)
+            with conn:
+                conn.executemany('DELETE FROM audit_spool WHERE rowid = ?', [(rowid,) for rowid in written])
+            remaining = conn.execute('SELECT COUNT(*) FROM audit_spool').fetchone()[0]
+        finally:
+            conn.close()
+        if not remaining:
+            os.remove(path)
+    return len(written)
+
+
+def _write_one_by_one(batch):
+    """ Write each entry in its own transaction, setting aside the ones that fail. Returns the number written. """
+    written = 0
+    for entry in batch:
+        try:
+            _write_batch([entry])
+            written += 1
+        except Exception as e:
+            _record_error(e)
+            username, action, _, timestamp, _ = entry
+            with _progress:
+                _set_aside.append(entry)
+                _stats['set_aside'] += 1
+            # The description is left out of the log, it may hold resident details
+            print(f'Audit log: set aside {action!r} by {username!r} at {timestamp}: {e!r}')
+            try:
+                _spool([entry])
+            except Exception as spool_error:
+                print(f'Audit log: could not spool {action!r} by {username!r} at {timestamp}: {spool_error!r}')
+    return written
+
+
+def _run():
+    global _committed
+    try:
+        replayed = replay_spool()
+        if replayed:
+            print(f'Audit log: wrote {replayed} spooled entries')
+    except Exception as e:
+        # The spool stays in place and is tried again when the writer next starts
+        _record_error(e)
+        print(f'Audit log: could not write spooled entries: {e!r}')
+    while True:
+        batch = _take_batch()
+        with _progress:
+            _in_flight[:] = batch
+        delay = RETRY_DELAY
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            started = time.perf_counter()
+            try:
+                _write_batch(batch)
+                written = len(batch)
+                break
+            except Exception as e:
+                # Retry the batch, e.g. while another station holds the write lock
+                _record_error(e)
+                if attempt >= MAX_ATTEMPTS:
+                    written = _write_one_by_one(batch)
+                    break
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+        finished = time.perf_counter()
+        latency = finished - batch[0][4]  # The oldest entry waited longest
+        with _progress:
+            _in_flight.clear()
+            _committed += len(batch)
+            _stats['entries'] += written
+            _stats['batches'] += 1
+            _stats['batch_seconds'] += finished - started
+            _stats['max_batch_seconds'] = max(_stats['max_batch_seconds'], finished - started)
+            _stats['latency_seconds'] += sum(finished - entry[4] for entry in batch)
+            _stats['max_latency_seconds'] = max(_stats['max_latency_seconds'], latency)
+            _progress.notify_all()
+
+
+def get_stats():
+    """
+    Return a snapshot of the writer's metrics.
+
+    Returns:
+    dict: queue_depth and max_queue_depth, entries written, batches, errors, set_aside
+    and blocked_submits counts, average and maximum batch commit time and
+    enqueue-to-commit latency in milliseconds, and the last error seen.
+    """
+    with _progress:
+        stats = dict(_stats)
+        stats['queue_depth'] = _queue.qsize()
+        stats['last_error'] = _last_error
+    batches, entries = stats['batches'], stats['entries']
+    stats['avg_batch_ms'] = stats.pop('batch_seconds') / batches * 1000 if batches else 0.0
+    stats['max_batch_ms'] = stats.pop('max_batch_seconds') * 1000
+    stats['avg_latency_ms'] = stats.pop('latency_seconds') / entries * 1000 if entries else 0.0
+    stats['max_latency_ms'] = stats.pop('max_latency_seconds') * 1000
+    return stats
+
+
+def set_aside_entries():
+    """ Entries that could not be written, as (username, action, description, timestamp) tuples, oldest first. """
+    with _progress:
+        return [entry[:4] for entry in _set_aside]
+
+
+def reset_stats():
+    global _last_error
+    with _progress:
+        for name in _stats:
+            _stats[name] = 0.0 if name.endswith('seconds') else 0
+        _last_error = None
+
+
+def _flush_at_exit():
+    if _set_aside:
+        print(f'Audit log: {len(_set_aside)} entries were set aside; they are written from {spool_path()} on the next start')
+    if flush(SHUTDOWN_TIMEOUT):
+        return
+    # Keep what is left for the next start; an entry the stuck writer commits after all is then written twice
+    with _progress:
+        pending = list(_in_flight)
+    while True:
+        try:
+            pending.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    try:
+        spooled = _spool(pending)
+        print(f'Audit log: {spooled} entries could not be written before exit ({_last_error}); '
+              f'they are written from {spool_path()} on the next start')
+    except Exception as e:
+        print(f'Audit log: {len(pending)} entries could not be written before exit and were lost ({_last_error}, {e!r})')
+
+
+# Drain the queue on a normal interpreter exit, including sys.exit() from the UI
+atexit.register(_flush_at_exit)
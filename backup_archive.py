@@ -0,0 +1,254 @@
+"""
+Compressed, encrypted backup archives.
+
+write_archive() streams the database's pages straight from a read snapshot through
+zlib and AES-GCM into one archive file. It holds one frame in memory at a time and
+never writes a plaintext copy. restore_archive() streams an archive back into a
+database file.
+
+Archive layout:
+
+    b'RMBK', format version byte, 4 byte header length, JSON header
+    frames: 4 byte ciphertext length, flags byte, AES-GCM ciphertext and tag
+
+Frame nonces are the header's random prefix followed by the frame number. Each frame
+authenticates the header, its number and its flags, so frames cannot be reordered,
+dropped or spliced in from another archive. The final frame carries the plaintext
+size and SHA-256, so a truncated archive is detected as well.
+
+The backup key is expanded from the database key, so restoring needs the same
+passphrase, or the previous one during a key rotation.
+
+    python backup_archive.py create ARCHIVE [--database PATH]
+    python backup_archive.py restore ARCHIVE DESTINATION
+"""
+import argparse
+import hashlib
+import json
+import os
+import struct
+import time
+import zlib
+from datetime import datetime
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+import crypto_context
+import db_backup
+import db_connection
+
+
+MAGIC = b'RMBK'
+FORMAT_VERSION = 1
+
+# Plaintext bytes per frame; memory use is about twice this
+FRAME_SIZE = 1024 * 1024
+
+# Level 3 keeps nearly all of level 6's ratio on a database at about 1.5 times the speed
+COMPRESSION_LEVEL = 3
+
+FLAG_FINAL = 1
+FRAME_HEADER = struct.Struct('>IB')  # ciphertext length, flags
+
+
+class BackupArchiveError(RuntimeError):
+    """ The archive is damaged, truncated, or not a backup archive. """
+
+
+class BackupKeyMismatchError(BackupArchiveError):
+    """ The archive was written with a key this installation does not have. """
+
+
+def _frame_nonce(prefix, number):
+    return prefix + struct.pack('>Q', number)
+
+
+def _frame_aad(header, number, flags):
+    return header + struct.pack('>QB', number, flags)
+
+
+def context_for_key(key_id, context=None):
+    """ Pick the current or, during a key rotation, the previous context for a key id. """
+    context = context or crypto_context.get_context()
+    for candidate in (context, context.previous):
+        if candidate is not None and candidate.key_id == key_id:
+            return candidate
+    raise BackupKeyMismatchError(f'The backup was written with key {key_id}, which is not configured here.')
+
+
+def write_archive(destination, source=None, context=None, frame_size=FRAME_SIZE, level=COMPRESSION_LEVEL, progress=None):
+    """
+    Stream a consistent snapshot of a database into a compressed, encrypted archive.
+
+    Args:
+    destination (str): Archive file to create; written as .partial and renamed when complete.
+    source (str): Database to back up, defaults to db_connection.DATABASE_PATH.
+    progress (callable): Called as progress(bytes_done, total_bytes, bytes_per_second) after each frame.
+
+    Returns:
+    dict: size, archive_bytes, ratio (size / archive_bytes), seconds and mb_per_second.
+    """
+    source = source or db_connection.DATABASE_PATH
+    context = context or crypto_context.get_context()
+    aesgcm = AESGCM(context.subkey(crypto_context.BACKUP_KEY_INFO))
+    nonce_prefix = os.urandom(4)
+    partial = destination + '.partial'
+    start = time.perf_counter()
+
+    try:
+        with db_backup.read_snapshot(source) as (db_file, page_size, page_count), open(partial, 'wb') as out:
+            total = page_size * page_count
+            header = json.dumps({
+                'database': os.path.basename(source),
+                'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'key_id': context.key_id,
+                'nonce_prefix': nonce_prefix.hex(),
+                'page_size': page_size,
+                'pages': page_count,
+                'compression': 'zlib',
+            }).encode('utf-8')
+            out.write(MAGIC + bytes([FORMAT_VERSION]) + struct.pack('>I', len(header)) + header)
+
+            def write_frame(number, flags, plaintext):
+                ciphertext = aesgcm.encrypt(_frame_nonce(nonce_prefix, number), plaintext, _frame_aad(header, number, flags))
+                out.write(FRAME_HEADER.pack(len(ciphertext), flags) + ciphertext)
+
+            file_hash = hashlib.sha256()
+            done = 0
+            number = 0
+            while done < total:
+                data = db_file.read(min(frame_size, total - done))
+                if not data:
+                    raise BackupArchiveError(f'{source} ended after {done} of {total} bytes')
+                file_hash.update(data)
+                write_frame(number, 0, zlib.compress(data, level))
+                number += 1
+                done += len(data)
+                if progress:
+                    elapsed = time.perf_counter() - start
+                    progress(done, total, done / elapsed if elapsed else 0.0)
+            trailer = json.dumps({'size': done, 'sha256': file_hash.hexdigest(), 'frames': number}).encode('utf-8')
+            write_frame(number, FLAG_FINAL, trailer)
+        os.replace(partial, destination)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+    seconds = time.perf_counter() - start
+    archive_bytes = os.path.getsize(destination)
+    return {'size': done, 'archive_bytes': archive_bytes, 'ratio': done / archive_bytes if archive_bytes else 0.0,
+            'seconds': seconds, 'mb_per_second': done / 1024 / 1024 / seconds if seconds else 0.0}
+
+
+def read_archive_header(f):
+    """
+    Read and check an archive's header.
+
+    Returns:
+    tuple: (raw header bytes, header dict).
+    """
+    prefix = f.read(len(MAGIC) + 5)
+    if len(prefix) < len(MAGIC) + 5 or prefix[:len(MAGIC)] != MAGIC:
+        raise BackupArchiveError('Not a backup archive')
+    if prefix[len(MAGIC)] != FORMAT_VERSION:
+        raise BackupArchiveError(f'Unsupported backup archive version {prefix[len(MAGIC)]}')
+    length = struct.unpack('>I', prefix[len(MAGIC) + 1:])[0]
+    header = f.read(length)
+    if len(header) < length:
+        raise BackupArchiveError('Archive header is truncated')
+    try:
+        info = json.loads(header)
+        info['key_id'], info['nonce_prefix'], info['page_size'], info['pages']
+    except (ValueError, KeyError, TypeError):
+        raise BackupArchiveError('Archive header is damaged')
+    return header, info
+
+
+def restore_archive(archive, destination, context=None, progress=None):
+    """
+    Stream an archive back into a database file.
+
+    The database is rebuilt next to `destination`, checked against the archive's
+    size and SHA-256 and with PRAGMA quick_check, then moved into place.
+
+    Raises:
+    BackupArchiveError: If the archive is damaged or truncated.
+    BackupKeyMismatchError: If neither the current nor the previous key wrote it.
+
+    Returns:
+    dict: size, archive_bytes, ratio, seconds and mb_per_second.
+    """
+    partial = destination + '.partial'
+    start = time.perf_counter()
+    archive_bytes = os.path.getsize(archive)
+    try:
+        with open(archive, 'rb') as f, open(partial, 'wb') as out:
+            header, info = read_archive_header(f)
+            aesgcm = AESGCM(context_for_key(info['key_id'], context).subkey(crypto_context.BACKUP_KEY_INFO))
+            nonce_prefix = bytes.fromhex(info['nonce_prefix'])
+            total = info['page_size'] * info['pages']
+            file_hash = hashlib.sha256()
+            done = 0
+            number = 0
+            while True:
+                frame_header = f.read(FRAME_HEADER.size)
+                if len(frame_header) < FRAME_HEADER.size:
+                    raise BackupArchiveError(f'Archive is truncated after {number} frames')
+                length, flags = FRAME_HEADER.unpack(frame_header)
+                ciphertext = f.read(length)
+                if len(ciphertext) < length:
+                    raise BackupArchiveError(f'Archive is truncated in frame {number}')
+                try:
+                    plaintext = aesgcm.decrypt(_frame_nonce(nonce_prefix, number), ciphertext, _frame_aad(header, number, flags))
+                except InvalidTag:
+                    raise BackupArchiveError(f'Frame {number} failed authentication')
+                if flags & FLAG_FINAL:
+                    trailer = json.loads(plaintext)
+                    break
+                data = zlib.decompress(plaintext)
+                file_hash.update(data)
+                out.write(data)
+                done += len(data)
+                number += 1
+                if progress:
+                    elapsed = time.perf_counter() - start
+                    progress(done, total, done / elapsed if elapsed else 0.0)
+            if f.read(1):
+                raise BackupArchiveError('Unexpected data after the final frame')
+        if trailer['frames'] != number or trailer['size'] != done or trailer['sha256'] != file_hash.hexdigest():
+            raise BackupArchiveError('Restored database does not match the archive checksum')
+        db_backup.verify_backup(partial, info['pages'])
+        os.replace(partial, destination)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+    seconds = time.perf_counter() - start
+    return {'size': done, 'archive_bytes': archive_bytes, 'ratio': done / archive_bytes if archive_bytes else 0.0,
+            'seconds': seconds, 'mb_per_second': done / 1024 / 1024 / seconds if seconds else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write or restore a compressed, encrypted backup archive.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    create_command = commands.add_parser('create')
+    create_command.add_argument('archive')
+    create_command.add_argument('--database', default=db_connection.DATABASE_PATH, help='Database file (default: %(default)s)')
+    restore_command = commands.add_parser('restore')
+    restore_command.add_argument('archive')
+    restore_command.add_argument('destination', help='Database file to rebuild; replaced only once verified')
+    args = parser.parse_args()
+
+    if args.command == 'create':
+        stats = write_archive(args.archive, args.database, progress=db_backup.progress_printer('Archive'))
+    else:
+        stats = restore_archive(args.archive, args.destination, progress=db_backup.progress_printer('Restore'))
+    print(f"{stats['size'] / 1024 / 1024:.1f} MB in {stats['seconds']:.1f} s ({stats['mb_per_second']:.1f} MB/s), "
+          f"archive {stats['archive_bytes'] / 1024 / 1024:.1f} MB, compression ratio {stats['ratio']:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""
+Scheduled backups on a background thread.
+
+start() launches a worker that takes a snapshot whenever one is due, so login never
+waits on a backup. On Windows and Linux the worker runs at the lowest CPU and I/O
+priority the OS gives a thread. It retries a failed backup after a growing delay, for example while the
+external drive is unplugged, and checks again every CHECK_INTERVAL seconds while
+the app stays open. It also moves closed months of audit logs into their archives.
+
+The welcome window shows status_text(). A backup cut short by exit writes no
+manifest, so it never shows up as a snapshot, and the next start takes it again.
+"""
+import os
+import sys
+import threading
+from datetime import datetime, timedelta
+
+import audit_archive
+import audit_writer
+import backup_snapshots
+import db_functions
+
+
+# Days between backups for each frequency offered in the backup configuration window
+FREQUENCY_DAYS = {'Daily': 1, 'Weekly': 7}
+
+# Seconds between checks for a due backup while the app stays open
+CHECK_INTERVAL = 3600
+
+# Seconds to wait before retrying a failed backup, doubling up to the maximum
+RETRY_DELAY = 60
+MAX_RETRY_DELAY = 3600
+
+# Windows: lowers the thread's CPU, I/O and memory priority together
+THREAD_MODE_BACKGROUND_BEGIN = 0x00010000
+
+_thread = None
+_thread_lock = threading.Lock()
+_wake = threading.Event()
+_stop = threading.Event()
+_status_changed = threading.Condition()
+_status = {'state': 'starting', 'percent': None, 'last_backup_date': None, 'last_snapshot': None,
+           'failures': 0, 'last_error': None, 'next_retry': None, 'low_priority': False}
+
+
+def is_backup_due(backup_config, today=None):
+    """ A backup is due once the configured interval has passed, or if none was ever taken. """
+    if not backup_config:
+        return False
+    last_backup_date = backup_config['last_backup_date']
+    if last_backup_date is None:
+        return True
+    days = FREQUENCY_DAYS.get(backup_config['backup_frequency'])
+    today = today or datetime.now().date()
+    return days is not None and (today - last_backup_date).days >= days
+
+
+def perform_backup(backup_config, progress=None):
+    """
+    Take an incremental snapshot into the configured folder, record the date, and
+    prune the snapshots the retention policy no longer keeps.
+
+    Raises:
+    Exception: Whatever stopped the snapshot; the backup date is then left unchanged.
+
+    Returns:
+    dict: The snapshot's manifest.
+    """
+    # Write out queued audit entries so the snapshot holds them
+    if not db_functions.flush_audit_log(audit_writer.BACKUP_FLUSH_TIMEOUT):
+        print('Audit log is not fully written; the backup may miss the most recent entries')
+    manifest = backup_snapshots.create_snapshot(backup_config['backup_folder'], progress=progress)
+    db_functions.update_last_backup_date()
+    try:
+        pruned = backup_snapshots.prune_snapshots(backup_config['backup_folder'], backup_config['keep_daily'],
+                                                  backup_config['keep_weekly'], backup_config['keep_monthly'])
+        if pruned['pruned']:
+            print(f"Pruned {len(pruned['pruned'])} old snapshots, freed {pruned['bytes'] / 1024 / 1024:.1f} MB")
+    except Exception as e:
+        # The new snapshot is safe; the old ones are pruned after a later backup
+        print(f'Error pruning old backups: {e}')
+    return manifest
+
+
+def _lower_thread_priority():
+    """ Best effort: move the calling thread to background priority. Returns True if that took effect. """
+    try:
+        if sys.platform == 'win32':
+            import ctypes
+            kernel32 = ctypes.windll.kernel32
+            return bool(kernel32.SetThreadPriority(kernel32.GetCurrentThread(), THREAD_MODE_BACKGROUND_BEGIN))
+        if sys.platform.startswith('linux'):
+            # On Linux a thread is its own scheduling entity, and without an explicit I/O
+            # priority the kernel derives one from the nice value
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+            return True
+        # Elsewhere setpriority() would take a process ID and slow down the whole app
+        return False
+    except (AttributeError, OSError):
+        return False
+
+
+def _set_status(**changes):
+    with _status_changed:
+        _status.update(changes)
+        _status_changed.notify_all()
+
+
+def _on_progress(done, total, bytes_per_second):
+    percent = done * 100 // total if total else 100
+    if percent != _status['percent']:
+        _set_status(percent=percent)
+
+
+def _check_once():
+    """
+    Take a backup if one is due, then archive closed audit months, whether or not the backup worked.
+
+    Returns:
+    bool: False if the backup failed.
+    """
+    succeeded = True
+    backup_config = db_functions.get_backup_configuration()
+    if not backup_config:
+        _set_status(state='not_configured')
+    elif is_backup_due(backup_config):
+        _set_status(state='running', percent=0, last_backup_date=backup_config['last_backup_date'])
+        try:
+            manifest = perform_backup(backup_config, progress=_on_progress)
+        except Exception as e:
+            with _status_changed:
+                failures = _status['failures'] + 1
+            delay = min(RETRY_DELAY * 2 ** (failures - 1), MAX_RETRY_DELAY)
+            _set_status(state='retrying', percent=None, failures=failures, last_error=str(e) or repr(e),
+                        next_retry=datetime.now() + timedelta(seconds=delay))
+            print(f'Error during backup: {e}')
+            succeeded = False
+        else:
+            print(f"Backup successful: snapshot {manifest['snapshot']} ({manifest['size'] / 1024 / 1024:.1f} MB, "
+                  f"{manifest['new_bytes'] / 1024 / 1024:.1f} MB new, {manifest['seconds']:.1f} s)")
+            _set_status(state='idle', percent=None, last_backup_date=datetime.now().date(), last_snapshot=manifest['snapshot'],
+                        failures=0, last_error=None, next_retry=None)
+    else:
+        _set_status(state='idle', last_backup_date=backup_config['last_backup_date'])
+
+    try:
+        audit_archive.archive_closed_months()
+    except Exception as e:
+        # Rows stay in the main database until the next check archives them
+        print(f'Error archiving audit logs: {e}')
+    return succeeded
+
+
+def _run():
+    _set_status(low_priority=_lower_thread_priority())
+    while not _stop.is_set():
+        wait = CHECK_INTERVAL
+        if not _check_once():
+            wait = (_status['next_retry'] - datetime.now()).total_seconds()
+        _wake.wait(max(wait, 0))
+        _wake.clear()
+
+
+def start():
+    """ Start the worker if it is not running, or have a running one check for a due backup now. """
+    global _thread
+    with _thread_lock:
+        _stop.clear()
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_run, name='backup-scheduler', daemon=True)
+            _thread.start()
+        else:
+            _wake.set()
+
+
+def stop(timeout=None):
+    """ Ask the worker to exit after its current backup, and wait for it. """
+    _stop.set()
+    _wake.set()
+    if _thread is not None:
+        _thread.join(timeout)
+
+
+def wait_until_idle(timeout=None):
+    """
+    Wait until the worker has finished its current check.
+
+    Returns:
+    bool: True once idle, False if the timeout ran out first.
+    """
+    with _status_changed:
+        return _status_changed.wait_for(lambda: _status['state'] not in ('starting', 'running'), timeout)
+
+
+def get_status():
+    """
+    Return a snapshot of the scheduler's state.
+
+    Returns:
+    dict: state ('starting', 'running', 'idle', 'retrying' or 'not_configured'),
+    percent done while running, last_backup_date, last_snapshot taken this session,
+    failures in a row, last_error, next_retry time, and whether low_priority took effect.
+    """
+    with _status_changed:
+        return dict(_status)
+
+
+def status_text():
+    """ One line describing the backup state, for the welcome window. """
+    status = get_status()
+    if status['state'] == 'running':
+        return f"Backup in progress: {status['percent']}%"
+    if status['state'] == 'retrying':
+        return f"Backup failed: {status['last_error']}. Retrying at {status['next_retry']:%H:%M}."
+    if status['state'] == 'not_configured':
+        return 'Backups are not set up.'
+    if status['state'] == 'starting':
+        return 'Checking backups...'
+    if status['last_backup_date'] is None:
+        return 'No backup has been taken yet.'
+    return f"Last backup: {status['last_backup_date']:%Y-%m-%d}"
@@ -0,0 +1,602 @@
+"""
+Incremental, content-addressed backups.
+
+Each snapshot stores the database, and the audit archives next to it, as a list of
+fixed-size chunks. A chunk already in the store from an earlier snapshot is not
+written again, so a snapshot costs storage only for what changed since the last one.
+SQLite rewrites pages in place, so page-aligned chunks stay where they were and
+unchanged regions dedupe exactly.
+
+Pages are read from a db_backup.read_snapshot() copy, taken online with the backup API.
+Chunks are compressed and sealed with AES-GCM under the backup key, like the backup
+archives. A chunk is named by a keyed HMAC of its contents, and its nonce is taken
+from that name, so identical chunks still seal to identical files and dedupe.
+
+    <backup folder>/resident_snapshots/chunks/ab/abcdef...    chunk contents
+    <backup folder>/resident_snapshots/manifests/<id>.json    one per snapshot
+
+A manifest is written only after all of its chunks, so a snapshot either restores
+completely or does not exist. Each snapshot is also recorded in the backup_snapshots
+catalog table, with its sizes and checksums, so listing snapshots and picking the
+previous one never scans the folder. prune_snapshots() applies a retention policy
+and then deletes the chunks no remaining snapshot uses. Backups and pruning of one
+folder take a lock file, so two stations never interleave them.
+
+    python backup_snapshots.py list FOLDER [--scan]
+    python backup_snapshots.py restore FOLDER SNAPSHOT DESTINATION
+    python backup_snapshots.py prune FOLDER [--keep-daily N] [--keep-weekly N] [--keep-monthly N]
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import socket
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+import audit_archive
+import backup_archive
+import crypto_context
+import database_setup
+import db_backup
+import db_connection
+
+
+STORE_NAME = 'resident_snapshots'
+
+# 16 pages of 4 KiB; a multiple of the page size keeps chunks aligned with pages
+CHUNK_SIZE = 64 * 1024
+
+CHUNK_NONCE_SIZE = 12
+
+# Seconds to wait for another station's backup or prune of the same folder to finish
+LOCK_TIMEOUT = 60
+LOCK_RETRY_DELAY = 0.5
+# A lock older than this was left by a station that stopped mid-backup
+LOCK_STALE_SECONDS = 3600
+# Seconds between touches of a held lock, well inside LOCK_STALE_SECONDS
+LOCK_REFRESH_SECONDS = 60
+
+CATALOG_COLUMNS = ('snapshot_id', 'created', 'key_id', 'files', 'size', 'new_bytes', 'stored_bytes',
+                   'database_sha256', 'manifest_sha256')
+
+
+class SnapshotNotFoundError(LookupError):
+    pass
+
+
+class SnapshotCorruptError(RuntimeError):
+    """ A restored file does not match the checksum recorded in its manifest. """
+
+
+class StoreBusyError(RuntimeError):
+    """ Another station is backing up to, or pruning, the same folder. """
+
+
+def store_root(backup_folder):
+    return os.path.join(backup_folder, STORE_NAME)
+
+
+def chunk_path(root, digest):
+    return os.path.join(root, 'chunks', digest[:2], digest)
+
+
+def manifest_path(root, snapshot_id):
+    return os.path.join(root, 'manifests', f'{snapshot_id}.json')
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = path + '.partial'
+    with open(partial, 'wb') as f:
+        f.write(data)
+    os.replace(partial, path)
+
+
+def _lock_owner(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+@contextmanager
+def store_lock(root, timeout=LOCK_TIMEOUT):
+    """
+    Hold the store's lock file while writing or deleting chunks and manifests.
+
+    The lock file holds a token unique to this holder. A background thread touches it
+    every LOCK_REFRESH_SECONDS, so a long backup never looks abandoned, and it is
+    removed on release only if it still holds that token.
+    """
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, 'lock')
+    token = f'{socket.gethostname()} {os.getpid()} {os.urandom(8).hex()}'.encode()
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > LOCK_STALE_SECONDS:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue  # Released meanwhile
+            if time.monotonic() > deadline:
+                raise StoreBusyError(f'{root} is locked by another backup')
+            time.sleep(LOCK_RETRY_DELAY)
+    try:
+        os.write(fd, token)
+    finally:
+        os.close(fd)
+
+    stop = threading.Event()
+
+    def refresh():
+        while not stop.wait(LOCK_REFRESH_SECONDS):
+            if _lock_owner(path) != token:
+                return
+            try:
+                os.utime(path)
+            except OSError:
+                pass  # The share is unreachable; the backup itself fails on its next write
+
+    refresher = threading.Thread(target=refresh, name='snapshot-lock', daemon=True)
+    refresher.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        refresher.join()
+        if _lock_owner(path) == token:
+            os.remove(path)
+        else:
+            print(f'{path}: lock was taken over by another station; leaving it in place')
+
+
+def _backup_key(context):
+    return context.subkey(crypto_context.BACKUP_KEY_INFO)
+
+
+def chunk_name(key, data):
+    return hmac.new(key, data, hashlib.sha256).hexdigest()
+
+
+def seal_chunk(key, name, data):
+    """ Compress and encrypt one chunk, authenticating it against its name. """
+    digest = bytes.fromhex(name)
+    return AESGCM(key).encrypt(digest[:CHUNK_NONCE_SIZE], zlib.compress(data, backup_archive.COMPRESSION_LEVEL), digest)
+
+
+def open_chunk(key, name, sealed):
+    digest = bytes.fromhex(name)
+    try:
+        return zlib.decompress(AESGCM(key).decrypt(digest[:CHUNK_NONCE_SIZE], sealed, digest))
+    except InvalidTag:
+        raise SnapshotCorruptError(f'chunk {name} failed authentication')
+
+
+def store_stream(root, key, f, size, progress=None):
+    """
+    Split `size` bytes of a file into chunks and write the chunks the store does not have yet.
+
+    Returns:
+    dict: Manifest entry with size, sha256, chunks, new_chunks, new_bytes and stored_bytes.
+    """
+    entry = {'size': 0, 'sha256': None, 'chunks': [], 'new_chunks': 0, 'new_bytes': 0, 'stored_bytes': 0}
+    file_hash = hashlib.sha256()
+    start = time.perf_counter()
+    while entry['size'] < size:
+        data = f.read(min(CHUNK_SIZE, size - entry['size']))
+        if not data:
+            raise SnapshotCorruptError(f'file ended after {entry["size"]} of {size} bytes')
+        file_hash.update(data)
+        name = chunk_name(key, data)
+        target = chunk_path(root, name)
+        if not os.path.exists(target):
+            # Only new chunks pay for compression and encryption
+            sealed = seal_chunk(key, name, data)
+            _write_atomic(target, sealed)
+            entry['new_chunks'] += 1
+            entry['new_bytes'] += len(data)
+            entry['stored_bytes'] += len(sealed)
+        entry['chunks'].append(name)
+        entry['size'] += len(data)
+        if progress:
+            elapsed = time.perf_counter() - start
+            progress(entry['size'], size, entry['size'] / elapsed if elapsed else 0.0)
+    entry['sha256'] = file_hash.hexdigest()
+    return entry
+
+
+def list_snapshots(backup_folder):
+    """
+    Return the manifests in a backup folder, oldest first, by scanning the folder.
+
+    Use catalog_snapshots() instead unless the catalog is unavailable, e.g. when the
+    database itself is lost.
+
+    Returns:
+    list: Manifest dicts.
+    """
+    folder = os.path.join(store_root(backup_folder), 'manifests')
+    if not os.path.isdir(folder):
+        return []
+    manifests = []
+    for name in sorted(os.listdir(folder)):
+        if name.endswith('.json'):
+            with open(os.path.join(folder, name), encoding='utf-8') as f:
+                manifests.append(json.load(f))
+    return manifests
+
+
+def load_manifest(backup_folder, snapshot_id, expected_sha256=None):
+    """
+    Read a snapshot's manifest.
+
+    Args:
+    expected_sha256 (str): The manifest's checksum from the catalog, if known.
+
+    Raises:
+    SnapshotNotFoundError: If the manifest is missing.
+    SnapshotCorruptError: If it does not match `expected_sha256`.
+    """
+    path = manifest_path(store_root(backup_folder), snapshot_id)
+    if not os.path.exists(path):
+        raise SnapshotNotFoundError(f'No snapshot {snapshot_id} in {backup_folder}')
+    with open(path, 'rb') as f:
+        data = f.read()
+    if expected_sha256 is not None and hashlib.sha256(data).hexdigest() != expected_sha256:
+        raise SnapshotCorruptError(f'{snapshot_id}: manifest does not match its catalog checksum')
+    return json.loads(data)
+
+
+def _catalog_folder(backup_folder):
+    return os.path.abspath(backup_folder)
+
+
+def _catalog_row(backup_folder, manifest, manifest_bytes):
+    return (_catalog_folder(backup_folder), manifest['snapshot'], manifest['created'], manifest.get('key_id'),
+            len(manifest['files']), manifest['size'], manifest['new_bytes'], manifest.get('stored_bytes', manifest['new_bytes']),
+            manifest['files'][manifest['database']]['sha256'], hashlib.sha256(manifest_bytes).hexdigest())
+
+
+def _record_snapshots(conn, rows):
+    conn.executemany(f'''
+        INSERT OR REPLACE INTO backup_snapshots (backup_folder, {', '.join(CATALOG_COLUMNS)})
+        VALUES ({', '.join('?' * (len(CATALOG_COLUMNS) + 1))})
+    ''', rows)
+
+
+def catalog_snapshots(backup_folder):
+    """
+    Return the catalogued snapshots of a backup folder, oldest first.
+
+    Returns:
+    list: Dicts with snapshot_id, created, key_id, files, size, new_bytes, stored_bytes,
+    database_sha256 and manifest_sha256.
+    """
+    with db_connection.transaction() as conn:
+        rows = conn.execute(f'''
+            SELECT {', '.join(CATALOG_COLUMNS)} FROM backup_snapshots
+            WHERE backup_folder = ? ORDER BY snapshot_id
+        ''', (_catalog_folder(backup_folder),)).fetchall()
+    return [dict(zip(CATALOG_COLUMNS, row)) for row in rows]
+
+
+def catalog_entry(backup_folder, snapshot_id):
+    """ The catalog row of one snapshot, or None if it is not catalogued. """
+    with db_connection.transaction() as conn:
+        row = conn.execute(f'''
+            SELECT {', '.join(CATALOG_COLUMNS)} FROM backup_snapshots
+            WHERE backup_folder = ? AND snapshot_id = ?
+        ''', (_catalog_folder(backup_folder), snapshot_id)).fetchone()
+    return dict(zip(CATALOG_COLUMNS, row)) if row else None
+
+
+def _manifest_ids(root):
+    folder = os.path.join(root, 'manifests')
+    if not os.path.isdir(folder):
+        return set()
+    return {name[:-len('.json')] for name in os.listdir(folder) if name.endswith('.json')}
+
+
+def reconcile_catalog(backup_folder):
+    """
+    Bring a folder's catalog rows in line with the manifests on disk.
+
+    The catalog misses snapshots taken before it existed, snapshots newer than a
+    database restored from an older one, and those of another database sharing the
+    folder; they are added. Rows whose manifest is gone are dropped. This lists the
+    manifests folder but reads only the manifests missing from the catalog.
+
+    Returns:
+    list: The catalog rows, as catalog_snapshots() returns them.
+    """
+    root = store_root(backup_folder)
+    on_disk = _manifest_ids(root)
+    catalogued = {snapshot['snapshot_id'] for snapshot in catalog_snapshots(backup_folder)}
+    rows = []
+    for snapshot_id in sorted(on_disk - catalogued):
+        with open(manifest_path(root, snapshot_id), 'rb') as f:
+            data = f.read()
+        rows.append(_catalog_row(backup_folder, json.loads(data), data))
+    gone = catalogued - on_disk
+    if rows or gone:
+        with db_connection.transaction() as conn:
+            conn.executemany('DELETE FROM backup_snapshots WHERE backup_folder = ? AND snapshot_id = ?',
+                             [(_catalog_folder(backup_folder), snapshot_id) for snapshot_id in gone])
+            _record_snapshots(conn, rows)
+    return catalog_snapshots(backup_folder)
+
+
+def create_snapshot(backup_folder, database_path=None, context=None, progress=None):
+    """
+    Take an incremental snapshot of the database and its audit archives.
+
+    Each file is read under db_backup.read_snapshot(), so the snapshot is consistent
+    while other stations write. An audit archive whose size and modification time
+    match the previous snapshot, under the same key, reuses that snapshot's chunk
+    list without being read. The snapshot is recorded in the catalog.
+
+    Args:
+    progress (callable): Called as progress(bytes_done, total_bytes, bytes_per_second) while the database is read.
+
+    Returns:
+    dict: The manifest, including new_bytes, stored_bytes and seconds for this snapshot.
+    """
+    database_path = database_path or db_connection.DATABASE_PATH
+    context = context or crypto_context.get_context()
+    key = _backup_key(context)
+    root = store_root(backup_folder)
+    start = time.perf_counter()
+    with store_lock(root):
+        now = datetime.now()
+        snapshot_id = now.strftime('%Y%m%d_%H%M%S')
+        while os.path.exists(manifest_path(root, snapshot_id)):
+            snapshot_id += '_1'
+        catalog = catalog_snapshots(backup_folder) or reconcile_catalog(backup_folder)
+        previous_files = {}
+        if catalog and catalog[-1]['key_id'] == context.key_id:
+            try:
+                previous_files = load_manifest(backup_folder, catalog[-1]['snapshot_id'])['files']
+            except SnapshotNotFoundError:
+                pass  # Deleted by hand; read every file again
+
+        files = {}
+        sources = [(database_path, progress)] + [(path, None) for _, path in audit_archive.list_archives()]
+        for source, source_progress in sources:
+            name = os.path.basename(source)
+            stat = os.stat(source)
+            earlier = previous_files.get(name)
+            if source != database_path and earlier and earlier.get('mtime_ns') == stat.st_mtime_ns \
+                    and earlier.get('source_size') == stat.st_size:
+                files[name] = dict(earlier, new_chunks=0, new_bytes=0, stored_bytes=0)
+                continue
+            with db_backup.read_snapshot(source) as (f, page_size, page_count):
+                files[name] = store_stream(root, key, f, page_size * page_count, source_progress)
+            files[name].update(mtime_ns=stat.st_mtime_ns, source_size=stat.st_size)
+
+        manifest = {
+            'snapshot': snapshot_id,
+            'created': now.strftime('%Y-%m-%d %H:%M:%S'),
+            'database': os.path.basename(database_path),
+            'key_id': context.key_id,
+            'chunk_size': CHUNK_SIZE,
+            'files': files,
+            'size': sum(entry['size'] for entry in files.values()),
+            'new_bytes': sum(entry['new_bytes'] for entry in files.values()),
+            'stored_bytes': sum(entry['stored_bytes'] for entry in files.values()),
+            'seconds': round(time.perf_counter() - start, 3),
+        }
+        manifest_bytes = json.dumps(manifest, indent=1).encode('utf-8')
+        _write_atomic(manifest_path(root, snapshot_id), manifest_bytes)
+        with db_connection.transaction() as conn:
+            _record_snapshots(conn, [_catalog_row(backup_folder, manifest, manifest_bytes)])
+    return manifest
+
+
+def select_expired(snapshots, keep_daily=7, keep_weekly=4, keep_monthly=12):
+    """
+    Apply a retention policy to catalogued snapshots.
+
+    The newest snapshot of each of the last `keep_daily` days, `keep_weekly` ISO weeks
+    and `keep_monthly` months that have one is kept, and so is the newest snapshot.
+
+    Returns:
+    list: snapshot_ids of the snapshots to prune, newest first.
+    """
+    newest_first = sorted(snapshots, key=lambda snapshot: (snapshot['created'], snapshot['snapshot_id']), reverse=True)
+    keep = {snapshot['snapshot_id'] for snapshot in newest_first[:1]}
+    policy = [
+        (keep_daily, lambda created: created.date()),
+        (keep_weekly, lambda created: tuple(created.isocalendar())[:2]),
+        (keep_monthly, lambda created: (created.year, created.month)),
+    ]
+    for count, period_of in policy:
+        periods = set()
+        for snapshot in newest_first:
+            period = period_of(datetime.strptime(snapshot['created'], '%Y-%m-%d %H:%M:%S'))
+            if period in periods:
+                continue
+            if len(periods) >= count:
+                break
+            periods.add(period)
+            keep.add(snapshot['snapshot_id'])
+    return [snapshot['snapshot_id'] for snapshot in newest_first if snapshot['snapshot_id'] not in keep]
+
+
+def collect_garbage(root, referenced):
+    """
+    Delete every chunk not in `referenced`, and partial chunks left by interrupted backups.
+
+    Call it only under store_lock(), so no backup is adding chunks meanwhile.
+
+    Returns:
+    tuple: (chunks deleted, bytes freed).
+    """
+    deleted = freed = 0
+    chunks = os.path.join(root, 'chunks')
+    if not os.path.isdir(chunks):
+        return deleted, freed
+    for prefix in os.listdir(chunks):
+        folder = os.path.join(chunks, prefix)
+        for name in os.listdir(folder):
+            if name not in referenced:
+                path = os.path.join(folder, name)
+                freed += os.path.getsize(path)
+                os.remove(path)
+                deleted += 1
+    return deleted, freed
+
+
+def prune_snapshots(backup_folder, keep_daily=7, keep_weekly=4, keep_monthly=12):
+    """
+    Delete the snapshots a retention policy no longer keeps, then the chunks only they used.
+
+    The catalog is reconciled with the manifests first, so snapshots it does not know
+    about are judged by the same policy. Chunks are kept if any manifest left on disk
+    refers to them, whether or not the catalog lists it.
+
+    Returns:
+    dict: pruned snapshot ids, kept count, chunks deleted and bytes freed.
+    """
+    root = store_root(backup_folder)
+    result = {'pruned': [], 'kept': 0, 'chunks': 0, 'bytes': 0}
+    with store_lock(root):
+        catalog = reconcile_catalog(backup_folder)
+        expired = select_expired(catalog, keep_daily, keep_weekly, keep_monthly)
+        if not expired:
+            result['kept'] = len(catalog)
+            return result
+        # Drop the catalog rows first, so a snapshot is never listed without its manifest
+        with db_connection.transaction() as conn:
+            conn.executemany('DELETE FROM backup_snapshots WHERE backup_folder = ? AND snapshot_id = ?',
+                             [(_catalog_folder(backup_folder), snapshot_id) for snapshot_id in expired])
+        for snapshot_id in expired:
+            try:
+                os.remove(manifest_path(root, snapshot_id))
+            except FileNotFoundError:
+                pass
+
+        # A manifest that cannot be read raises here, before any chunk is deleted
+        referenced = set()
+        for snapshot_id in _manifest_ids(root):
+            for entry in load_manifest(backup_folder, snapshot_id)['files'].values():
+                referenced.update(entry['chunks'])
+            result['kept'] += 1
+        result['chunks'], result['bytes'] = collect_garbage(root, referenced)
+    result['pruned'] = expired
+    return result
+
+
+def restore_snapshot(backup_folder, snapshot_id, destination_folder, context=None, manifest_sha256=None):
+    """
+    Rebuild every file of a snapshot in `destination_folder`.
+
+    Each file is assembled next to its destination, checked against the manifest's
+    SHA-256 and with PRAGMA quick_check, then moved into place.
+
+    Args:
+    manifest_sha256 (str): The manifest's checksum from the catalog, if known.
+
+    Raises:
+    SnapshotCorruptError: If a chunk is missing or a rebuilt file does not match.
+
+    Returns:
+    list: Paths of the restored files, the database first.
+    """
+    manifest = load_manifest(backup_folder, snapshot_id, manifest_sha256)
+    # Snapshots taken before chunks were sealed have no key_id and store chunks as plain bytes
+    key = _backup_key(backup_archive.context_for_key(manifest['key_id'], context)) if 'key_id' in manifest else None
+    root = store_root(backup_folder)
+    os.makedirs(destination_folder, exist_ok=True)
+    names = [manifest['database']] + sorted(name for name in manifest['files'] if name != manifest['database'])
+    restored = []
+    for name in names:
+        entry = manifest['files'][name]
+        target = os.path.join(destination_folder, name)
+        partial = target + '.partial'
+        file_hash = hashlib.sha256()
+        try:
+            with open(partial, 'wb') as out:
+                for digest in entry['chunks']:
+                    try:
+                        with open(chunk_path(root, digest), 'rb') as f:
+                            data = open_chunk(key, digest, f.read()) if key else f.read()
+                    except FileNotFoundError:
+                        raise SnapshotCorruptError(f'{name}: chunk {digest} is missing from the store')
+                    file_hash.update(data)
+                    out.write(data)
+            if file_hash.hexdigest() != entry['sha256']:
+                raise SnapshotCorruptError(f'{name}: rebuilt file does not match the snapshot checksum')
+            db_backup.verify_backup(partial)
+            os.replace(partial, target)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        restored.append(target)
+    return restored
+
+
+def main():
+    parser = argparse.ArgumentParser(description='List, restore and prune incremental database snapshots.')
+    parser.add_argument('--database', default=db_connection.DATABASE_PATH,
+                        help='Database holding the snapshot catalog (default: %(default)s)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    list_command = commands.add_parser('list')
+    list_command.add_argument('folder', help='Backup folder')
+    list_command.add_argument('--scan', action='store_true', help='Read the manifests instead of the catalog, e.g. when the database is lost')
+    restore_command = commands.add_parser('restore')
+    restore_command.add_argument('folder', help='Backup folder')
+    restore_command.add_argument('snapshot', help='Snapshot id, as shown by list')
+    restore_command.add_argument('destination', help='Folder to rebuild the files in')
+    prune_command = commands.add_parser('prune')
+    prune_command.add_argument('folder', help='Backup folder')
+    prune_command.add_argument('--keep-daily', type=int, default=7, help='Daily snapshots to keep (default: %(default)s)')
+    prune_command.add_argument('--keep-weekly', type=int, default=4, help='Weekly snapshots to keep (default: %(default)s)')
+    prune_command.add_argument('--keep-monthly', type=int, default=12, help='Monthly snapshots to keep (default: %(default)s)')
+    args = parser.parse_args()
+
+    # A restore must work without the database, which may be what is being restored
+    has_catalog = os.path.exists(args.database) and not getattr(args, 'scan', False)
+    if has_catalog:
+        db_connection.set_database_path(args.database)
+        database_setup.initialize_database()
+
+    if args.command == 'list':
+        if has_catalog:
+            snapshots = catalog_snapshots(args.folder)
+        else:
+            snapshots = [dict(zip(CATALOG_COLUMNS, _catalog_row(args.folder, manifest, b'')[1:]))
+                         for manifest in list_snapshots(args.folder)]
+        for snapshot in snapshots:
+            print(f"{snapshot['snapshot_id']}  {snapshot['created']}  {snapshot['size'] / 1024 / 1024:8.1f} MB  "
+                  f"{snapshot['new_bytes'] / 1024 / 1024:8.1f} MB new, {snapshot['stored_bytes'] / 1024 / 1024:.1f} MB stored  "
+                  f"{snapshot['files']} files  database sha256 {snapshot['database_sha256'][:16]}")
+    elif args.command == 'restore':
+        entry = catalog_entry(args.folder, args.snapshot) if has_catalog else None
+        for path in restore_snapshot(args.folder, args.snapshot, args.destination,
+                                     manifest_sha256=entry['manifest_sha256'] if entry else None):
+            print(f'Restored {path}')
+    else:
+        if not has_catalog:
+            parser.error(f'{args.database} not found; pruning needs the snapshot catalog')
+        result = prune_snapshots(args.folder, args.keep_daily, args.keep_weekly, args.keep_monthly)
+        print(f"Pruned {len(result['pruned'])} snapshots, kept {result['kept']}, "
+              f"deleted {result['chunks']} chunks ({result['bytes'] / 1024 / 1024:.1f} MB)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,863 @@
+"""
+Benchmarks and stress tests for the resident management database layer.
+
+Each benchmark builds its own throwaway database, so they can be run on any
+workstation without touching resident_data.db:
+
+    python benchmarks.py --list
+    python benchmarks.py concurrency
+"""
+import argparse
+import datetime
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from cryptography.fernet import Fernet
+
+import audit_archive
+import audit_writer
+import backup_archive
+import backup_scheduler
+import backup_snapshots
+import crypto_context
+import db_backup
+import database_setup
+import db_connection
+
+
+@contextmanager
+def temporary_database(mode=None):
+    """ Create an initialized database in a temporary folder and point db_connection at it. """
+    folder = tempfile.mkdtemp(prefix='resident_bench_')
+    previous_path = db_connection.DATABASE_PATH
+    previous_mode = db_connection.CONCURRENCY_MODE
+    if mode:
+        db_connection.CONCURRENCY_MODE = mode
+    db_connection.set_database_path(os.path.join(folder, 'resident_data.db'))
+    try:
+        database_setup.initialize_database()
+        yield db_connection.DATABASE_PATH
+    finally:
+        audit_writer.flush()  # Queued audit entries belong to this database
+        db_connection.close_all_connections()
+        db_connection.CONCURRENCY_MODE = previous_mode
+        db_connection.set_database_path(previous_path)
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def timed(function, *args, repeat=1, **kwargs):
+    """ Return the best wall-clock time in seconds over `repeat` calls. """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _seed_stress_data(residents=20, medications_per_resident=10):
+    with db_connection.transaction() as conn:
+        for r in range(residents):
+            cursor = conn.execute('INSERT INTO residents (name, date_of_birth, level_of_care) VALUES (?, ?, ?)',
+                                  (f'Resident {r}', '', ''))
+            resident_id = cursor.lastrowid
+            conn.executemany('INSERT INTO medications (resident_id, medication_name, dosage, instructions) VALUES (?, ?, ?, ?)',
+                             [(resident_id, f'Medication {m}', '', '') for m in range(medications_per_resident)])
+
+
+def _stress_worker(db_path, mode, seconds, worker_index, results):
+    """ Mimic one nurse station: mostly chart reads with a steady stream of eMAR saves. """
+    db_connection.CONCURRENCY_MODE = mode
+    db_connection.set_database_path(db_path)
+    counts = {'reads': 0, 'writes': 0, 'lock_errors': 0}
+    time_slots = ['Morning', 'Noon', 'Evening', 'Night']
+    deadline = time.perf_counter() + seconds
+    operation = worker_index
+    while time.perf_counter() < deadline:
+        operation += 1
+        resident_name = f'Resident {operation % 20}'
+        try:
+            if operation % 4 == 0:
+                # Same shape as save_emar_data_from_management_window: look up ids, then upsert
+                with db_connection.transaction() as conn:
+                    for medication in range(10):
+                        resident_id = conn.execute('SELECT id FROM residents WHERE name = ?', (resident_name,)).fetchone()[0]
+                        medication_id = conn.execute('SELECT id FROM medications WHERE resident_id = ? AND medication_name = ?',
+                                                     (resident_id, f'Medication {medication}')).fetchone()[0]
+                        conn.execute('''
+                            INSERT INTO emar_chart (resident_id, medication_id, date, time_slot, administered)
+                            VALUES (?, ?, ?, ?, ?)
+                            ON CONFLICT(resident_id, medication_id, date, time_slot)
+                            DO UPDATE SET administered = excluded.administered
+                        ''', (resident_id, medication_id, f'2024-01-{operation % 28 + 1:02d}',
+                              time_slots[operation % 4], f'W{worker_index}'))
+                counts['writes'] += 1
+            else:
+                with db_connection.transaction() as conn:
+                    conn.execute('''
+                        SELECT m.medication_name, e.date, e.time_slot, e.administered
+                        FROM emar_chart e
+                        JOIN residents r ON e.resident_id = r.id
+                        JOIN medications m ON e.medication_id = m.id
+                        WHERE r.name = ? AND e.date >= ? AND e.date < ?
+                    ''', (resident_name, '2024-01-01', '2024-02-01')).fetchall()
+                counts['reads'] += 1
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e) and 'busy' not in str(e):
+                raise
+            counts['lock_errors'] += 1
+    db_connection.close_connection()
+    results.put(counts)
+
+
+def concurrency_stress(processes=4, seconds=5):
+    """ Compare throughput and lock-error rate of the rollback journal against WAL mode. """
+    for mode in ('rollback', 'wal'):
+        with temporary_database(mode) as db_path:
+            _seed_stress_data()
+            db_connection.close_all_connections()
+
+            context = multiprocessing.get_context('spawn')
+            results = context.Queue()
+            workers = [context.Process(target=_stress_worker, args=(db_path, mode, seconds, i, results))
+                       for i in range(processes)]
+            for worker in workers:
+                worker.start()
+            totals = {'reads': 0, 'writes': 0, 'lock_errors': 0}
+            for _ in workers:
+                for key, value in results.get().items():
+                    totals[key] += value
+            for worker in workers:
+                worker.join()
+
+        operations = totals['reads'] + totals['writes']
+        attempts = operations + totals['lock_errors']
+        error_rate = totals['lock_errors'] / attempts if attempts else 0
+        print(f"{mode:>8}: {operations / seconds:8.0f} ops/s  reads={totals['reads']} writes={totals['writes']} "
+              f"lock errors={totals['lock_errors']} ({error_rate:.2%})")
+
+
+def import_db_functions():
+    """ Import db_functions for a benchmark, injecting a throwaway key when no passphrase is configured. """
+    if not crypto_context.has_passphrase():
+        crypto_context.set_context(crypto_context.CryptoContext(key=Fernet.generate_key()))
+    import db_functions
+    return db_functions
+
+
+def _seed_emar_history(years, medications=10):
+    """ Chart every scheduled slot of every day for one resident, ending in December 2024. """
+    time_slots = ['Morning', 'Noon', 'Evening', 'Night']
+    with db_connection.transaction() as conn:
+        conn.execute("INSERT INTO residents (name, date_of_birth, level_of_care) VALUES ('Benchmark Resident', '', '')")
+        resident_id = conn.execute("SELECT id FROM residents WHERE name = 'Benchmark Resident'").fetchone()[0]
+        medication_ids = [conn.execute('INSERT INTO medications (resident_id, medication_name, dosage, instructions) VALUES (?, ?, ?, ?)',
+                                       (resident_id, f'Medication {m}', '', '')).lastrowid for m in range(medications)]
+        day = datetime.date(2025 - years, 1, 1)
+        rows = []
+        while day.year < 2025:
+            for medication_id in medication_ids:
+                rows.extend((resident_id, medication_id, day.isoformat(), slot, 'AB') for slot in time_slots)
+            day += datetime.timedelta(days=1)
+        conn.executemany('INSERT INTO emar_chart (resident_id, medication_id, date, time_slot, administered) VALUES (?, ?, ?, ?, ?)', rows)
+    return len(rows)
+
+
+def month_lookup(year_counts=(1, 2, 4, 8), repeat=20):
+    """ Time a monthly eMAR read with strftime() filtering against the month_window() range query. """
+    db_functions = import_db_functions()
+    strftime_sql = '''
+        SELECT m.medication_name, e.date, e.time_slot, e.administered
+        FROM emar_chart e
+        JOIN residents r ON e.resident_id = r.id
+        JOIN medications m ON e.medication_id = m.id
+        WHERE r.name = ? AND strftime('%Y-%m', e.date) = ?
+    '''
+    for years in year_counts:
+        with temporary_database():
+            rows = _seed_emar_history(years)
+            conn = db_connection.get_connection()
+            conn.execute('ANALYZE')
+            before = timed(lambda: conn.execute(strftime_sql, ('Benchmark Resident', '2024-06')).fetchall(), repeat=repeat)
+            after = timed(db_functions.fetch_emar_data_for_month, 'Benchmark Resident', '2024-06', repeat=repeat)
+        print(f'{years} year(s), {rows:>7} rows: strftime {before * 1000:8.2f} ms   month_window {after * 1000:6.2f} ms')
+
+
+def _adl_window_values(seed):
+    """ Build the widget values an ADL chart window returns for one month. """
+    db_functions = import_db_functions()
+    return {f'-{key}-{day}-': f'{(seed + day + i) % 3 or ""}' for i, key in enumerate(db_functions.ADL_KEYS) for day in range(1, 32)}
+
+
+def _legacy_adl_chart_save(resident_name, year_month, window_values):
+    """ save_adl_data_from_chart_window() before save_adl_rows(): one connection per call, one upsert per day. """
+    db_functions = import_db_functions()
+    with sqlite3.connect(db_connection.DATABASE_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT id FROM residents WHERE name = ?', (resident_name,))
+        result = cursor.fetchone()
+        resident_id = result[0] if result else None
+    with sqlite3.connect(db_connection.DATABASE_PATH) as conn:
+        cursor = conn.cursor()
+        for day in range(1, 32):
+            adl_data = [window_values[f'-{key}-{day}-'] for key in db_functions.ADL_KEYS]
+            cursor.execute(db_functions.ADL_UPSERT_SQL, (resident_id, f"{year_month}-{str(day).zfill(2)}", *adl_data))
+        conn.commit()
+
+
+def adl_monthly_save(residents=100):
+    """ Save a month of ADL charts, then save it again after editing one day: the previous chart save vs save_adl_rows(). """
+    db_functions = import_db_functions()
+    charts = [(f'Resident {r}', _adl_window_values(r)) for r in range(residents)]
+    # The usual second save: one cell changed on one day
+    edited = [(name, dict(values, **{'-breakfast-15-': 'X'})) for name, values in charts]
+
+    def run(save):
+        with temporary_database():
+            with db_connection.transaction() as conn:
+                conn.executemany('INSERT INTO residents (name, date_of_birth, level_of_care) VALUES (?, ?, ?)',
+                                 [(name, '', '') for name, _ in charts])
+            first = timed(lambda: [save(name, '2024-06', values) for name, values in charts])
+            again = timed(lambda: [save(name, '2024-06', values) for name, values in edited])
+        return first, again
+
+    legacy_first, legacy_again = run(_legacy_adl_chart_save)
+    bulk_first, bulk_again = run(db_functions.save_adl_data_from_chart_window)
+
+    print(f'{residents} residents x 31 days')
+    print(f'  first save   previous {legacy_first * 1000:8.1f} ms   save_adl_rows {bulk_first * 1000:8.1f} ms')
+    print(f'  one day edit previous {legacy_again * 1000:8.1f} ms   save_adl_rows {bulk_again * 1000:8.1f} ms')
+
+
+def _legacy_emar_chart_save(resident_name, year_month, window_values):
+    """ The previous save_emar_data_from_chart_window: every key scanned for every day, one cross-join upsert per cell. """
+    conn = sqlite3.connect(db_connection.DATABASE_PATH)
+    cursor = conn.cursor()
+    for day in range(1, 32):
+        date_str = f"{year_month}-{str(day).zfill(2)}"
+        for key, value in window_values.items():
+            if key.startswith('-') and key.endswith(f'-{day}-'):
+                parts = key.strip('-').split('_')
+                medication_name = '_'.join(parts[:-1])
+                time_slot = parts[-1].split('-')[0]
+                cursor.execute('''
+                    INSERT INTO emar_chart (resident_id, medication_id, date, admin_date, time_slot, administered)
+                    SELECT residents.id, medications.id, ?, ?, ?, ?
+                    FROM residents, medications
+                    WHERE residents.name = ? AND medications.medication_name = ?
+                    ON CONFLICT(resident_id, medication_id, date, time_slot) DO UPDATE SET
+                    administered = excluded.administered
+                ''', (date_str, date_str, time_slot, value, resident_name, medication_name))
+    conn.commit()
+    conn.close()
+
+
+def emar_chart_save(residents=50, medications=20, repeat=5):
+    """ Save a month of the eMAR chart for a resident with 20 scheduled medications: legacy loop against the bulk writer. """
+    db_functions = import_db_functions()
+    time_slots = ['Morning', 'Evening']
+    with temporary_database():
+        _seed_stress_data(residents, medications)
+        window_values = {}
+        for m in range(medications):
+            for slot in time_slots:
+                for day in range(1, 32):
+                    window_values[f'-Medication {m}_{slot}-{day}-'] = 'AB' if day % 2 else ''
+            # PRN cells and other widgets the chart window also returns
+            window_values.update({f'-PRN_Medication {m}-{day}-': '' for day in range(1, 32)})
+
+        legacy = timed(_legacy_emar_chart_save, 'Resident 0', '2024-05', window_values, repeat=repeat)
+        first_save = timed(db_functions.save_emar_data_from_chart_window, 'Resident 1', '2024-05', window_values)
+        cells = db_functions.save_emar_data_from_chart_window('Resident 2', '2024-05', window_values)
+        unchanged = timed(db_functions.save_emar_data_from_chart_window, 'Resident 2', '2024-05', window_values, repeat=repeat)
+
+    print(f'{medications} medications x {len(time_slots)} slots x 31 days, {residents} residents in the database')
+    print(f'  legacy per-cell upserts  {legacy * 1000:8.1f} ms')
+    print(f'  bulk writer, first save  {first_save * 1000:8.1f} ms  ({cells} cells written)')
+    print(f'  bulk writer, unchanged   {unchanged * 1000:8.1f} ms')
+
+
+def _legacy_emar_entries_save(entries):
+    """ The previous save_emar_data_from_management_window: two id lookups per entry before each upsert. """
+    db_functions = import_db_functions()
+    with db_connection.transaction() as conn:
+        cursor = conn.cursor()
+        for entry in entries:
+            cursor.execute("SELECT id FROM residents WHERE name = ?", (entry['resident_name'],))
+            resident_id = cursor.fetchone()[0]
+            cursor.execute("SELECT id FROM medications WHERE resident_id = ? AND medication_name = ?",
+                           (resident_id, entry['medication_name']))
+            medication_id = cursor.fetchone()[0]
+            cursor.execute(db_functions.EMAR_UPSERT_SQL, (resident_id, medication_id, entry['date'], entry['date'],
+                                                          entry['time_slot'], entry['administered']))
+
+
+def medication_pass_save(residents=100, medications=10, repeat=5):
+    """ Save a facility-wide medication pass for one time slot: per-entry id lookups against save_emar_entries(). """
+    db_functions = import_db_functions()
+    with temporary_database():
+        _seed_stress_data(residents, medications)
+        entries = [{'resident_name': f'Resident {r}', 'medication_name': f'Medication {m}', 'date': '2024-05-01',
+                    'time_slot': 'Morning', 'administered': 'AB'}
+                   for r in range(residents) for m in range(medications)]
+
+        legacy = timed(_legacy_emar_entries_save, entries, repeat=repeat)
+        batched = timed(db_functions.save_emar_entries, entries, repeat=repeat)
+
+    print(f'{residents} residents x {medications} medications, Morning pass ({len(entries)} entries)')
+    print(f'  per-entry lookups  {legacy * 1000:8.1f} ms')
+    print(f'  save_emar_entries  {batched * 1000:8.1f} ms')
+
+
+def medication_profile(medications=20, lookups=4, repeat=5):
+    """ Load a resident's medication profile the way one management window refresh does: uncached against the profile cache. """
+    db_functions = import_db_functions()
+    with temporary_database():
+        with db_connection.transaction() as conn:
+            conn.execute("INSERT INTO residents (name, date_of_birth, level_of_care) VALUES ('Resident 0', '', '')")
+        for m in range(medications):
+            medication_type = ('Scheduled', 'As Needed (PRN)', 'Controlled')[m % 3]
+            db_functions.insert_medication('Resident 0', f'Medication {m}', f'{m} mg', 'With food', medication_type,
+                                           ['Morning', 'Evening'], 'Pill', 30)
+
+        def refresh(cached):
+            for _ in range(lookups):
+                if not cached:
+                    db_functions.invalidate_medication_profile('Resident 0')
+                db_functions.fetch_medications_for_resident('Resident 0')
+
+        uncached = timed(refresh, False, repeat=repeat)
+        cached = timed(refresh, True, repeat=repeat)
+        stats = db_functions.get_medication_profile_stats()
+
+    print(f'{medications} medications, {lookups} profile lookups per refresh')
+    print(f'  uncached  {uncached * 1000:8.1f} ms')
+    print(f'  cached    {cached * 1000:8.1f} ms  (hit rate {stats["hit_rate"]:.0%})')
+
+
+def _time_in_fresh_interpreter(code, env):
+    """ Run `code` in a new Python process and return its own measurement in seconds. """
+    script = f"import time\nstart = time.perf_counter()\n{code}\nprint(time.perf_counter() - start)"
+    output = subprocess.run([sys.executable, '-c', script], env=env, check=True, capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    return float(output.stdout.split()[-1])
+
+
+def import_time(repeat=5):
+    """ Import db_functions in a fresh interpreter: import alone, first field decrypt with the KDF, and with an injected key. """
+    env = dict(os.environ, RESIDENT_MGMT_DB_KEY='benchmark-only-key')
+    token = crypto_context.CryptoContext(passphrase='benchmark-only-key').encrypt('benchmark')
+    injected_key = crypto_context.derive_key('benchmark-only-key').decode()
+    cases = [
+        ('import only', 'import db_functions'),
+        ('import + first decrypt (KDF)', f'import db_functions\ndb_functions.decrypt_data({token!r})'),
+        ('import + injected key decrypt', 'import crypto_context\n'
+                                          f'crypto_context.set_context(crypto_context.CryptoContext(key={injected_key!r}.encode()))\n'
+                                          f'import db_functions\ndb_functions.decrypt_data({token!r})'),
+    ]
+    for label, code in cases:
+        best = min(_time_in_fresh_interpreter(code, env) for _ in range(repeat))
+        print(f'  {label:<32}{best * 1000:8.1f} ms')
+
+
+def bulk_decrypt(row_counts=(1000, 10000, 100000)):
+    """ Decrypt an audit description column of 1k, 10k and 100k rows: one decrypt_data() per row against decrypt_column(). """
+    db_functions = import_db_functions()
+    context = crypto_context.get_context()
+    sample = [context.encrypt(f'Resident {i} ADL chart saved for 2024-05-{i % 28 + 1:02d}') for i in range(1000)]
+    print(f'{crypto_context.DECRYPT_WORKERS} decrypt worker(s)')
+    for rows in row_counts:
+        tokens = (sample * (rows // len(sample) + 1))[:rows]
+        per_row = timed(lambda: [context.decrypt(token, cache=False) for token in tokens])
+        serial = timed(context.decrypt_many, tokens, workers=1, cache=False)
+        pooled = timed(db_functions.decrypt_column, tokens, cache=False)
+        print(f'  {rows:>7} rows  per-row {per_row * 1000:8.1f} ms  bulk serial {serial * 1000:8.1f} ms  '
+              f'bulk pooled {pooled * 1000:8.1f} ms  ({rows / pooled:,.0f} rows/s)')
+
+
+def decrypt_cache(residents=50, medications=10, opens=3):
+    """ Reopen every resident's charts after a save: decrypts with and without the session decrypt cache. """
+    db_functions = import_db_functions()
+    with temporary_database():
+        for r in range(residents):
+            db_functions.insert_resident(f'Resident {r}', '1940-01-01', 'Assisted Living')
+            for m in range(medications):
+                db_functions.insert_medication(f'Resident {r}', f'Medication {m}', f'{m} mg', 'With food', 'Scheduled', ['Morning'])
+
+        def open_charts():
+            db_functions.get_resident_care_level()
+            for r in range(residents):
+                # A save on the chart drops the profile, so every open reloads it from the database
+                db_functions.invalidate_medication_profile(f'Resident {r}')
+                db_functions.fetch_medications_for_resident(f'Resident {r}')
+
+        cache = crypto_context.get_context().cache
+        max_bytes = cache.max_bytes
+        cache.max_bytes = 0  # Nothing fits, so every read decrypts
+        uncached = timed(open_charts, repeat=opens)
+        cache.max_bytes = max_bytes
+        db_functions.clear_session_caches()
+        cache.reset_stats()
+        first_open = timed(open_charts)
+        cached = timed(open_charts, repeat=opens)
+        stats = db_functions.get_decrypt_cache_stats()
+
+    print(f'{residents} residents x {medications} medications')
+    print(f'  without cache  {uncached * 1000:8.1f} ms')
+    print(f'  first open     {first_open * 1000:8.1f} ms')
+    print(f'  repeat opens   {cached * 1000:8.1f} ms  (hit rate {stats["hit_rate"]:.0%}, {stats["entries"]} entries, {stats["bytes"] / 1024:.0f} KiB)')
+
+
+def field_format(rows=20000):
+    """ Compare the Fernet token and compact AES-GCM field formats: stored bytes per row and encrypt/decrypt throughput. """
+    import_db_functions()
+    context = crypto_context.get_context()
+    # Typical residents and medications values: date_of_birth, level_of_care, dosage, instructions
+    samples = ['1940-01-01', 'Assisted Living', '10mg', 'Take one tablet by mouth with food twice daily']
+    values = (samples * (rows // len(samples) + 1))[:rows]
+    plain_bytes = sum(len(value.encode()) for value in values) / rows
+
+    for label, encrypt in (('fernet', context.encrypt_fernet), ('compact', context.encrypt_compact)):
+        start = time.perf_counter()
+        tokens = [encrypt(value) for value in values]
+        encrypt_time = time.perf_counter() - start
+        decrypt_time = timed(context.decrypt_many, tokens, workers=1, cache=False)
+        stored = sum(len(token) for token in tokens) / rows
+        print(f'  {label:<8} {stored:6.1f} bytes/field ({plain_bytes:.1f} plain)  '
+              f'encrypt {rows / encrypt_time:10,.0f}/s  decrypt {rows / decrypt_time:10,.0f}/s')
+
+
+def _synthetic_audit_year(residents=40, days=365):
+    """ Yield (username, action, description, timestamp) rows resembling a year of facility audit logs. """
+    adl_keys = ['first_shift_sp', 'second_shift_sp', 'first_shift_activity1', 'shower', 'shampoo', 'peri_care_am',
+                'peri_care_pm', 'oral_care_am', 'oral_care_pm', 'breakfast', 'lunch', 'dinner', 'snack_am', 'water_intake']
+    time_slots = ['Morning', 'Noon', 'Evening', 'Night']
+    start = datetime.date(2023, 1, 1)
+    for day in range(days):
+        date = (start + datetime.timedelta(days=day)).isoformat()
+        for shift, user in enumerate(('nurse1', 'nurse2', 'nurse3')):
+            yield user, 'Login', user, f'{date} {7 + shift * 8:02d}:00:00'
+            yield user, 'Logout', f'{user} logout', f'{date} {14 + shift * 8 - 24 * (shift == 2):02d}:59:00'
+        for r in range(residents):
+            changes = '; '.join(f"{key} changed from '' to '{'AB' if (r + day + i) % 5 else 'Self'}'"
+                                for i, key in enumerate(adl_keys[(r + day) % 4:]))
+            yield 'nurse1', f'ADL Data Saved Resident: Resident {r}', f'ADL Changes: {changes}', f'{date} 10:{r % 60:02d}:00'
+            given = '; '.join(f'Administered Medication {m} at {time_slots[(r + m) % 4]}: AB' for m in range(6))
+            yield 'nurse2', f'eMAR Data Saved Resident: Resident {r}', f'eMAR changes for Resident {r}: {given}', f'{date} 18:{r % 60:02d}:00'
+
+
+def audit_log_size(residents=40, days=365):
+    """ Database size of a synthetic year of audit logs: Fernet, compact AES-GCM, and compact with the audit payload codec. """
+    db_functions = import_db_functions()
+    context = crypto_context.get_context()
+    rows = list(_synthetic_audit_year(residents, days))
+    variants = [
+        ('fernet', context.encrypt_fernet),
+        ('compact', context.encrypt_compact),
+        ('compact + codec', audit_writer.encode_audit_payload),
+    ]
+    plain = sum(len(description.encode()) for _, _, description, _ in rows)
+    print(f'{len(rows):,} audit rows, {plain / 1024 / 1024:.1f} MB of plaintext descriptions')
+    baseline = None
+    for label, encode in variants:
+        with temporary_database() as db_path:
+            start = time.perf_counter()
+            with db_connection.transaction() as conn:
+                conn.executemany('INSERT INTO audit_logs (username, action, description, timestamp) VALUES (?, ?, ?, ?)',
+                                 [(user, action, encode(description), timestamp) for user, action, description, timestamp in rows])
+            elapsed = time.perf_counter() - start
+            db_connection.checkpoint('TRUNCATE')
+            db_connection.get_connection().execute('VACUUM')
+            size = os.path.getsize(db_path)
+        baseline = baseline or size
+        print(f'  {label:<16}{size / 1024 / 1024:8.1f} MB  ({size / baseline:5.0%} of fernet)  written in {elapsed:.1f} s')
+
+
+def _open_audit_viewer(db_functions, **filters):
+    pager = db_functions.AuditLogPager(**filters)
+    pager.first_page()
+    pager.close()  # Don't leave a prefetch running against the temporary database
+
+
+def _legacy_fetch_audit_logs(db_functions):
+    """ The audit viewer before paging: every log read and decrypted up front. """
+    conn = db_connection.get_connection()
+    logs = conn.execute('SELECT timestamp, username, action, description FROM audit_logs ORDER BY timestamp DESC').fetchall()
+    descriptions = db_functions.decrypt_column((log[3] for log in logs), cache=False)
+    return [{'date': log[0], 'username': log[1], 'action': log[2], 'description': description}
+            for log, description in zip(logs, descriptions)]
+
+
+def audit_viewer_open(day_counts=(30, 120, 365), repeat=5):
+    """ Open the audit log viewer: every matching log decrypted up front vs the first keyset page. """
+    db_functions = import_db_functions()
+    for days in day_counts:
+        with temporary_database():
+            rows = [(user, action, audit_writer.encode_audit_payload(description), timestamp)
+                    for user, action, description, timestamp in _synthetic_audit_year(days=days)]
+            with db_connection.transaction() as conn:
+                conn.executemany('INSERT INTO audit_logs (username, action, description, timestamp) VALUES (?, ?, ?, ?)', rows)
+            full = timed(_legacy_fetch_audit_logs, db_functions, repeat=repeat)
+            first_page = timed(_open_audit_viewer, db_functions, repeat=repeat)
+            filtered = timed(_open_audit_viewer, db_functions, username='NURSE2', repeat=repeat)
+        print(f'{len(rows):>7,} logs  all rows {full * 1000:8.1f} ms  first page {first_page * 1000:6.1f} ms'
+              f'  username prefix {filtered * 1000:6.1f} ms')
+
+
+def audit_archival(days=365, repeat=5):
+    """ Main database size, log inserts and viewer pages before and after archiving a year of audit logs. """
+    db_functions = import_db_functions()
+    with temporary_database() as db_path:
+        rows = [(user, action, audit_writer.encode_audit_payload(description), timestamp)
+                for user, action, description, timestamp in _synthetic_audit_year(days=days)]
+        with db_connection.transaction() as conn:
+            conn.executemany('INSERT INTO audit_logs (username, action, description, timestamp) VALUES (?, ?, ?, ?)', rows)
+        new_rows = rows[:200]
+
+        def measure():
+            db_connection.checkpoint('TRUNCATE')
+            size = os.path.getsize(db_path)
+            with db_connection.transaction() as conn:
+                start = time.perf_counter()
+                conn.executemany('INSERT INTO audit_logs (username, action, description, timestamp) VALUES (?, ?, ?, ?)', new_rows)
+                insert = time.perf_counter() - start
+                conn.rollback()
+            recent = timed(_open_audit_viewer, db_functions, repeat=repeat)
+            archived_day = timed(_open_audit_viewer, db_functions, date=rows[len(rows) // 2][3][:10], repeat=repeat)
+            return size, insert, recent, archived_day
+
+        results = [('before', measure())]
+        start = time.perf_counter()
+        moved = audit_archive.archive_closed_months()
+        elapsed = time.perf_counter() - start
+        db_connection.get_connection().execute('VACUUM')
+        results.append(('after', measure()))
+
+    print(f'{len(rows):,} logs, {len(moved)} months archived in {elapsed:.1f} s')
+    for label, (size, insert, recent, archived_day) in results:
+        print(f'  {label:<7} main db {size / 1024 / 1024:6.1f} MB  insert 200 {insert * 1000:6.1f} ms  '
+              f'first page {recent * 1000:5.1f} ms  archived day {archived_day * 1000:5.1f} ms')
+
+
+@contextmanager
+def _ui_stall_probe(interval=0.002):
+    """ Measure the longest gap a thread waking every `interval` seconds sees, like the UI event loop. """
+    result = {'max_gap': 0.0}
+    stop = threading.Event()
+
+    def probe():
+        last = time.perf_counter()
+        while not stop.is_set():
+            time.sleep(interval)
+            now = time.perf_counter()
+            result['max_gap'] = max(result['max_gap'], now - last - interval)
+            last = now
+
+    thread = threading.Thread(target=probe)
+    thread.start()
+    try:
+        yield result
+    finally:
+        stop.set()
+        thread.join()
+
+
+def database_backup(target_mb=64):
+    """ Back up a live database: checkpoint plus shutil.copyfile vs the online backup engine. """
+    with temporary_database() as db_path:
+        folder = os.path.dirname(db_path)
+        rows = [('nurse', 'Login', os.urandom(200), f'2024-01-01 00:00:{i % 60:02d}') for i in range(target_mb * 3000)]
+        with db_connection.transaction() as conn:
+            conn.executemany('INSERT INTO audit_logs (username, action, description, timestamp) VALUES (?, ?, ?, ?)', rows)
+        db_connection.checkpoint('TRUNCATE')
+        size = os.path.getsize(db_path)
+        print(f'{size / 1024 / 1024:.0f} MB database')
+
+        def copyfile():
+            db_connection.checkpoint('TRUNCATE')
+            shutil.copyfile(db_path, os.path.join(folder, 'copy.db'))
+
+        variants = [
+            ('copyfile', copyfile),
+            ('backup, 1 step', lambda: db_backup.backup_database(os.path.join(folder, 'one.db'), db_path, pages=-1)),
+            ('backup, 256 pages', lambda: db_backup.backup_database(os.path.join(folder, 'steps.db'), db_path)),
+        ]
+        for label, run in variants:
+            with _ui_stall_probe() as probe:
+                elapsed = timed(run)
+            print(f'  {label:<18}{elapsed * 1000:8.1f} ms  {size / 1024 / 1024 / elapsed:7.1f} MB/s  '
+                  f'longest UI stall {probe["max_gap"] * 1000:6.1f} ms')
+
+        # Another station writing during the backup restarts an incremental copy
+        stop = threading.Event()
+
+        def writer():
+            conn = sqlite3.connect(db_path, timeout=10)
+            while not stop.is_set():
+                with conn:
+                    conn.execute("INSERT INTO audit_logs (username, action) VALUES ('other', 'Login')")
+                time.sleep(0.01)
+            conn.close()
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            stats = db_backup.backup_database(os.path.join(folder, 'busy.db'), db_path)
+        finally:
+            stop.set()
+            thread.join()
+        print(f"  while writing      {stats['seconds'] * 1000:8.1f} ms  {stats['restarts']} restarts, verified: {stats['verified']}")
+
+
+def incremental_backup(sizes_mb=(16, 64), days=3):
+    """ Daily snapshots after a day's changes: bytes written and time vs a full copy, then a full restore. """
+    db_functions = import_db_functions()
+    for size_mb in sizes_mb:
+        with temporary_database() as db_path:
+            folder = os.path.dirname(db_path)
+            backup_folder = os.path.join(folder, 'backups')
+            rows = [('nurse', 'Login', os.urandom(200), f'2024-01-01 00:00:{i % 60:02d}') for i in range(size_mb * 3000)]
+            with db_connection.transaction() as conn:
+                conn.executemany('INSERT INTO audit_logs (username, action, description, timestamp) VALUES (?, ?, ?, ?)', rows)
+            for r in range(20):
+                db_functions.insert_resident(f'Resident {r}', '1940-01-01', 'Assisted Living')
+            db_connection.checkpoint('TRUNCATE')
+            first = backup_snapshots.create_snapshot(backup_folder, db_path)
+            full_copy = timed(db_backup.backup_database, os.path.join(folder, 'full.db'), db_path)
+            print(f'{first["size"] / 1024 / 1024:.0f} MB database: first snapshot {first["new_bytes"] / 1024 / 1024:.1f} MB '
+                  f'in {first["seconds"] * 1000:.0f} ms, full copy {full_copy * 1000:.0f} ms')
+            for day in range(days):
+                # A day's work: a few hundred audit entries and chart saves
+                for i in range(300):
+                    db_functions.log_action('nurse', 'ADL Data Saved', f'day {day} change {i}')
+                for r in range(20):
+                    db_functions.save_adl_data_from_management_window(f'Resident {r}', {'breakfast': 'AB', 'lunch': 'AB'})
+                db_functions.flush_audit_log(timeout=None)
+                manifest = backup_snapshots.create_snapshot(backup_folder, db_path)
+                print(f'  day {day + 1}: {manifest["new_bytes"] / 1024:8.0f} KiB new of {manifest["size"] / 1024 / 1024:.0f} MB '
+                      f'in {manifest["seconds"] * 1000:.0f} ms')
+            start = time.perf_counter()
+            restored = backup_snapshots.restore_snapshot(backup_folder, manifest['snapshot'], os.path.join(folder, 'restored'))
+            print(f'  restore {(time.perf_counter() - start) * 1000:.0f} ms, {len(restored)} files verified')
+
+
+def backup_archive_stream(days=365):
+    """ Compressed, encrypted backup archive of a year of audit logs: size, speed and peak memory vs a plain copy. """
+    with temporary_database() as db_path:
+        folder = os.path.dirname(db_path)
+        rows = [(user, action, audit_writer.encode_audit_payload(description), timestamp)
+                for user, action, description, timestamp in _synthetic_audit_year(days=days)]
+        with db_connection.transaction() as conn:
+            conn.executemany('INSERT INTO audit_logs (username, action, description, timestamp) VALUES (?, ?, ?, ?)', rows)
+        db_connection.checkpoint('TRUNCATE')
+        size = os.path.getsize(db_path)
+        archive = os.path.join(folder, 'backup.rmbk')
+
+        copy = db_backup.backup_database(os.path.join(folder, 'copy.db'), db_path)
+        tracemalloc.start()
+        written = backup_archive.write_archive(archive, db_path)
+        write_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        restored = backup_archive.restore_archive(archive, os.path.join(folder, 'restored.db'))
+        restore_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        print(f'{size / 1024 / 1024:.1f} MB database, {len(rows):,} audit rows')
+        print(f"  plain copy      {copy['mb_per_second']:7.1f} MB/s  {copy['bytes'] / 1024 / 1024:6.1f} MB written")
+        print(f"  archive write   {written['mb_per_second']:7.1f} MB/s  {written['archive_bytes'] / 1024 / 1024:6.1f} MB written  "
+              f"ratio {written['ratio']:.2f}  peak memory {write_peak / 1024 / 1024:.1f} MB")
+        print(f"  archive restore {restored['mb_per_second']:7.1f} MB/s  verified  peak memory {restore_peak / 1024 / 1024:.1f} MB")
+
+        # Another station writing while the archive is made: the snapshot still restores cleanly
+        stop = threading.Event()
+
+        def writer():
+            conn = sqlite3.connect(db_path, timeout=10)
+            while not stop.is_set():
+                with conn:
+                    conn.execute("INSERT INTO audit_logs (username, action) VALUES ('other', 'Login')")
+                time.sleep(0.01)
+            conn.close()
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            busy = backup_archive.write_archive(archive, db_path)
+        finally:
+            stop.set()
+            thread.join()
+        backup_archive.restore_archive(archive, os.path.join(folder, 'restored.db'))
+        print(f"  while writing   {busy['mb_per_second']:7.1f} MB/s  restored and verified")
+
+
+def startup_backup(target_mb=64):
+    """ Time until login can show when a backup is due: backing up on the main thread vs the backup scheduler. """
+    db_functions = import_db_functions()
+    with temporary_database() as db_path:
+        folder = os.path.dirname(db_path)
+        rows = [('nurse', 'Login', os.urandom(200), f'2024-01-01 00:00:{i % 60:02d}') for i in range(target_mb * 3000)]
+        with db_connection.transaction() as conn:
+            conn.executemany('INSERT INTO audit_logs (username, action, description, timestamp) VALUES (?, ?, ?, ?)', rows)
+        db_connection.checkpoint('TRUNCATE')
+        print(f'{os.path.getsize(db_path) / 1024 / 1024:.0f} MB database, first backup due')
+
+        db_functions.save_backup_configuration(os.path.join(folder, 'main_thread'), 'Daily')
+        with _ui_stall_probe() as probe:
+            start = time.perf_counter()
+            backup_scheduler.perform_backup(db_functions.get_backup_configuration())
+            blocked = time.perf_counter() - start
+        print(f'  main thread   login after {blocked * 1000:8.1f} ms  longest UI stall {probe["max_gap"] * 1000:6.1f} ms')
+
+        db_functions.save_backup_configuration(os.path.join(folder, 'scheduler'), 'Daily')
+        with db_connection.transaction() as conn:
+            conn.execute('UPDATE backup_config SET last_backup_date = NULL WHERE id = 1')
+        with _ui_stall_probe() as probe:
+            start = time.perf_counter()
+            backup_scheduler.start()
+            blocked = time.perf_counter() - start
+            backup_scheduler.wait_until_idle()
+            finished = time.perf_counter() - start
+        backup_scheduler.stop()  # Don't leave the worker checking the temporary database
+        status = backup_scheduler.get_status()
+        print(f'  scheduler     login after {blocked * 1000:8.1f} ms  longest UI stall {probe["max_gap"] * 1000:6.1f} ms  '
+              f'backup done after {finished * 1000:.0f} ms ({status["state"]}, low priority: {status["low_priority"]})')
+
+
+class _SimulatedClock(datetime.datetime):
+    """ A datetime whose now() the benchmark sets, so a year of daily snapshots takes seconds. """
+    current = None
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.current
+
+
+def _folder_bytes(folder):
+    return sum(os.path.getsize(os.path.join(path, name)) for path, _, names in os.walk(folder) for name in names)
+
+
+def backup_retention(days=400):
+    """ A year of daily snapshots with and without the retention policy: store size, pruning time and listing time. """
+    db_functions = import_db_functions()
+    with temporary_database() as db_path:
+        folder = os.path.dirname(db_path)
+        rows = [(user, action, audit_writer.encode_audit_payload(description), timestamp)
+                for user, action, description, timestamp in _synthetic_audit_year(days=30)]
+        with db_connection.transaction() as conn:
+            conn.executemany('INSERT INTO audit_logs (username, action, description, timestamp) VALUES (?, ?, ?, ?)', rows)
+        kept_all, pruned = os.path.join(folder, 'kept_all'), os.path.join(folder, 'pruned')
+
+        prune_seconds = []
+        backup_snapshots.datetime = _SimulatedClock
+        try:
+            for day in range(days):
+                _SimulatedClock.current = datetime.datetime(2025, 1, 1, 2) + datetime.timedelta(days=day)
+                for i in range(300):
+                    db_functions.log_action('nurse', 'ADL Data Saved', f'day {day} change {i}')
+                db_functions.flush_audit_log(timeout=None)
+                backup_snapshots.create_snapshot(kept_all, db_path)
+                backup_snapshots.create_snapshot(pruned, db_path)
+                start = time.perf_counter()
+                backup_snapshots.prune_snapshots(pruned)
+                prune_seconds.append(time.perf_counter() - start)
+        finally:
+            backup_snapshots.datetime = datetime.datetime
+
+        catalog = backup_snapshots.catalog_snapshots(pruned)
+        oldest = catalog[0]
+        restored = backup_snapshots.restore_snapshot(pruned, oldest['snapshot_id'], os.path.join(folder, 'restored'),
+                                                     manifest_sha256=oldest['manifest_sha256'])
+        print(f'{days} daily snapshots of a {os.path.getsize(db_path) / 1024 / 1024:.1f} MB database')
+        for label, backup_folder in (('keep all', kept_all), ('7/4/12', pruned)):
+            count = len(backup_snapshots.catalog_snapshots(backup_folder))
+            print(f'  {label:<9}{count:5} snapshots  {_folder_bytes(backup_folder) / 1024 / 1024:7.1f} MB on disk  '
+                  f'list from catalog {timed(backup_snapshots.catalog_snapshots, backup_folder, repeat=5) * 1000:6.1f} ms  '
+                  f'scanning manifests {timed(backup_snapshots.list_snapshots, backup_folder, repeat=5) * 1000:7.1f} ms')
+        print(f'  prune after each backup: avg {sum(prune_seconds) / len(prune_seconds) * 1000:.1f} ms, '
+              f'max {max(prune_seconds) * 1000:.1f} ms; oldest kept snapshot {oldest["created"]} restored ({len(restored)} files verified)')
+
+
+def _legacy_log_action(username, action, description):
+    with db_connection.transaction() as conn:
+        conn.execute('INSERT INTO audit_logs (username, action, description, timestamp) VALUES (?, ?, ?, ?)',
+                     (username, action, audit_writer.encode_audit_payload(description),
+                      datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+
+def audit_write(entries=2000):
+    """ Time spent by the caller logging actions: one commit per entry vs the background audit writer. """
+    db_functions = import_db_functions()
+    rows = [row[:3] for row, _ in zip(_synthetic_audit_year(), range(entries))]
+    with temporary_database():
+        start = time.perf_counter()
+        for row in rows:
+            _legacy_log_action(*row)
+        legacy = time.perf_counter() - start
+
+        audit_writer.reset_stats()
+        start = time.perf_counter()
+        for row in rows:
+            db_functions.log_action(*row)
+        queued = time.perf_counter() - start
+        db_functions.flush_audit_log(timeout=None)
+        flushed = time.perf_counter() - start
+        stats = audit_writer.get_stats()
+
+    print(f'{entries} audit entries')
+    print(f'  commit per entry   {legacy * 1000:8.1f} ms in the caller')
+    print(f'  audit writer       {queued * 1000:8.1f} ms in the caller, {flushed * 1000:.1f} ms until flushed')
+    print(f"    {stats['batches']} batches (avg {stats['avg_batch_ms']:.1f} ms), max queue depth {stats['max_queue_depth']}, "
+          f"latency avg {stats['avg_latency_ms']:.1f} ms / max {stats['max_latency_ms']:.1f} ms")
+
+
+BENCHMARKS = {
+    'concurrency': concurrency_stress,
+    'month_lookup': month_lookup,
+    'adl_monthly_save': adl_monthly_save,
+    'emar_chart_save': emar_chart_save,
+    'medication_pass_save': medication_pass_save,
+    'medication_profile': medication_profile,
+    'import_time': import_time,
+    'bulk_decrypt': bulk_decrypt,
+    'decrypt_cache': decrypt_cache,
+    'field_format': field_format,
+    'audit_log_size': audit_log_size,
+    'audit_viewer_open': audit_viewer_open,
+    'audit_write': audit_write,
+    'audit_archival': audit_archival,
+    'database_backup': database_backup,
+    'incremental_backup': incremental_backup,
+    'backup_archive_stream': backup_archive_stream,
+    'startup_backup': startup_backup,
+    'backup_retention': backup_retention,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run database benchmarks against throwaway databases.')
+    parser.add_argument('names', nargs='*', help='Benchmarks to run (default: all)')
+    parser.add_argument('--list', action='store_true', help='List the available benchmarks')
+    args = parser.parse_args()
+
+    if args.list:
+        for name, function in BENCHMARKS.items():
+            print(f'{name}: {function.__doc__.strip()}')
+        return
+
+    for name in args.names or BENCHMARKS:
+        print(f'== {name} ==')
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,402 @@
+import base64
+import hmac
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+
+# Environment variable holding the database passphrase
+PASSPHRASE_ENV_VAR = 'RESIDENT_MGMT_DB_KEY'
+# During a key rotation: the passphrase being retired, still tried for values not yet re-encrypted
+PREVIOUS_PASSPHRASE_ENV_VAR = 'RESIDENT_MGMT_DB_PREVIOUS_KEY'
+
+KDF_SALT = b'\x00' * 16  # Use a fixed salt; TO BE CHANGED TO BE RANDOM
+KDF_ITERATIONS = 100000
+
+# Compact field format, stored as a raw BLOB: one version byte, a 12 byte nonce, then the
+# AES-GCM ciphertext and 16 byte tag. Legacy Fernet tokens are stored as TEXT, so the
+# column type alone tells the two apart and both can be read side by side.
+COMPACT_FORMAT_VERSION = 1
+# Same layout, but the plaintext was zlib-compressed before encryption
+COMPACT_ZLIB_FORMAT_VERSION = 2
+COMPACT_NONCE_SIZE = 12
+COMPRESSION_LEVEL = 6
+COMPACT_KEY_INFO = b'resident-management field encryption v1'
+
+# Blind indexes: a truncated keyed HMAC of the normalized plaintext, stored next to an
+# encrypted column so equality filters can run in SQL without decrypting every row
+BLIND_INDEX_KEY_INFO = b'resident-management blind index v1'
+BLIND_INDEX_SIZE = 16
+
+# Backups are compressed and encrypted under their own key, expanded like the ones above
+BACKUP_KEY_INFO = b'resident-management backup v1'
+
+# Format used for newly written fields, selected with RESIDENT_MGMT_FIELD_FORMAT
+FIELD_FORMATS = ('compact', 'fernet')
+FIELD_FORMAT = os.environ.get('RESIDENT_MGMT_FIELD_FORMAT', 'compact').lower()
+if FIELD_FORMAT not in FIELD_FORMATS:
+    FIELD_FORMAT = 'compact'
+
+# Bulk decryption: columns shorter than PARALLEL_DECRYPT_MIN_ROWS are decrypted inline,
+# larger ones are split into DECRYPT_CHUNK_SIZE slices and spread over the thread pool
+PARALLEL_DECRYPT_MIN_ROWS = 2000
+DECRYPT_CHUNK_SIZE = 1000
+DECRYPT_WORKERS = os.cpu_count() or 1
+
+# Upper bound on the plaintext cache, counting token and plaintext characters per entry
+DECRYPT_CACHE_MAX_BYTES = 4 * 1024 * 1024
+DECRYPT_CACHE_ENTRY_OVERHEAD = 100  # Approximate dict, key and string object overhead
+
+
+class MissingPassphraseError(RuntimeError):
+    """ Raised when data has to be encrypted or decrypted but no passphrase or key is configured. """
+
+
+class UnknownFieldFormatError(ValueError):
+    """ Raised for a BLOB field whose header names a format version this code cannot read. """
+
+
+# Everything decrypt() raises for a value that is not readable with this context's key
+DECRYPT_ERRORS = (InvalidToken, InvalidTag, UnknownFieldFormatError)
+
+
+def is_compact(value):
+    """ Whether a stored field uses the compact BLOB format rather than a Fernet token. """
+    return isinstance(value, (bytes, bytearray, memoryview))
+
+
+def derive_key(passphrase, salt=KDF_SALT, iterations=KDF_ITERATIONS):
+    """
+    Derive the Fernet key for a passphrase with PBKDF2-SHA256.
+
+    Args:
+    passphrase (str or bytes): The database passphrase.
+
+    Returns:
+    bytes: The url-safe base64 encoded 32 byte key.
+    """
+    if isinstance(passphrase, str):
+        passphrase = passphrase.encode()
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        iterations=iterations,
+        backend=default_backend()
+    )
+    return base64.urlsafe_b64encode(kdf.derive(passphrase))
+
+
+def _expand_key(key_material, info):
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=info, backend=default_backend()).derive(key_material)
+
+
+class DecryptCache:
+    """
+    Least-recently-used map from ciphertext to plaintext with a size cap.
+
+    Holds decrypted PHI, so it lives for one login session and is wiped on logout.
+    """
+
+    def __init__(self, max_bytes=DECRYPT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    @staticmethod
+    def _cost(token, plaintext):
+        return len(token) + len(plaintext) + DECRYPT_CACHE_ENTRY_OVERHEAD
+
+    def get(self, token):
+        with self._lock:
+            plaintext = self._entries.get(token)
+            if plaintext is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(token)
+            self._stats['hits'] += 1
+            return plaintext
+
+    def put(self, token, plaintext):
+        cost = self._cost(token, plaintext)
+        if cost > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(token, None)
+            if previous is not None:
+                self._bytes -= self._cost(token, previous)
+            self._entries[token] = plaintext
+            self._bytes += cost
+            while self._bytes > self.max_bytes:
+                old_token, old_plaintext = self._entries.popitem(last=False)
+                self._bytes -= self._cost(old_token, old_plaintext)
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """
+        Returns:
+        dict: hits, misses, evictions, entries, bytes and hit_rate.
+        """
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries), bytes=self._bytes)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def reset_stats(self):
+        with self._lock:
+            for counter in self._stats:
+                self._stats[counter] = 0
+
+
+class CryptoContext:
+    """
+    Field encryption for one database key.
+
+    The key is derived from the passphrase on the first encrypt or decrypt and reused
+    afterwards. Pass `key` (an already derived Fernet key) to skip the KDF entirely.
+    Decrypted values are kept in a DecryptCache so repeated reads skip the crypto.
+
+    New values are written in `field_format`; both formats are always readable.
+    While a key rotation is in progress, `previous` is the context of the retired key
+    and is tried for values this key cannot decrypt.
+    """
+
+    def __init__(self, passphrase=None, key=None, cache_bytes=DECRYPT_CACHE_MAX_BYTES, field_format=None, previous=None):
+        self._passphrase = passphrase
+        self._key = key
+        self.previous = previous
+        self._fernet = None
+        self._aesgcm = None
+        self._blind_index_key = None
+        self.field_format = field_format or FIELD_FORMAT
+        self._lock = threading.Lock()
+        self.cache = DecryptCache(cache_bytes)
+
+    @property
+    def is_derived(self):
+        return self._fernet is not None
+
+    @property
+    def key_id(self):
+        """ A short, non-secret fingerprint of the key, to tell keys apart in logs and checkpoints. """
+        return self.blind_index('key id').hex()[:16]
+
+    @property
+    def key(self):
+        """ The Fernet key, derived now if it has not been yet. """
+        if self._fernet is None:
+            self._load()
+        return self._key
+
+    @property
+    def fernet(self):
+        if self._fernet is None:
+            self._load()
+        return self._fernet
+
+    @property
+    def aesgcm(self):
+        if self._fernet is None:
+            self._load()
+        return self._aesgcm
+
+    def _load(self):
+        with self._lock:
+            if self._fernet is not None:
+                return
+            if self._key is None:
+                if not self._passphrase:
+                    raise MissingPassphraseError(f'Set the {PASSPHRASE_ENV_VAR} environment variable to the database passphrase.')
+                self._key = derive_key(self._passphrase)
+            # The compact format and the blind indexes get their own keys, expanded from the Fernet key material
+            key_material = base64.urlsafe_b64decode(self._key)
+            self._aesgcm = AESGCM(_expand_key(key_material, COMPACT_KEY_INFO))
+            self._blind_index_key = _expand_key(key_material, BLIND_INDEX_KEY_INFO)
+            self._fernet = Fernet(self._key)
+
+    def subkey(self, info):
+        """ A 32 byte key for another purpose, expanded from this context's key with HKDF. """
+        return _expand_key(base64.urlsafe_b64decode(self.key), info)
+
+    def blind_index(self, value):
+        """
+        Return the blind index of a plaintext value, or None for a missing value.
+
+        Values are compared case-insensitively and with whitespace collapsed, so
+        'supervisory  care' finds 'Supervisory Care'.
+        """
+        if value is None:
+            return None
+        if self._fernet is None:
+            self._load()
+        normalized = ' '.join(value.split()).casefold().encode()
+        return hmac.new(self._blind_index_key, normalized, 'sha256').digest()[:BLIND_INDEX_SIZE]
+
+    def blind_index_candidates(self, value):
+        """ Blind indexes a stored value may carry: this key's, plus the retired key's during a rotation. """
+        candidates = [self.blind_index(value)]
+        if self.previous is not None:
+            candidates.append(self.previous.blind_index(value))
+        return candidates
+
+    def encrypt(self, data, compress_over=None):
+        """
+        Encrypt a field in this context's format.
+
+        Args:
+        data (str): The plaintext.
+        compress_over (int): Compress plaintexts longer than this many bytes first, when
+            that makes them smaller. Only the compact format records compression.
+        """
+        if self.field_format == 'compact':
+            return self.encrypt_compact(data, compress_over)
+        return self.encrypt_fernet(data)
+
+    def encrypt_fernet(self, data):
+        return self.fernet.encrypt(data.encode()).decode()
+
+    def encrypt_compact(self, data, compress_over=None):
+        payload = data.encode()
+        version = COMPACT_FORMAT_VERSION
+        if compress_over is not None and len(payload) > compress_over:
+            compressed = zlib.compress(payload, COMPRESSION_LEVEL)
+            if len(compressed) < len(payload):
+                payload, version = compressed, COMPACT_ZLIB_FORMAT_VERSION
+        header = bytes((version,))
+        nonce = os.urandom(COMPACT_NONCE_SIZE)
+        # The header is authenticated too, so a tampered version byte fails to decrypt
+        return header + nonce + self.aesgcm.encrypt(nonce, payload, header)
+
+    def _decrypt_value(self, data):
+        try:
+            return self.decrypt_own(data)
+        except DECRYPT_ERRORS:
+            if self.previous is None:
+                raise
+            return self.previous.decrypt_own(data)
+
+    def decrypt_own(self, data):
+        """ Decrypt with this context's key only, ignoring `previous`. """
+        if not is_compact(data):
+            return self.fernet.decrypt(data.encode()).decode()  # Decrypt and convert back to string
+        data = bytes(data)
+        if data[0] not in (COMPACT_FORMAT_VERSION, COMPACT_ZLIB_FORMAT_VERSION):
+            raise UnknownFieldFormatError(f'Unsupported field format version {data[0]}')
+        nonce = data[1:1 + COMPACT_NONCE_SIZE]
+        payload = self.aesgcm.decrypt(nonce, data[1 + COMPACT_NONCE_SIZE:], data[:1])
+        if data[0] == COMPACT_ZLIB_FORMAT_VERSION:
+            payload = zlib.decompress(payload)
+        return payload.decode()
+
+    def decrypt(self, data, cache=True):
+        if cache:
+            plaintext = self.cache.get(data)
+            if plaintext is not None:
+                return plaintext
+        plaintext = self._decrypt_value(data)
+        if cache:
+            self.cache.put(data, plaintext)
+        return plaintext
+
+    def _decrypt_chunk(self, tokens):
+        decrypt = self._decrypt_value
+        return [decrypt(token) if token else token for token in tokens]
+
+    def decrypt_many(self, tokens, workers=None, cache=True):
+        """
+        Decrypt a column of tokens, keeping their order.
+
+        Small columns are decrypted inline; large ones are decrypted in chunks across
+        a shared thread pool. None and empty values are passed through unchanged.
+
+        Args:
+        tokens (iterable): The encrypted values, e.g. one column of a query result.
+        workers (int): Threads to use, defaults to DECRYPT_WORKERS.
+        cache (bool): Serve and store values through the decrypt cache. Pass False for
+            one-off columns such as audit descriptions that would only evict useful entries.
+
+        Returns:
+        list: The decrypted strings in the same order as `tokens`.
+        """
+        tokens = list(tokens)
+        if not cache:
+            return self._decrypt_uncached(tokens, workers)
+
+        decrypted = [self.cache.get(token) if token else token for token in tokens]
+        missing = [i for i, plaintext in enumerate(decrypted) if plaintext is None and tokens[i]]
+        if missing:
+            for i, plaintext in zip(missing, self._decrypt_uncached([tokens[i] for i in missing], workers)):
+                decrypted[i] = plaintext
+                self.cache.put(tokens[i], plaintext)
+        return decrypted
+
+    def _decrypt_uncached(self, tokens, workers=None):
+        workers = workers or DECRYPT_WORKERS
+        self.fernet  # Derive the key once, before fanning out
+        if workers < 2 or len(tokens) < PARALLEL_DECRYPT_MIN_ROWS:
+            return self._decrypt_chunk(tokens)
+
+        chunks = [tokens[i:i + DECRYPT_CHUNK_SIZE] for i in range(0, len(tokens), DECRYPT_CHUNK_SIZE)]
+        decrypted = []
+        for chunk in _decrypt_pool(workers).map(self._decrypt_chunk, chunks):
+            decrypted.extend(chunk)
+        return decrypted
+
+
+_context = None
+_context_lock = threading.Lock()
+_pools = {}
+
+
+def _decrypt_pool(workers):
+    """ Return the shared decrypt thread pool with `workers` threads, starting it on first use. """
+    with _context_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = _pools[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='decrypt')
+    return pool
+
+
+def get_context():
+    """ Return the process-wide context, created from the environment on first use. """
+    global _context
+    if _context is None:
+        with _context_lock:
+            if _context is None:
+                previous_passphrase = os.environ.get(PREVIOUS_PASSPHRASE_ENV_VAR)
+                previous = CryptoContext(passphrase=previous_passphrase, cache_bytes=0) if previous_passphrase else None
+                _context = CryptoContext(passphrase=os.environ.get(PASSPHRASE_ENV_VAR), previous=previous)
+    return _context
+
+
+def set_context(context):
+    """ Replace the process-wide context, e.g. with CryptoContext(key=...) in batch jobs. """
+    global _context
+    with _context_lock:
+        _context = context
+
+
+def has_passphrase():
+    """ Whether encryption can work: a key was injected or the passphrase is set. """
+    context = _context
+    if context is not None and (context._key is not None or context._passphrase):
+        return True
+    return bool(os.environ.get(PASSPHRASE_ENV_VAR))
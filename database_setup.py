@@ -1,10 +1,189 @@
 import sqlite3
+import db_connection
+
+
+# Rows rewritten per transaction by chunked backfills
+BACKFILL_CHUNK_SIZE = 5000
+
+
+def add_column(conn, table, column, definition):
+    """ Add a column unless an earlier, interrupted run of the migration already did. """
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+    if column not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+def backfill_emar_admin_date_time(conn):
+    """
+    Split emar_chart.date into admin_date and admin_time.
+
+    Scheduled doses store 'YYYY-MM-DD'; PRN and controlled doses store 'YYYY-MM-DD HH:MM'.
+    Rows are walked in chart_id order one chunk per transaction, so the write lock is
+    held briefly and an interrupted run resumes with the rows still missing admin_date.
+    """
+    last_id = conn.execute('SELECT COALESCE(MAX(chart_id), 0) FROM emar_chart').fetchone()[0]
+    chunk_start = 0
+    while chunk_start < last_id:
+        chunk_end = chunk_start + BACKFILL_CHUNK_SIZE
+        conn.execute('''
+            UPDATE emar_chart
+            SET admin_date = substr(date, 1, 10),
+                admin_time = CASE WHEN length(date) > 10 THEN substr(date, 12, 5) END
+            WHERE chart_id > ? AND chart_id <= ? AND admin_date IS NULL AND date IS NOT NULL
+        ''', (chunk_start, chunk_end))
+        conn.commit()
+        conn.execute('BEGIN IMMEDIATE')
+        chunk_start = chunk_end
+
+
+KEY_ROTATION_PROGRESS_TABLE = '''CREATE TABLE IF NOT EXISTS key_rotation_progress (
+    table_name TEXT PRIMARY KEY,
+    key_id TEXT NOT NULL,
+    last_rowid INTEGER NOT NULL DEFAULT 0,
+    rows_done INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT)'''
+
+AUDIT_LOGS_TABLE = '''CREATE TABLE IF NOT EXISTS audit_logs (
+    log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT,
+    action TEXT,
+    description TEXT,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)'''
+
+# Pages are ordered by (timestamp, log_id); each filter gets an index in that order
+AUDIT_LOG_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_audit_logs_timestamp_id ON audit_logs(timestamp, log_id)',
+    'CREATE INDEX IF NOT EXISTS idx_audit_logs_username ON audit_logs(username COLLATE NOCASE, timestamp, log_id)',
+    'CREATE INDEX IF NOT EXISTS idx_audit_logs_action ON audit_logs(action, timestamp, log_id)',
+]
+
+# One row per snapshot in a backup folder, so listing and pruning never scan the folder.
+# database_sha256 is the restored database file's checksum; manifest_sha256 guards the manifest itself.
+BACKUP_SNAPSHOTS_TABLE = '''CREATE TABLE IF NOT EXISTS backup_snapshots (
+    backup_folder TEXT NOT NULL,
+    snapshot_id TEXT NOT NULL,
+    created TEXT NOT NULL,
+    key_id TEXT,
+    files INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    new_bytes INTEGER NOT NULL,
+    stored_bytes INTEGER NOT NULL,
+    database_sha256 TEXT NOT NULL,
+    manifest_sha256 TEXT NOT NULL,
+    PRIMARY KEY (backup_folder, snapshot_id))'''
+
+# Bump residents.medication_version on any change to a resident's medications, so every
+# station, including ones running an older build, tells cached profiles when they are stale
+_BUMP_MEDICATION_VERSION = 'UPDATE residents SET medication_version = medication_version + 1 WHERE id IN'
+MEDICATION_VERSION_TRIGGERS = [
+    f'''CREATE TRIGGER IF NOT EXISTS medications_version_insert AFTER INSERT ON medications
+        BEGIN {_BUMP_MEDICATION_VERSION} (NEW.resident_id); END''',
+    f'''CREATE TRIGGER IF NOT EXISTS medications_version_update AFTER UPDATE ON medications
+        BEGIN {_BUMP_MEDICATION_VERSION} (OLD.resident_id, NEW.resident_id); END''',
+    f'''CREATE TRIGGER IF NOT EXISTS medications_version_delete AFTER DELETE ON medications
+        BEGIN {_BUMP_MEDICATION_VERSION} (OLD.resident_id); END''',
+    f'''CREATE TRIGGER IF NOT EXISTS medication_time_slots_version_insert AFTER INSERT ON medication_time_slots
+        BEGIN {_BUMP_MEDICATION_VERSION} (SELECT resident_id FROM medications WHERE id = NEW.medication_id); END''',
+    f'''CREATE TRIGGER IF NOT EXISTS medication_time_slots_version_update AFTER UPDATE ON medication_time_slots
+        BEGIN {_BUMP_MEDICATION_VERSION} (SELECT resident_id FROM medications WHERE id IN (OLD.medication_id, NEW.medication_id)); END''',
+    f'''CREATE TRIGGER IF NOT EXISTS medication_time_slots_version_delete AFTER DELETE ON medication_time_slots
+        BEGIN {_BUMP_MEDICATION_VERSION} (SELECT resident_id FROM medications WHERE id = OLD.medication_id); END''',
+]
+
+
+# Versioned schema changes applied after the base tables exist. Each entry is
+# (version, description, steps); a step is a SQL statement or a callable taking the
+# connection. PRAGMA user_version records the last version applied to the file.
+MIGRATIONS = [
+    (1, 'Indexes for hot lookup columns', [
+        'CREATE INDEX IF NOT EXISTS idx_residents_name ON residents(name)',
+        'CREATE INDEX IF NOT EXISTS idx_medications_resident_name ON medications(resident_id, medication_name)',
+        'CREATE INDEX IF NOT EXISTS idx_emar_chart_resident_date ON emar_chart(resident_id, date)',
+        'CREATE INDEX IF NOT EXISTS idx_emar_chart_medication ON emar_chart(medication_id)',
+        'CREATE INDEX IF NOT EXISTS idx_non_med_admin_order_date ON non_med_order_administrations(order_id, administration_date)',
+        'CREATE INDEX IF NOT EXISTS idx_non_med_orders_resident_name ON non_medication_orders(resident_id, order_name)',
+        'CREATE INDEX IF NOT EXISTS idx_audit_logs_timestamp ON audit_logs(timestamp, username, action)',
+    ]),
+    (2, 'Separate administration date and time in emar_chart', [
+        lambda conn: add_column(conn, 'emar_chart', 'admin_date', 'TEXT'),
+        lambda conn: add_column(conn, 'emar_chart', 'admin_time', 'TEXT'),
+        backfill_emar_admin_date_time,
+        'CREATE INDEX IF NOT EXISTS idx_emar_chart_resident_admin_date ON emar_chart(resident_id, admin_date, admin_time)',
+        'DROP INDEX IF EXISTS idx_emar_chart_resident_date',
+        # Stations still running an older build only write date; derive the new columns for them
+        '''CREATE TRIGGER IF NOT EXISTS emar_chart_admin_date_default AFTER INSERT ON emar_chart
+           WHEN NEW.admin_date IS NULL AND NEW.date IS NOT NULL
+           BEGIN
+               UPDATE emar_chart
+               SET admin_date = substr(NEW.date, 1, 10),
+                   admin_time = CASE WHEN length(NEW.date) > 10 THEN substr(NEW.date, 12, 5) END
+               WHERE chart_id = NEW.chart_id;
+           END''',
+    ]),
+    (3, 'Blind indexes for equality searches on encrypted resident fields', [
+        # Filled by db_functions when the encryption key is available; see backfill_resident_blind_indexes()
+        lambda conn: add_column(conn, 'residents', 'date_of_birth_index', 'BLOB'),
+        lambda conn: add_column(conn, 'residents', 'level_of_care_index', 'BLOB'),
+        'CREATE INDEX IF NOT EXISTS idx_residents_date_of_birth_index ON residents(date_of_birth_index)',
+        'CREATE INDEX IF NOT EXISTS idx_residents_level_of_care_index ON residents(level_of_care_index)',
+    ]),
+    (4, 'Checkpoints for resumable key rotation', [
+        KEY_ROTATION_PROGRESS_TABLE,
+    ]),
+    (5, 'Indexes for keyset-paginated audit log pages', AUDIT_LOG_INDEXES + [
+        'DROP INDEX IF EXISTS idx_audit_logs_timestamp',
+    ]),
+    (6, 'Backup retention policy and snapshot catalog', [
+        # Snapshots kept: the newest of each of the last N days, ISO weeks and months
+        lambda conn: add_column(conn, 'backup_config', 'keep_daily', 'INTEGER NOT NULL DEFAULT 7'),
+        lambda conn: add_column(conn, 'backup_config', 'keep_weekly', 'INTEGER NOT NULL DEFAULT 4'),
+        lambda conn: add_column(conn, 'backup_config', 'keep_monthly', 'INTEGER NOT NULL DEFAULT 12'),
+        BACKUP_SNAPSHOTS_TABLE,
+    ]),
+    (7, 'Per-resident medication change counter for cached medication profiles', [
+        lambda conn: add_column(conn, 'residents', 'medication_version', 'INTEGER NOT NULL DEFAULT 0'),
+    ] + MEDICATION_VERSION_TRIGGERS),
+]
+
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate_database(conn):
+    """
+    Apply every migration newer than the database's recorded schema version.
+
+    Each migration runs in its own write transaction, so stations starting at the
+    same time apply it once and a failed migration leaves the previous version intact.
+    """
+    for version, description, steps in MIGRATIONS:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
 
 
 def initialize_database():
     # Connect to SQLite database
     # The database file will be 'resident_data.db'
-    conn = sqlite3.connect('resident_data.db')
+    conn = sqlite3.connect(db_connection.DATABASE_PATH)
+
+    # Switch the file to the shared concurrency mode (WAL by default); the journal
+    # mode is stored in the database so every station's connection inherits it
+    db_connection.apply_concurrency_mode(conn)
     c = conn.cursor()
 
     # Create Users Table
@@ -24,12 +203,7 @@ def initialize_database():
     last_backup_date TEXT)''')
 
     # Create audit_logs Table
-    c.execute('''CREATE TABLE IF NOT EXISTS audit_logs (
-        log_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT,
-        action TEXT,
-        description TEXT,
-        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+    c.execute(AUDIT_LOGS_TABLE)
 
     # Create table for user settings
     c.execute('''CREATE TABLE IF NOT EXISTS user_settings (
@@ -42,7 +216,9 @@ def initialize_database():
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT,
         date_of_birth TEXT,
-        level_of_care TEXT)''')
+        level_of_care TEXT,
+        date_of_birth_index BLOB,
+        level_of_care_index BLOB)''')
 
     # Create Time Slots table
     c.execute('''CREATE TABLE IF NOT EXISTS time_slots (
@@ -97,6 +273,8 @@ def initialize_database():
         administered TEXT,
         current_count INTEGER DEFAULT NULL,
         notes TEXT DEFAULT '',
+        admin_date TEXT,
+        admin_time TEXT,
         FOREIGN KEY(resident_id) REFERENCES residents(id),
         FOREIGN KEY(medication_id) REFERENCES medications(id),
         UNIQUE(resident_id, medication_id, date, time_slot))''')
@@ -145,4 +323,22 @@ def initialize_database():
                 UNIQUE(resident_id, date))''')
 
     conn.commit()
-    conn.close()
\ No newline at end of file
+
+    migrate_database(conn)
+    conn.close()
+
+
+def initialize_audit_archive(path):
+    """
+    Create a monthly audit archive file, or bring an existing one up to date.
+
+    Archives hold the audit_logs table with its page indexes, plus key rotation
+    checkpoints so rotate-key can re-encrypt them like the main database.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        for statement in [AUDIT_LOGS_TABLE] + AUDIT_LOG_INDEXES + [KEY_ROTATION_PROGRESS_TABLE]:
+            conn.execute(statement)
+        conn.commit()
+    finally:
+        conn.close()
@@ -0,0 +1,175 @@
+"""
+Online backups of the SQLite database.
+
+backup_database() copies a live database with SQLite's backup API. It reads through
+the WAL and never blocks writers on other stations. It copies a bounded number of
+pages per step and pauses between steps so the UI thread keeps running. The copy is
+written to a temporary file, checked, and only then moved into place, so a failed or
+interrupted backup never leaves a half-written file under the final name.
+
+read_snapshot() hands streaming writers (backup_archive, backup_snapshots) such a
+copy in a temporary folder, so they read a file no other station is writing to and
+hold no lock on the live database while they compress, encrypt or chunk it.
+"""
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+
+import db_connection
+
+
+# Seconds a backup connection waits for another station's lock
+CONCURRENCY_TIMEOUT = 10
+
+# Pages copied per backup step; 256 pages of 4 KiB is 1 MiB
+PAGES_PER_STEP = 256
+
+# Seconds to pause after each step, letting other threads run
+STEP_PAUSE = 0.001
+
+# A write from another connection restarts an incremental backup from the first page.
+# After this many restarts the backup falls back to copying everything in one step,
+# which reads from a single snapshot and cannot be restarted.
+MAX_RESTARTS = 3
+
+
+class BackupVerificationError(RuntimeError):
+    """ The finished copy failed its integrity check or does not match the source. """
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def verify_backup(path, expected_pages=None):
+    """
+    Check a backup file with PRAGMA quick_check.
+
+    Args:
+    expected_pages (int): Page count the copy must have, if known.
+
+    Raises:
+    BackupVerificationError: If the check fails or the page count differs.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute('PRAGMA quick_check').fetchone()[0]
+        page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+    finally:
+        conn.close()
+    if result != 'ok':
+        raise BackupVerificationError(f'{path}: integrity check failed: {result}')
+    if expected_pages is not None and page_count != expected_pages:
+        raise BackupVerificationError(f'{path}: {page_count} pages, expected {expected_pages}')
+
+
+def progress_printer(label, report=print, every=10):
+    """ Build a progress(done, total, bytes_per_second) callback that reports every `every` percent. """
+    reported = {'percent': -every}
+
+    def progress(done, total, bytes_per_second):
+        percent = done * 100 // total if total else 100
+        if percent - reported['percent'] >= every or done == total:
+            reported['percent'] = percent
+            report(f'{label}: {percent}% ({bytes_per_second / 1024 / 1024:.1f} MB/s)')
+    return progress
+
+
+def backup_database(destination, source=None, pages=PAGES_PER_STEP, pause=STEP_PAUSE, verify=True, progress=None):
+    """
+    Copy a live database to `destination`.
+
+    Args:
+    destination (str): Backup file to create; an existing file is replaced only once the new copy is verified.
+    source (str): Database to copy, defaults to db_connection.DATABASE_PATH.
+    pages (int): Pages copied per step, -1 to copy everything in one step.
+    pause (float): Seconds to sleep between steps.
+    verify (bool): Run verify_backup() on the copy before moving it into place.
+    progress (callable): Called as progress(pages_done, total_pages, bytes_per_second) after each step.
+
+    Returns:
+    dict: pages, bytes, restarts, seconds, mb_per_second and verified.
+    """
+    source = source or db_connection.DATABASE_PATH
+    partial = destination + '.partial'
+    stats = {'pages': 0, 'bytes': 0, 'restarts': 0, 'verified': False}
+    start = time.perf_counter()
+
+    src = sqlite3.connect(source, timeout=CONCURRENCY_TIMEOUT)
+    try:
+        page_size = src.execute('PRAGMA page_size').fetchone()[0]
+        last = {'remaining': None}
+
+        def on_step(status, remaining, total):
+            if last['remaining'] is not None and remaining > last['remaining']:
+                # Another connection wrote to the source and the copy started over
+                stats['restarts'] += 1
+                if stats['restarts'] > MAX_RESTARTS:
+                    raise _TooManyRestarts()
+            last['remaining'] = remaining
+            stats['pages'] = total
+            if progress:
+                elapsed = time.perf_counter() - start
+                progress(total - remaining, total, (total - remaining) * page_size / elapsed if elapsed else 0.0)
+            if pause and remaining:
+                time.sleep(pause)
+
+        def copy(step_pages):
+            if os.path.exists(partial):
+                os.remove(partial)
+            dst = sqlite3.connect(partial)
+            try:
+                src.backup(dst, pages=step_pages, progress=on_step)
+            finally:
+                dst.close()
+
+        try:
+            copy(pages)
+        except _TooManyRestarts:
+            copy(-1)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    finally:
+        src.close()
+
+    try:
+        if verify:
+            verify_backup(partial, stats['pages'])
+            stats['verified'] = True
+        os.replace(partial, destination)
+    except BaseException:
+        os.remove(partial)
+        raise
+
+    stats['seconds'] = time.perf_counter() - start
+    stats['bytes'] = os.path.getsize(destination)
+    stats['mb_per_second'] = stats['bytes'] / 1024 / 1024 / stats['seconds'] if stats['seconds'] else 0.0
+    return stats
+
+
+@contextmanager
+def read_snapshot(path=None):
+    """
+    Copy a live database with backup_database() into a temporary folder, and yield the copy for raw reads.
+
+    The copy is taken in page steps, so no lock is held on the live database while the
+    caller compresses, encrypts or chunks it, however long that takes.
+
+    Yields:
+    tuple: (open binary file, page_size, page_count). Read page_size * page_count bytes.
+    """
+    path = path or db_connection.DATABASE_PATH
+    with tempfile.TemporaryDirectory(prefix='resident-backup-') as folder:
+        copy = os.path.join(folder, os.path.basename(path))
+        stats = backup_database(copy, path)
+        conn = sqlite3.connect(copy)
+        try:
+            page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        finally:
+            conn.close()
+        with open(copy, 'rb') as f:
+            yield f, page_size, stats['pages']
@@ -0,0 +1,221 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+DATABASE_PATH = 'resident_data.db'
+
+# Number of prepared statements each connection keeps compiled
+STATEMENT_CACHE_SIZE = 256
+
+# Per-connection tuning applied once when a thread opens its connection
+PRAGMA_PROFILE = {
+    'cache_size': -16000,  # Negative value is in KiB, so roughly 16 MB of page cache
+    'temp_store': 'MEMORY',
+    'mmap_size': 64 * 1024 * 1024,
+}
+
+# Multi-workstation concurrency settings. 'wal' lets readers on other stations keep
+# working while one station writes; 'rollback' is the original SQLite default and is
+# still needed when the database lives on a network share, where WAL's shared memory
+# index cannot be used. Select with the RESIDENT_MGMT_DB_MODE environment variable.
+CONCURRENCY_MODES = {
+    'wal': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',  # Durable at checkpoint, safe against corruption in WAL mode
+        'busy_timeout': 10000,  # Milliseconds to wait for another station's lock
+        'wal_autocheckpoint': 1000,  # Pages written before an automatic passive checkpoint
+        'journal_size_limit': 64 * 1024 * 1024,  # Truncate the WAL back to this size after checkpoints
+        'begin': 'IMMEDIATE',  # Take the write lock up front instead of failing on upgrade
+    },
+    'rollback': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,
+        'wal_autocheckpoint': 1000,
+        'journal_size_limit': -1,
+        'begin': 'DEFERRED',
+    },
+}
+CONCURRENCY_MODE = os.environ.get('RESIDENT_MGMT_DB_MODE', 'wal').lower()
+if CONCURRENCY_MODE not in CONCURRENCY_MODES:
+    CONCURRENCY_MODE = 'wal'
+
+_local = threading.local()
+_stats_lock = threading.Lock()
+_connection_stats = {'opened': 0, 'reused': 0, 'closed': 0, 'transactions': 0}
+_open_connections = []
+_generation = 0
+
+
+def _apply_pragmas(conn, pragmas):
+    for name, value in pragmas.items():
+        conn.execute(f'PRAGMA {name} = {value}')
+
+
+def apply_concurrency_mode(conn, mode=None):
+    """
+    Apply a concurrency mode to an open connection.
+
+    Args:
+    conn (sqlite3.Connection): The connection to configure.
+    mode (str): A key of CONCURRENCY_MODES, defaults to CONCURRENCY_MODE.
+    """
+    settings = CONCURRENCY_MODES[mode or CONCURRENCY_MODE]
+    # busy_timeout first so switching the journal mode waits for other stations
+    _apply_pragmas(conn, {'busy_timeout': settings['busy_timeout']})
+    _apply_pragmas(conn, {
+        'journal_mode': settings['journal_mode'],
+        'synchronous': settings['synchronous'],
+        'wal_autocheckpoint': settings['wal_autocheckpoint'],
+        'journal_size_limit': settings['journal_size_limit'],
+    })
+    conn.isolation_level = settings['begin']
+
+
+def _count(counter):
+    with _stats_lock:
+        _connection_stats[counter] += 1
+
+
+def get_connection():
+    """
+    Return the calling thread's long-lived connection, opening and tuning it on first use.
+
+    Returns:
+    sqlite3.Connection: The connection owned by the current thread.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        if _local.generation == _generation:
+            _count('reused')
+            return conn
+        # Dropped by close_all_connections() on another thread, which could not close it
+        close_connection()
+
+    timeout = CONCURRENCY_MODES[CONCURRENCY_MODE]['busy_timeout'] / 1000
+    conn = sqlite3.connect(DATABASE_PATH, timeout=timeout, cached_statements=STATEMENT_CACHE_SIZE)
+    apply_concurrency_mode(conn)
+    _apply_pragmas(conn, PRAGMA_PROFILE)
+    _local.conn = conn
+    _local.depth = 0
+    _local.generation = _generation
+    with _stats_lock:
+        _connection_stats['opened'] += 1
+        _open_connections.append(conn)
+    return conn
+
+
+@contextmanager
+def transaction():
+    """
+    Scope a unit of work on the thread's connection.
+
+    The outermost scope commits on success and rolls back on error. Nested scopes
+    join the enclosing transaction, so helpers that open their own scope can be
+    called from inside a larger one without committing it early.
+    """
+    conn = get_connection()
+    if _local.depth > 0:
+        _local.depth += 1
+        try:
+            yield conn
+        finally:
+            _local.depth -= 1
+        return
+
+    _local.depth = 1
+    _count('transactions')
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        _local.depth = 0
+
+
+def close_connection():
+    """ Close the calling thread's connection, if it has one. """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        return
+    _local.conn = None
+    _local.depth = 0
+    with _stats_lock:
+        if conn in _open_connections:
+            _open_connections.remove(conn)
+            _connection_stats['closed'] += 1
+    conn.close()
+
+
+def checkpoint(mode='PASSIVE'):
+    """
+    Copy committed WAL content back into the main database file.
+
+    PASSIVE never blocks other stations; TRUNCATE waits for readers and then
+    empties the WAL, which is what backups and shutdown want.
+
+    Returns:
+    tuple: (busy, wal_pages, checkpointed_pages) as reported by SQLite.
+    """
+    conn = get_connection()
+    return conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+
+
+def close_all_connections():
+    """
+    Close every connection opened through this module, e.g. before replacing the database file.
+
+    SQLite only lets the owning thread close a connection. Those owned by other threads
+    stay counted as open until that thread's next get_connection() closes them, and no
+    thread reuses them after this call.
+
+    Returns:
+    int: The number of connections left for their own threads to close.
+    """
+    global _generation
+    with _stats_lock:
+        _generation += 1
+        connections = list(_open_connections)
+    deferred = 0
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.ProgrammingError:
+            deferred += 1
+            continue
+        with _stats_lock:
+            _open_connections.remove(conn)
+            _connection_stats['closed'] += 1
+    _local.conn = None
+    _local.depth = 0
+    return deferred
+
+
+def set_database_path(path):
+    """ Point new connections at a different database file and drop the current ones. """
+    global DATABASE_PATH
+    close_all_connections()
+    DATABASE_PATH = path
+
+
+def get_connection_stats():
+    """
+    Return a snapshot of the connection counters.
+
+    Returns:
+    dict: opened, reused, closed and transactions counts plus the number currently open.
+    """
+    with _stats_lock:
+        stats = dict(_connection_stats)
+        stats['open'] = len(_open_connections)
+    return stats
+
+
+def reset_connection_stats():
+    with _stats_lock:
+        for counter in _connection_stats:
+            _connection_stats[counter] = 0
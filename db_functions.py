@@ -1,19 +1,16 @@
-import sqlite3
 from datetime import datetime, timedelta
-import os
-import calendar
 import bcrypt
-from cryptography.fernet import Fernet
-import base64
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 import config
-import sys
-import PySimpleGUI as sg
+import audit_archive
+import audit_writer
+import crypto_context
+import db_connection
+import copy
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import string
 import secrets
-import pyperclip
 
 
 def generate_strong_passphrase(length=15):
@@ -22,77 +19,83 @@ def generate_strong_passphrase(length=15):
     return passphrase
 
 
-# Check if the environment variable exists
-passphrase_env_var = os.environ.get('RESIDENT_MGMT_DB_KEY')
-if passphrase_env_var:
-    passphrase = passphrase_env_var.encode()  # Proceed with encoding if exists
-else:
-    passphrase = generate_strong_passphrase()  # Generate a new passphrase if not found
-
-    detailed_instructions = (
-        f"Passphrase: {passphrase}\n\n"
-        "Setting the Environment Variable\n\n"
-        "For Windows:\n"
-        "1. Open the Start Search, type in 'env', and choose 'Edit the system environment variables'.\n"
-        "2. In the System Properties window, click on the 'Environment Variables…' button.\n"
-        "3. In the Environment Variables window, click 'New…' under the 'System variables' section.\n"
-        "4. Set the variable name as RESIDENT_MGMT_DB_KEY and paste the passphrase in the variable value. Click OK.\n\n"
-        "For macOS and Linux:\n"
-        "1. Open a terminal window.\n"
-        "2. Enter the following command, replacing <passphrase> with the actual passphrase:\n"
-        "   echo 'export RESIDENT_MGMT_DB_KEY=\"<passphrase>\"' >> ~/.bash_profile\n"
-        "3. For the change to take effect, you might need to reload the profile with source ~/.bash_profile or simply restart the terminal."
-    )
-
-    layout = [
-        [sg.Text("Passphrase not found. Please follow the instructions below to set it up.")],
-        [sg.Multiline(detailed_instructions, size=(80, 15), disabled=True)],
-        [sg.Button("Copy Passphrase")]
-    ]
-
-    window = sg.Window("Setup Passphrase", layout)
-
-    while True:
-        event, values = window.read()
-
-        if event == sg.WINDOW_CLOSED:
-            break
-        elif event == "Copy Passphrase":
-            pyperclip.copy(passphrase)
-            sg.popup("Passphrase copied to clipboard. Please follow the instructions to set it as an environment variable.", keep_on_top=True)
+def encrypt_data(data):
+    return crypto_context.get_context().encrypt(data)
 
-    window.close()
-    sys.exit()  # Exit after displaying the instructions
- 
+def decrypt_data(data):
+    return crypto_context.get_context().decrypt(data)
 
-if passphrase_env_var == None:
-    sg.popup(detailed_instructions)
-    sys.exit()
+def decrypt_column(tokens, cache=True):
+    """ Decrypt a list of tokens in bulk, keeping their order. """
+    return crypto_context.get_context().decrypt_many(tokens, cache=cache)
 
-salt = b'\x00'*16  # Use a fixed salt; TO BE CHANGED TO BE RANDOM
 
-# Generate a key from the passphrase
-kdf = PBKDF2HMAC(
-    algorithm=hashes.SHA256(),
-    length=32,
-    salt=salt,
-    iterations=100000,
-    backend=default_backend()
-)
-key = base64.urlsafe_b64encode(kdf.derive(passphrase))
-fernet = Fernet(key)
+def blind_index(value):
+    return crypto_context.get_context().blind_index(value)
 
+def blind_index_candidates(value):
+    return crypto_context.get_context().blind_index_candidates(value)
 
-def encrypt_data(data):
-    return fernet.encrypt(data.encode()).decode()
 
-def decrypt_data(data):
-    return fernet.decrypt(data.encode()).decode()  # Decrypt and convert back to string
+def get_decrypt_cache_stats():
+    return crypto_context.get_context().cache.stats()
+
+
+def clear_session_caches():
+    """ Wipe decrypted data held in memory for the logged in user; called on login and logout. """
+    crypto_context.get_context().cache.clear()
+    clear_medication_profiles()
+
+
+# 'YYYY-MM', also accepting a one-digit month as typed into the search fields
+YEAR_MONTH_PATTERN = re.compile(r'^(\d{4})-(\d{1,2})$')
+
+# A range no date falls in, for months that cannot be parsed
+EMPTY_MONTH_WINDOW = ('', '')
+
+
+def is_valid_year_month(year_month):
+    """ True if `year_month` is a 'YYYY-MM' string with a month from 1 to 12. """
+    match = YEAR_MONTH_PATTERN.match(year_month.strip()) if isinstance(year_month, str) else None
+    return match is not None and 1 <= int(match.group(2)) <= 12
+
+
+def month_window(year_month):
+    """
+    Turn a 'YYYY-MM' month into a half-open date range.
+
+    Comparing a date column with `>= start AND < end` keeps the column bare, so the
+    date indexes can be used, and it matches both 'YYYY-MM-DD' and 'YYYY-MM-DD HH:MM' values.
+    Free-text input that is not a valid month, such as blank search fields, gives an
+    empty range, so searches find no rows instead of raising.
+
+    Args:
+    year_month (str): The month in 'YYYY-MM' format.
+
+    Returns:
+    tuple: (first day of the month, first day of the following month) as 'YYYY-MM-DD' strings.
+    """
+    if not is_valid_year_month(year_month):
+        return EMPTY_MONTH_WINDOW
+    year, month = (int(part) for part in year_month.strip().split('-'))
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return f'{year:04d}-{month:02d}-01', f'{next_year:04d}-{next_month:02d}-01'
+
+
+def split_admin_datetime(value):
+    """
+    Split an eMAR 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM' value into the admin_date and admin_time columns.
+
+    Returns:
+    tuple: (admin_date, admin_time), with admin_time None for scheduled doses.
+    """
+    admin_date, _, admin_time = value.partition(' ')
+    return admin_date, admin_time or None
 
 
 def fetch_residents():
     """ Fetches a list of resident names from the database. """
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT name FROM residents')
         return [row[0] for row in cursor.fetchall()]
@@ -100,78 +103,207 @@ def fetch_residents():
 
 def get_resident_care_level():
     """Fetch and decrypt residents' care level from the database."""
-    decrypted_care_levels = {}
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT name, level_of_care FROM residents')
-        for name, encrypted_level_of_care in cursor.fetchall():
-            decrypted_level_of_care = decrypt_data(encrypted_level_of_care)  # Assuming decrypt_data is already defined
-            decrypted_care_levels[name] = decrypted_level_of_care
-    return decrypted_care_levels
+        rows = cursor.fetchall()
+    decrypted_care_levels = decrypt_column(level_of_care for _, level_of_care in rows)
+    return {name: level_of_care for (name, _), level_of_care in zip(rows, decrypted_care_levels)}
 
 
 def log_action(username, action, description):
     # Get current time in local timezone
     current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-    with sqlite3.connect('resident_data.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO audit_logs (username, action, description, timestamp)
-            VALUES (?, ?, ?, ?)
-        ''', (username, action, encrypt_data(description), current_time))
-        conn.commit()
+    # Encrypted and inserted by the background audit writer
+    audit_writer.submit(username, action, description, current_time)
 
 
-def fetch_audit_logs(last_10_days=False, username='', action='', date=''):
-    conn = sqlite3.connect('resident_data.db')
-    cursor = conn.cursor()
-    
-    # Start building the query
-    query = "SELECT timestamp, username, action, description FROM audit_logs WHERE 1=1"
-    params = []
-    
-    # Filter for the last 10 days
-    if last_10_days:
-        ten_days_ago = (datetime.now() - timedelta(days=10)).strftime('%Y-%m-%d')
-        query += " AND timestamp >= ?"
-        params.append(ten_days_ago)
-    
-    # Filter by username if provided
+def flush_audit_log(timeout=audit_writer.UI_FLUSH_TIMEOUT):
+    """
+    Wait until every logged action is in the database; used on logout and before reading the log.
+
+    Returns:
+    bool: False if the timeout ran out first; the entries stay queued and are written later.
+    """
+    return audit_writer.flush(timeout)
+
+
+AUDIT_PAGE_SIZE = 100
+
+# One background thread reads and decrypts the next audit page while the current one is shown
+_audit_prefetch_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='audit-prefetch')
+
+
+def prefix_upper_bound(prefix):
+    """ Smallest string greater than every string starting with `prefix`, for index range scans. """
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def audit_username_filter(conn, prefix, schema='main'):
+    """
+    Build the username condition for a case-insensitive prefix.
+
+    When the prefix names a single user the condition is an equality, which reads the
+    username index already in page order; otherwise it is a range on that index.
+
+    Args:
+    schema (str): 'main' or the schema an audit archive is attached under.
+
+    Returns:
+    tuple: (sql, params), or None when no logged username starts with `prefix`.
+    """
+    low, high = prefix.lower(), prefix_upper_bound(prefix.lower())
+    first = conn.execute(f'''
+        SELECT username FROM {schema}.audit_logs WHERE username >= ? COLLATE NOCASE AND username < ? COLLATE NOCASE
+        ORDER BY username COLLATE NOCASE LIMIT 1
+    ''', (low, high)).fetchone()
+    if first is None:
+        return None
+    other = conn.execute(f'''
+        SELECT 1 FROM {schema}.audit_logs WHERE username > ? COLLATE NOCASE AND username < ? COLLATE NOCASE LIMIT 1
+    ''', (first[0], high)).fetchone()
+    if other is None:
+        return " AND username = ? COLLATE NOCASE", [first[0]]
+    return " AND username >= ? COLLATE NOCASE AND username < ? COLLATE NOCASE", [low, high]
+
+
+def fetch_audit_rows(conn, schema, username, conditions, params, limit):
+    """ Run one audit page query against the main database or an attached archive. """
+    query = f"SELECT log_id, timestamp, username, action, description FROM {schema}.audit_logs WHERE 1=1"
+    # Served by the NOCASE username index; LIKE could not use it
     if username:
-        query += " AND username LIKE ?"
-        params.append(f"%{username}%")
-    
-    # Filter by action if provided
+        username_filter = audit_username_filter(conn, username, schema)
+        if username_filter is None:
+            return []
+        query += username_filter[0]
+        params = username_filter[1] + params
+    query += conditions + " ORDER BY timestamp DESC, log_id DESC LIMIT ?"
+    return conn.execute(query, params + [limit]).fetchall()
+
+
+def fetch_audit_log_page(before=None, page_size=AUDIT_PAGE_SIZE, username='', action='', date='', since=''):
+    """
+    Fetch one page of audit logs, newest first, decrypting only that page.
+
+    Pages are keyed on (timestamp, log_id) rather than OFFSET, so every page costs the
+    same however far back it is. Monthly audit archives are attached only when the
+    date range reaches into their month; without a date or since filter every archive
+    can be reached.
+
+    Args:
+    before (tuple): (timestamp, log_id) of the last row of the previous page, or None for the first page.
+    username (str): Case-insensitive username prefix.
+    date (str): A single day, 'YYYY-MM-DD'. Raises ValueError if it is not a valid date.
+    since (str): Only logs at or after this timestamp or date.
+
+    Returns:
+    tuple: (logs, next_before). next_before is None on the last page.
+    """
+    conn = db_connection.get_connection()
+    conditions = ""
+    params = []
+
     if action:
-        query += " AND action = ?"
+        conditions += " AND action = ?"
         params.append(action)
-    
-    # Filter by specific date if provided
+
     if date:
-        query += " AND DATE(timestamp) = ?"
-        params.append(date)
-    
-    # Add ORDER BY clause to sort by timestamp in descending order
-    query += " ORDER BY timestamp DESC"
+        next_day = (datetime.strptime(date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        conditions += " AND timestamp >= ? AND timestamp < ?"
+        params.extend([date, next_day])
+
+    if since:
+        conditions += " AND timestamp >= ?"
+        params.append(since)
+
+    if before:
+        conditions += " AND (timestamp, log_id) < (?, ?)"
+        params.extend(before)
+
+    # One extra row tells whether there is another page
+    limit = page_size + 1
+    rows = fetch_audit_rows(conn, 'main', username, conditions, params, limit)
+    # An archive_month() interrupted between its copy and its delete leaves rows in both
+    # places under the same log_id; the copy in main is the one shown
+    main_ids = {row[0] for row in rows}
+
+    # Archived months, newest first, stopping once the page is filled by newer rows
+    end = min(bound for bound in (date, before and before[0]) if bound) if date or before else None
+    for year_month, path in audit_archive.archives_for_range(date or since or None, end):
+        if len(rows) >= limit and rows[limit - 1][1] >= audit_archive.month_bounds(year_month)[1]:
+            break
+        audit_archive.attach_archive(conn, path)
+        try:
+            rows += [row for row in fetch_audit_rows(conn, audit_archive.ARCHIVE_SCHEMA, username, conditions, params, limit)
+                     if row[0] not in main_ids]
+        finally:
+            audit_archive.detach_archive(conn)
+        rows.sort(key=lambda row: (row[1], row[0]), reverse=True)
+
+    rows, has_more = rows[:page_size], len(rows) > page_size
+
+    descriptions = decrypt_column((row[4] for row in rows), cache=False)
+    logs = [{'log_id': row[0], 'date': row[1], 'username': row[2], 'action': row[3], 'description': description}
+            for row, description in zip(rows, descriptions)]
+    next_before = (rows[-1][1], rows[-1][0]) if has_more else None
+    return logs, next_before
 
-    # Execute the query with the filters applied
-    cursor.execute(query, params)
-    
-    # Fetch all matching records
-    logs = cursor.fetchall()
-    
-    # Close the database connection
-    conn.close()
-    
-    # Decrypt the description in each log entry
-    decrypted_logs = []
-    for log in logs:
-        decrypted_description = fernet.decrypt(log[3].encode()).decode()
-        decrypted_logs.append({'date': log[0], 'username': log[1], 'action': log[2], 'description': decrypted_description})
-    
-    
-    return decrypted_logs
+
+class AuditLogPager:
+    """
+    Walks audit log pages for the audit log viewer, prefetching the next page in the
+    background as soon as one is returned.
+
+    Filters are the keyword arguments of fetch_audit_log_page().
+    """
+
+    def __init__(self, page_size=AUDIT_PAGE_SIZE, **filters):
+        self.page_size = page_size
+        self.filters = filters
+        self.page_number = 0
+        self.has_next = False
+        self._page_starts = []  # `before` key of every page shown so far
+        self._next_before = None
+        self._prefetch = None  # (before, future)
+
+    def _fetch(self, before):
+        if self._prefetch and self._prefetch[0] == before:
+            logs, next_before = self._prefetch[1].result()
+        else:
+            logs, next_before = fetch_audit_log_page(before, self.page_size, **self.filters)
+        self._prefetch = None
+        self._next_before = next_before
+        self.has_next = next_before is not None
+        if self.has_next:
+            self._prefetch = (next_before, _audit_prefetch_pool.submit(
+                fetch_audit_log_page, next_before, self.page_size, **self.filters))
+        return logs
+
+    def first_page(self):
+        self._page_starts = [None]
+        self.page_number = 1
+        return self._fetch(None)
+
+    def next_page(self):
+        if not self.has_next:
+            return None
+        self._page_starts.append(self._next_before)
+        self.page_number += 1
+        return self._fetch(self._next_before)
+
+    def previous_page(self):
+        if self.page_number <= 1:
+            return None
+        self._page_starts.pop()
+        self.page_number -= 1
+        return self._fetch(self._page_starts[-1])
+
+    def close(self):
+        """ Drop the prefetched page, waiting for it if it is already being read. """
+        if self._prefetch and not self._prefetch[1].cancel():
+            self._prefetch[1].exception()
+        self._prefetch = None
 
 
 def validate_login(username, password):
@@ -185,7 +317,7 @@ def validate_login(username, password):
     Returns:
     bool: True if credentials are valid, otherwise False.
     """
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT password_hash FROM users WHERE username = ?', (username,))
         user = cursor.fetchone()
@@ -208,7 +340,7 @@ def needs_password_reset(username):
     Returns:
     bool: True if the user's password is temporary, otherwise False.
     """
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT is_temp_password FROM users WHERE username = ?', (username,))
         result = cursor.fetchone()
@@ -231,7 +363,7 @@ def update_user_password(username, new_password):
     hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
 
     # Connect to the SQLite database
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
 
         # Update the user's password and reset the is_temp_password flag
@@ -241,8 +373,6 @@ def update_user_password(username, new_password):
             WHERE username = ?
         ''', (hashed_password, username))
 
-        conn.commit()
-
 
 def update_user_password_and_initials(username, new_password, initials):
     """
@@ -254,18 +384,17 @@ def update_user_password_and_initials(username, new_password, initials):
     initials (str): The initials of the user.
     """
     hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             UPDATE users
             SET password_hash = ?, initials = ?, is_temp_password = 0
             WHERE username = ?
         ''', (hashed_password, initials, username))
-        conn.commit()
 
 
 def is_first_time_setup():
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT count(*) FROM users")
         user_count = cursor.fetchone()[0]
@@ -278,7 +407,7 @@ def create_admin_account(username, password, initials):
     hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
 
     # Connect to the SQLite database
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
 
         # Insert the new admin account into the users table with is_temp_password set to False
@@ -287,11 +416,16 @@ def create_admin_account(username, password, initials):
             VALUES (?, ?, ?, ?, ?)
         ''', (username, hashed_password, 'admin', initials, False))
 
-        conn.commit()
 
+def save_backup_configuration(backup_folder, backup_frequency, keep_daily=7, keep_weekly=4, keep_monthly=12):
+    """
+    Save the backup folder, frequency and retention policy.
 
-def save_backup_configuration(backup_folder, backup_frequency):
-    with sqlite3.connect('resident_data.db') as conn:
+    Args:
+    keep_daily, keep_weekly, keep_monthly (int): Snapshots to keep, the newest of each of
+        the last N days, ISO weeks and months. Older snapshots are pruned after each backup.
+    """
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         # Check if a row exists
         cursor.execute("SELECT id FROM backup_config WHERE id = 1")
@@ -301,28 +435,30 @@ def save_backup_configuration(backup_folder, backup_frequency):
             # Update if row exists
             cursor.execute('''
                 UPDATE backup_config
-                SET backup_folder = ?, backup_frequency = ?
+                SET backup_folder = ?, backup_frequency = ?, keep_daily = ?, keep_weekly = ?, keep_monthly = ?
                 WHERE id = 1
-            ''', (backup_folder, backup_frequency))
+            ''', (backup_folder, backup_frequency, keep_daily, keep_weekly, keep_monthly))
         else:
             # Insert if no row exists
             cursor.execute('''
-                INSERT INTO backup_config (id, backup_folder, backup_frequency)
-                VALUES (1, ?, ?)
-            ''', (backup_folder, backup_frequency))
-        
-        conn.commit()
+                INSERT INTO backup_config (id, backup_folder, backup_frequency, keep_daily, keep_weekly, keep_monthly)
+                VALUES (1, ?, ?, ?, ?, ?)
+            ''', (backup_folder, backup_frequency, keep_daily, keep_weekly, keep_monthly))
 
 
 def get_backup_configuration():
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT backup_folder, backup_frequency, last_backup_date FROM backup_config WHERE id = 1")
+        cursor.execute('''
+            SELECT backup_folder, backup_frequency, last_backup_date, keep_daily, keep_weekly, keep_monthly
+            FROM backup_config WHERE id = 1
+        ''')
         config = cursor.fetchone()
         if config:
-            # Parse the last_backup_date string to datetime.date
-            last_backup_date = datetime.strptime(config[2], "%Y-%m-%d").date()
-            return {'backup_folder': config[0], 'backup_frequency': config[1], 'last_backup_date': last_backup_date}
+            # Parse the last_backup_date string to datetime.date; NULL until the first backup
+            last_backup_date = datetime.strptime(config[2], "%Y-%m-%d").date() if config[2] else None
+            return {'backup_folder': config[0], 'backup_frequency': config[1], 'last_backup_date': last_backup_date,
+                    'keep_daily': config[3], 'keep_weekly': config[4], 'keep_monthly': config[5]}
         else:
             return None
 
@@ -330,10 +466,9 @@ def get_backup_configuration():
 def update_last_backup_date():
     # Update the last backup date in the backup configuration
     last_backup_date = datetime.now().strftime("%Y-%m-%d")
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         cursor.execute("UPDATE backup_config SET last_backup_date = ? WHERE id = 1", (last_backup_date,))
-        conn.commit()
 
 
 def is_username_exists(username):
@@ -346,7 +481,7 @@ def is_username_exists(username):
     Returns:
     bool: True if the username exists, False otherwise.
     """
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT COUNT(*) FROM users WHERE username = ?', (username,))
         count = cursor.fetchone()[0]
@@ -366,31 +501,26 @@ def create_user(username, password, role='User', is_temp_password=True, initials
     """
     hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
 
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         cursor.execute('INSERT INTO users (username, password_hash, role, is_temp_password, initials) VALUES (?, ?, ?, ?, ?)',
                        (username, hashed_password, role, is_temp_password, initials))
-        conn.commit()
 
 
 def get_all_usernames():
-    conn = sqlite3.connect('resident_data.db')
+    conn = db_connection.get_connection()
     c = conn.cursor()
     c.execute("SELECT username FROM users")
     usernames = [row[0] for row in c.fetchall()]
-    conn.close()
     return usernames
 
 
 def remove_user(username):
-    conn = sqlite3.connect('resident_data.db')
-    c = conn.cursor() 
-
-    # Delete the user from the users table
-    c.execute("DELETE FROM users WHERE username = ?", (username,))
+    with db_connection.transaction() as conn:
+        c = conn.cursor()
 
-    conn.commit()
-    conn.close()
+        # Delete the user from the users table
+        c.execute("DELETE FROM users WHERE username = ?", (username,))
 
 
 def is_admin(username):
@@ -403,7 +533,7 @@ def is_admin(username):
     Returns:
     bool: True if the user is an admin, False otherwise.
     """
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
 
         # Fetch the role of the user
@@ -426,7 +556,7 @@ def get_user_initials(username):
     Returns:
     str: The initials of the user or None if not found.
     """
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT initials FROM users WHERE username = ?", (username,))
         result = cursor.fetchone()
@@ -437,7 +567,7 @@ def get_user_initials(username):
 
 
 def get_user_theme():
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT setting_value FROM user_settings WHERE setting_name = 'theme'")
         result = cursor.fetchone()
@@ -446,7 +576,7 @@ def get_user_theme():
 
 # Function to save theme choice
 def save_user_theme_choice(theme):
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         # Check if the theme setting already exists
         cursor.execute('SELECT COUNT(*) FROM user_settings WHERE setting_name = "theme"')
@@ -459,11 +589,9 @@ def save_user_theme_choice(theme):
             # Insert a new theme setting
             cursor.execute('INSERT INTO user_settings (setting_name, setting_value) VALUES ("theme", ?)', (theme,))
 
-        conn.commit()
-
 
 def get_user_font():
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         # Query to select the font setting from the database
         cursor.execute("SELECT setting_value FROM user_settings WHERE setting_name = 'font'")
@@ -473,7 +601,7 @@ def get_user_font():
 
 
 def save_user_font_choice(font):
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         # Check if the font setting already exists
         cursor.execute('SELECT COUNT(*) FROM user_settings WHERE setting_name = "font"')
@@ -486,19 +614,17 @@ def save_user_font_choice(font):
             # Insert a new font setting
             cursor.execute('INSERT INTO user_settings (setting_name, setting_value) VALUES ("font", ?)', (font,))
 
-        conn.commit()
-
 
 def get_resident_count():
     """ Return the number of residents in the database. """
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT COUNT(*) FROM residents')
         return cursor.fetchone()[0]
 
 
 def get_resident_names():
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT name FROM residents')
         residents = cursor.fetchall()
@@ -512,16 +638,98 @@ def insert_resident(name, date_of_birth, level_of_care):
     encrypted_dob = encrypt_data(date_of_birth)  # Assuming encrypt_data is already defined
     encrypted_level_of_care = encrypt_data(level_of_care)
 
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO residents (name, date_of_birth, level_of_care, date_of_birth_index, level_of_care_index)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (name, encrypted_dob, encrypted_level_of_care, blind_index(date_of_birth), blind_index(level_of_care)))
+
+
+# Blind index column kept next to each searchable encrypted residents column
+RESIDENT_BLIND_INDEXES = {'date_of_birth': 'date_of_birth_index', 'level_of_care': 'level_of_care_index'}
+
+
+def backfill_resident_blind_indexes():
+    """
+    Fill in blind indexes for residents written before they existed or by an older build.
+
+    Runs on each successful login from login_window(), not on every search, so read
+    paths never take the write lock. Values that cannot be decrypted get an empty index, so they are
+    not retried on every login.
+
+    Returns:
+    int: The number of residents updated.
+    """
+    with db_connection.transaction() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, date_of_birth, level_of_care FROM residents
+            WHERE date_of_birth_index IS NULL OR level_of_care_index IS NULL
+        ''')
+        rows = cursor.fetchall()
+        updates = []
+        for resident_id, date_of_birth, level_of_care in rows:
+            indexes = []
+            for value in (date_of_birth, level_of_care):
+                try:
+                    indexes.append(blind_index(decrypt_data(value)) if value else b'')
+                except crypto_context.DECRYPT_ERRORS:
+                    indexes.append(b'')
+            updates.append((*indexes, resident_id))
+        if not updates:
+            # An UPDATE would begin a write transaction even with nothing to write
+            return 0
+        cursor.executemany('UPDATE residents SET date_of_birth_index = ?, level_of_care_index = ? WHERE id = ?', updates)
+    return len(updates)
+
+
+def find_residents(date_of_birth=None, level_of_care=None):
+    """
+    Find residents by exact date of birth and/or level of care without decrypting the whole table.
+
+    The filters run against the blind index columns; only the matching rows are decrypted.
+
+    Returns:
+    list: Dicts with name, date_of_birth and level_of_care, ordered by name.
+    """
+    filters = {'date_of_birth': date_of_birth, 'level_of_care': level_of_care}
+    query = "SELECT name, date_of_birth, level_of_care FROM residents WHERE 1=1"
+    params = []
+    for field, value in filters.items():
+        if value is not None:
+            candidates = blind_index_candidates(value)
+            query += f" AND {RESIDENT_BLIND_INDEXES[field]} IN ({', '.join('?' * len(candidates))})"
+            params.extend(candidates)
+    query += " ORDER BY name"
+
+    with db_connection.transaction() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+
+    residents = []
+    for name, encrypted_dob, encrypted_level_of_care in rows:
+        resident = {'name': name, 'date_of_birth': decrypt_data(encrypted_dob), 'level_of_care': decrypt_data(encrypted_level_of_care)}
+        # A truncated HMAC can in theory collide, so confirm on the decrypted value
+        if all(value is None or blind_index(resident[field]) == blind_index(value) for field, value in filters.items()):
+            residents.append(resident)
+    return residents
+
+
+def resident_has_care_level(resident_name, level_of_care):
+    """ Check a resident's level of care through its blind index, without decrypting it. """
+    candidates = blind_index_candidates(level_of_care)
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
-        cursor.execute('INSERT INTO residents (name, date_of_birth, level_of_care) VALUES (?, ?, ?)', 
-                       (name, encrypted_dob, encrypted_level_of_care))
-        conn.commit()
+        cursor.execute(f"SELECT 1 FROM residents WHERE name = ? AND level_of_care_index IN ({', '.join('?' * len(candidates))})",
+                       (resident_name, *candidates))
+        return cursor.fetchone() is not None
 
 
 def fetch_resident_information(resident_name):
     """Fetch and decrypt a resident's information from the database."""
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT name, date_of_birth FROM residents WHERE name = ?", (resident_name,))
         result = cursor.fetchone()
@@ -534,89 +742,157 @@ def fetch_resident_information(resident_name):
 
 
 def update_resident_info(old_name, new_name, new_dob):
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
-        cursor.execute("UPDATE residents SET name = ?, date_of_birth = ? WHERE name = ?", (new_name, new_dob, old_name))
-        conn.commit()
+        cursor.execute("UPDATE residents SET name = ?, date_of_birth = ?, date_of_birth_index = ? WHERE name = ?",
+                       (new_name, encrypt_data(new_dob), blind_index(new_dob), old_name))
+    invalidate_medication_profile(old_name)
 
 
 def remove_resident(resident_name):
     """ Removes a resident from the database. """
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         cursor.execute('DELETE FROM residents WHERE name = ?', (resident_name,))
-        conn.commit()
+    invalidate_medication_profile(resident_name)
 
 
 def get_resident_id(resident_name):
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT id FROM residents WHERE name = ?', (resident_name,))
         result = cursor.fetchone()
         return result[0] if result else None
 
 
-def fetch_medications_for_resident(resident_name):
-    with sqlite3.connect('resident_data.db') as conn:
-        cursor = conn.cursor()
+# Decoded medication profiles per resident name, see fetch_medications_for_resident().
+# Each entry is (resident_id, medication_version, profile); the version is checked
+# against the database before an entry is served, so changes made on other stations show up.
+_medication_profiles = {}
+_medication_profile_lock = threading.Lock()
+_medication_profile_stats = {'hits': 0, 'misses': 0, 'stale': 0, 'invalidations': 0}
 
-        # Get the resident ID
-        cursor.execute("SELECT id FROM residents WHERE name = ?", (resident_name,))
-        resident_id_result = cursor.fetchone()
-        if not resident_id_result:
-            return {}  # No such resident found
-        resident_id = resident_id_result[0]
 
-        # Fetch Scheduled Medications
-        cursor.execute("""
-            SELECT m.medication_name, m.dosage, m.instructions, ts.slot_name
-            FROM medications m
-            JOIN medication_time_slots mts ON m.id = mts.medication_id
-            JOIN time_slots ts ON mts.time_slot_id = ts.id
-            WHERE m.resident_id = ? AND m.medication_type = 'Scheduled'
-        """, (resident_id,))
-        scheduled_results = cursor.fetchall()
-
-        scheduled_medications = {}
-        for med_name, dosage, instructions, time_slot in scheduled_results:
-            decrypted_dosage = decrypt_data(dosage)
-            decrypted_instructions = decrypt_data(instructions)
-            if time_slot not in scheduled_medications:
-                scheduled_medications[time_slot] = {}
-            scheduled_medications[time_slot][med_name] = {
-                'dosage': decrypted_dosage, 'instructions': decrypted_instructions}
-
-        # Fetch PRN Medications
-        cursor.execute("""
-            SELECT medication_name, dosage, instructions
-            FROM medications 
-            WHERE resident_id = ? AND medication_type = 'As Needed (PRN)'
-        """, (resident_id,))
-        prn_results = cursor.fetchall()
+def invalidate_medication_profile(resident_name=None, resident_id=None):
+    """
+    Drop cached medication profiles after a resident's medications change.
+
+    Args:
+    resident_name (str): The resident whose profile is stale.
+    resident_id (int): Alternatively, the resident's ID.
+    """
+    with _medication_profile_lock:
+        # Counted even when nothing is cached, so a load running concurrently is not stored
+        _medication_profile_stats['invalidations'] += 1
+        for name, (cached_id, _, _) in list(_medication_profiles.items()):
+            if name == resident_name or (resident_id is not None and cached_id == resident_id):
+                del _medication_profiles[name]
+
+
+def clear_medication_profiles():
+    """ Drop every cached profile, e.g. when the user logs out. """
+    with _medication_profile_lock:
+        _medication_profile_stats['invalidations'] += 1
+        _medication_profiles.clear()
 
-        prn_medications = {med_name: {'dosage': decrypt_data(dosage), 'instructions': decrypt_data(instructions)} 
-            for med_name, dosage, instructions in prn_results}
 
-        # Fetch Controlled Medications
+def get_medication_profile_stats():
+    """
+    Return the medication profile cache counters.
+
+    Returns:
+    dict: hits, misses, stale entries reloaded after another station's change, invalidations,
+    the number of cached residents and the hit rate.
+    """
+    with _medication_profile_lock:
+        stats = dict(_medication_profile_stats)
+        stats['entries'] = len(_medication_profiles)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+    return stats
+
+
+def load_medication_profile(resident_name):
+    """
+    Read and decrypt every medication of a resident with a single query.
+
+    Returns:
+    tuple: (resident_id, medication_version, profile) where profile has 'Scheduled' (time slot
+    -> name -> details), 'PRN' and 'Controlled' (name -> details); (None, None, {}) when the
+    resident does not exist.
+    """
+    with db_connection.transaction() as conn:
+        cursor = conn.cursor()
         cursor.execute("""
-            SELECT medication_name, dosage, instructions, count, medication_form
-            FROM medications 
-            WHERE resident_id = ? AND medication_type = 'Controlled'
-        """, (resident_id,))
-        controlled_results = cursor.fetchall()
+            SELECT r.id, r.medication_version, m.id, m.medication_name, m.medication_type, m.dosage, m.instructions,
+                   m.count, m.medication_form, ts.slot_name
+            FROM residents r
+            LEFT JOIN medications m ON m.resident_id = r.id
+            LEFT JOIN medication_time_slots mts ON mts.medication_id = m.id
+            LEFT JOIN time_slots ts ON ts.id = mts.time_slot_id
+            WHERE r.name = ?
+            ORDER BY m.id, ts.id
+        """, (resident_name,))
+        rows = cursor.fetchall()
 
-        controlled_medications = {med_name: {'dosage': decrypt_data(dosage), 'instructions': decrypt_data(instructions), 'count': count, 'form': form} 
-            for med_name, dosage, instructions, count, form in controlled_results}
+    if not rows:
+        return None, None, {}  # No such resident found
+
+    # Scheduled medications repeat once per time slot; decrypt each medication once
+    encrypted = {row[2]: (row[5], row[6]) for row in rows if row[2] is not None}
+    plain = iter(decrypt_column(token for pair in encrypted.values() for token in pair))
+    decoded = {medication_id: {'dosage': next(plain), 'instructions': next(plain)} for medication_id in encrypted}
+
+    profile = {'Scheduled': {}, 'PRN': {}, 'Controlled': {}}
+    for resident_id, _, medication_id, med_name, medication_type, dosage, instructions, count, form, time_slot in rows:
+        if medication_id is None:
+            continue  # Resident without medications
+        details = decoded[medication_id]
+        if medication_type == 'Scheduled':
+            if time_slot is not None:
+                profile['Scheduled'].setdefault(time_slot, {})[med_name] = dict(details)
+        elif medication_type == 'As Needed (PRN)':
+            profile['PRN'][med_name] = dict(details)
+        elif medication_type == 'Controlled':
+            profile['Controlled'][med_name] = dict(details, count=count, form=form)
+    return rows[0][0], rows[0][1], profile
+
+
+def get_medication_version(resident_name):
+    """ Return (resident_id, medication_version), or None when the resident does not exist. """
+    with db_connection.transaction() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, medication_version FROM residents WHERE name = ?', (resident_name,))
+        return cursor.fetchone()
 
-        # Combine the data into a single structure
-        medications_data = {'Scheduled': scheduled_medications, 'PRN': prn_medications, 'Controlled': controlled_medications}
-        return medications_data
+
+def fetch_medications_for_resident(resident_name):
+    with _medication_profile_lock:
+        cached = _medication_profiles.get(resident_name)
+        invalidations = _medication_profile_stats['invalidations']
+    # Another station may have changed this resident's medications since the profile was loaded
+    stale = cached is not None and get_medication_version(resident_name) != cached[:2]
+    with _medication_profile_lock:
+        if stale:
+            _medication_profile_stats['stale'] += 1
+            cached = None
+        _medication_profile_stats['hits' if cached else 'misses'] += 1
+    if cached is None:
+        cached = load_medication_profile(resident_name)
+        if cached[0] is None:
+            return {}  # No such resident found
+        with _medication_profile_lock:
+            # Skip caching if a save invalidated profiles while this one was loading
+            if _medication_profile_stats['invalidations'] == invalidations:
+                _medication_profiles[resident_name] = cached
+    # Callers reshape the result, so hand out a copy and keep the cached one intact
+    return copy.deepcopy(cached[2])
 
 
 def insert_medication(resident_name, medication_name, dosage, instructions, medication_type, selected_time_slots, medication_form=None, count=None):
     resident_id = get_resident_id(resident_name)
     if resident_id is not None:
-        with sqlite3.connect('resident_data.db') as conn:
+        with db_connection.transaction() as conn:
             cursor = conn.cursor()
 
             # Encrypt PHI fields
@@ -646,50 +922,41 @@ def insert_medication(resident_name, medication_name, dosage, instructions, medi
                     cursor.execute('SELECT id FROM time_slots WHERE slot_name = ?', (slot,))
                     slot_id = cursor.fetchone()[0]
                     cursor.execute('INSERT INTO medication_time_slots (medication_id, time_slot_id) VALUES (?, ?)', (medication_id, slot_id))
-            
-            conn.commit()
+        invalidate_medication_profile(resident_name)
 
 
 def remove_medication(medication_name, resident_name):
     resident_id = get_resident_id(resident_name)
-    # Connect to the database
-    conn = sqlite3.connect('resident_data.db')
-    c = conn.cursor()
 
     try:
-        # Start a transaction
-        conn.execute('BEGIN')
+        # Run the deletes as one transaction; it rolls back if any step fails
+        with db_connection.transaction() as conn:
+            c = conn.cursor()
 
-        # Get the medication ID
-        c.execute('SELECT id FROM medications WHERE medication_name = ? AND resident_id = ?', (medication_name, resident_id))
-        medication_id = c.fetchone()
-        if medication_id:
-            medication_id = medication_id[0]
+            # Get the medication ID
+            c.execute('SELECT id FROM medications WHERE medication_name = ? AND resident_id = ?', (medication_name, resident_id))
+            medication_id = c.fetchone()
+            if medication_id:
+                medication_id = medication_id[0]
 
-            # Delete related entries from medication_time_slots
-            c.execute('DELETE FROM medication_time_slots WHERE medication_id = ?', (medication_id,))
+                # Delete related entries from medication_time_slots
+                c.execute('DELETE FROM medication_time_slots WHERE medication_id = ?', (medication_id,))
 
-            # Delete related entries from emar_chart
-            c.execute('DELETE FROM emar_chart WHERE medication_id = ?', (medication_id,))
+                # Delete related entries from emar_chart
+                c.execute('DELETE FROM emar_chart WHERE medication_id = ?', (medication_id,))
 
-            # Finally, delete the medication itself
-            c.execute('DELETE FROM medications WHERE id = ?', (medication_id,))
+                # Finally, delete the medication itself
+                c.execute('DELETE FROM medications WHERE id = ?', (medication_id,))
 
-        # Commit the transaction
-        conn.commit()
+        invalidate_medication_profile(resident_name)
         log_action(config.global_config['logged_in_user'], 'Medication Deleted', f'{medication_name} removed')
         print(f"Medication '{medication_name}' and all related data successfully removed.")
     except Exception as e:
-        # Rollback in case of error
-        conn.rollback()
         print(f"Error removing medication: {e}")
-    finally:
-        # Close the connection
-        conn.close()
 
 
 def fetch_medication_details(medication_name, resident_id):
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT medication_name, dosage, instructions FROM medications WHERE medication_name = ? AND resident_id = ?", (medication_name, resident_id))
         result = cursor.fetchone()
@@ -700,16 +967,16 @@ def fetch_medication_details(medication_name, resident_id):
 
 
 def update_medication_details(old_name, resident_id, new_name, new_dosage, new_instructions):
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         encrypted_new_dosage = encrypt_data(new_dosage)
         encrypted_new_instructions = encrypt_data(new_instructions)
         cursor = conn.cursor()
         cursor.execute("UPDATE medications SET medication_name = ?, dosage = ?, instructions = ? WHERE medication_name = ? AND resident_id = ?", (new_name, encrypted_new_dosage, encrypted_new_instructions, old_name, resident_id))
-        conn.commit()
+    invalidate_medication_profile(resident_id=resident_id)
 
 
 def get_controlled_medication_count_and_form(resident_name, medication_name):
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
 
         # Fetch the resident ID based on the resident's name
@@ -733,7 +1000,7 @@ def get_controlled_medication_count_and_form(resident_name, medication_name):
 
 
 def save_controlled_administration_data(resident_name, medication_name, admin_data, new_count):
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
 
         # Retrieve resident ID and medication ID
@@ -744,10 +1011,11 @@ def save_controlled_administration_data(resident_name, medication_name, admin_da
         medication_id = cursor.fetchone()[0]
 
         # Insert administration data into emar_chart, including the new count
+        admin_date, admin_time = split_admin_datetime(admin_data['datetime'])
         cursor.execute('''
-            INSERT INTO emar_chart (resident_id, medication_id, date, administered, notes, current_count)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (resident_id, medication_id, admin_data['datetime'], admin_data['initials'], admin_data['notes'], new_count))
+            INSERT INTO emar_chart (resident_id, medication_id, date, admin_date, admin_time, administered, notes, current_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (resident_id, medication_id, admin_data['datetime'], admin_date, admin_time, admin_data['initials'], admin_data['notes'], new_count))
 
         # Update medication count in medications table
         cursor.execute('''
@@ -755,15 +1023,14 @@ def save_controlled_administration_data(resident_name, medication_name, admin_da
             SET count = ?
             WHERE id = ?
         ''', (new_count, medication_id))
-
-        conn.commit()
+    invalidate_medication_profile(resident_name)
 
 
 def discontinue_medication(resident_name, medication_name, discontinued_date):
     # Get the resident's ID
     resident_id = get_resident_id(resident_name)
     if resident_id is not None:
-        with sqlite3.connect('resident_data.db') as conn:
+        with db_connection.transaction() as conn:
             cursor = conn.cursor()
 
             # Update the medication record with the discontinued date
@@ -772,28 +1039,45 @@ def discontinue_medication(resident_name, medication_name, discontinued_date):
                 SET discontinued_date = ? 
                 WHERE resident_id = ? AND medication_name = ? AND (discontinued_date IS NULL OR discontinued_date = '')
             ''', (discontinued_date, resident_id, medication_name))
-            
-            conn.commit()
+        invalidate_medication_profile(resident_name)
 
 
-def filter_active_medications(medication_names, resident_name):
-    active_medications = []
+def fetch_active_medications(resident_name=None, include_pending_discontinuations=True):
+    """
+    Fetch the medications that are not discontinued as of today, in a single query.
 
-    with sqlite3.connect('resident_data.db') as conn:
-        cursor = conn.cursor()
+    A medication stays active until its discontinued date has arrived, so orders
+    discontinued for a future date are still returned.
 
-        for med_name in medication_names:
-            cursor.execute('''
-                SELECT discontinued_date FROM medications
-                JOIN residents ON medications.resident_id = residents.id
-                WHERE residents.name = ? AND medications.medication_name = ?
-            ''', (resident_name, med_name))
-            result = cursor.fetchone()
+    Args:
+    resident_name (str): Limit the result to one resident; None returns every resident.
+    include_pending_discontinuations (bool): False leaves out orders already set to stop on a
+        future date, e.g. when offering medications to discontinue.
 
-            # Check if the medication is discontinued and if the discontinuation date is past the current date
-            if result is None or (result[0] is None or datetime.now().date() < datetime.strptime(result[0], '%Y-%m-%d').date()):
-                active_medications.append(med_name)
+    Returns:
+    dict: resident_name -> {medication_name: medication_id}.
+    """
+    query = '''
+        SELECT r.name, m.medication_name, m.id
+        FROM medications m
+        JOIN residents r ON m.resident_id = r.id
+    '''
+    if include_pending_discontinuations:
+        query += " WHERE (m.discontinued_date IS NULL OR m.discontinued_date = '' OR m.discontinued_date > date('now', 'localtime'))"
+    else:
+        query += " WHERE (m.discontinued_date IS NULL OR m.discontinued_date = '')"
+    params = []
+    if resident_name is not None:
+        query += " AND r.name = ?"
+        params.append(resident_name)
+    query += " ORDER BY r.name, m.id"
 
+    active_medications = {}
+    with db_connection.transaction() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        for name, medication_name, medication_id in cursor.fetchall():
+            active_medications.setdefault(name, {})[medication_name] = medication_id
     return active_medications
 
 
@@ -806,7 +1090,7 @@ def fetch_discontinued_medications(resident_name):
     """
     discontinued_medications = {}
 
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
 
         # Fetch the resident's ID
@@ -822,16 +1106,16 @@ def fetch_discontinued_medications(resident_name):
             WHERE resident_id = ? AND discontinued_date IS NOT NULL
         ''', (resident_id,))
 
+        # Medication names are stored in plain text, so there is nothing to decrypt
         for medication_name, discontinued_date in cursor.fetchall():
-            decrypted_medication_name = decrypt_data(medication_name) if medication_name else medication_name
             if discontinued_date:  # Ensure there is a discontinuation date
-                discontinued_medications[decrypted_medication_name] = discontinued_date
+                discontinued_medications[medication_name] = discontinued_date
 
     return discontinued_medications
 
 
 def save_non_medication_order(resident_id, order_name, frequency, specific_days, special_instructions):
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         
         # Prepare the frequency and specific_days values for insertion
@@ -848,8 +1132,6 @@ def save_non_medication_order(resident_id, order_name, frequency, specific_days,
             VALUES (?, ?, ?, ?, ?)
         ''', (resident_id, order_name, frequency_value, specific_days, special_instructions))
 
-        conn.commit()
-
 
 def update_non_med_order_details(order_name, resident_id, new_order_name, new_instructions):
     """
@@ -861,7 +1143,7 @@ def update_non_med_order_details(order_name, resident_id, new_order_name, new_in
         new_order_name (str): The new name for the order.
         new_instructions (str): The new special instructions for the order.
     """
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
 
         # Prepare the SQL statement for updating the order details.
@@ -877,9 +1159,6 @@ def update_non_med_order_details(order_name, resident_id, new_order_name, new_in
         # Execute the SQL statement with the new values and the original order name and resident ID.
         cursor.execute(sql, (new_order_name, new_instructions, order_name, resident_id))
         
-        # Commit the transaction to save changes.
-        conn.commit()
-        
         if cursor.rowcount == 0:
             # If no rows were updated, it could mean the order name/resident ID didn't match.
             print("No order was updated. Please check the order name and resident ID.")
@@ -895,7 +1174,7 @@ def remove_non_med_order(order_name, resident_name):
         order_name (str): The name of the non-medication order to be removed.
         resident_name (str): The name of the resident from whom the order is to be removed.
     """
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
 
         # First, get the resident ID for the given resident name to ensure accuracy
@@ -917,9 +1196,6 @@ def remove_non_med_order(order_name, resident_name):
         # Execute the SQL statement with the order name and resident ID
         cursor.execute(sql, (order_name, resident_id))
         
-        # Commit the transaction to save changes
-        conn.commit()
-        
         if cursor.rowcount == 0:
             # If no rows were deleted, it means the order name/resident ID didn't match any record
             print("No non-medication order was removed. Please check the order name and resident name.")
@@ -928,7 +1204,7 @@ def remove_non_med_order(order_name, resident_name):
 
 
 def fetch_all_non_medication_orders_for_resident(resident_name):
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
 
         resident_id = get_resident_id(resident_name)
@@ -957,33 +1233,30 @@ def fetch_all_non_medication_orders_for_resident(resident_name):
 
 
 def fetch_administrations_for_order(order_id, month, year):
-    # Connect to the SQLite database
-    conn = sqlite3.connect('resident_data.db')
+    conn = db_connection.get_connection()
     cursor = conn.cursor()
 
     # Update the query to include the initials field
     query = """
     SELECT administration_date, notes, initials
     FROM non_med_order_administrations
-    WHERE order_id = ? AND strftime('%m', administration_date) = ? AND strftime('%Y', administration_date) = ?
+    WHERE order_id = ? AND administration_date >= ? AND administration_date < ?
     ORDER BY administration_date ASC
     """
 
     # Execute the query
-    cursor.execute(query, (order_id, month.zfill(2), year))
+    start_date, end_date = month_window(f'{year}-{month}')
+    cursor.execute(query, (order_id, start_date, end_date))
 
     # Fetch and format the results, now including initials
     results = cursor.fetchall()
     formatted_results = [[datetime.strptime(row[0], '%Y-%m-%d').strftime('%b %d, %Y'), row[1], row[2]] for row in results]
 
-    # Close the database connection
-    conn.close()
-
     return formatted_results
 
 
 def record_non_med_order_performance(order_name, resident_id, notes, user_initials):
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
 
         # Step 1: Look up the order_id
@@ -1010,20 +1283,19 @@ def record_non_med_order_performance(order_name, resident_id, notes, user_initia
             SET last_administered_date = ?
             WHERE order_id = ?
         ''', (current_date, order_id))
-
-        conn.commit()
         log_action(config.global_config['logged_in_user'], 'Non-Medication Order Administered', f'{order_name} administered for {resident_id}')
 
 
 def does_adl_chart_data_exist(resident_name, year_month):
-    with sqlite3.connect('resident_data.db') as conn:
+    start_date, end_date = month_window(year_month)
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             SELECT EXISTS(
                 SELECT 1 FROM adl_chart
-                WHERE resident_name = ? AND strftime('%Y-%m', date) = ?
+                WHERE resident_id = (SELECT id FROM residents WHERE name = ?) AND date >= ? AND date < ?
             )
-        ''', (resident_name, year_month))
+        ''', (resident_name, start_date, end_date))
         return cursor.fetchone()[0]
 
 
@@ -1039,7 +1311,7 @@ def fetch_adl_data_for_resident(resident_name):
     today = datetime.now().strftime("%Y-%m-%d")
     resident_id = get_resident_id(resident_name)  # Ensure this function exists and correctly fetches the ID
 
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         # Adjust the query to use resident_id instead of resident_name
         cursor.execute('''
@@ -1061,13 +1333,14 @@ def fetch_adl_data_for_resident(resident_name):
 def fetch_adl_chart_data_for_month(resident_name, year_month):
     # year_month should be in the format 'YYYY-MM'
     resident_id = get_resident_id(resident_name)
-    with sqlite3.connect('resident_data.db') as conn:
+    start_date, end_date = month_window(year_month)
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             SELECT * FROM adl_chart
-            WHERE resident_id = ? AND strftime('%Y-%m', date) = ?
+            WHERE resident_id = ? AND date >= ? AND date < ?
             ORDER BY date
-        ''', (resident_id, year_month))
+        ''', (resident_id, start_date, end_date))
         return cursor.fetchall()
 
 
@@ -1083,7 +1356,7 @@ def fetch_adl_data_for_resident_and_date(resident_name, date):
         dict: A dictionary containing ADL data for the resident and date.
     """
     resident_id = get_resident_id(resident_name)
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             SELECT * FROM adl_chart WHERE resident_id = ? AND date = ?
@@ -1124,107 +1397,78 @@ def fetch_adl_data_for_resident_and_date(resident_name, date):
         return {}
 
 
-def save_adl_data_from_management_window(resident_name, adl_data):
-    resident_id = get_resident_id(resident_name)
+# Built once from ADL_KEYS so every ADL save reuses the same prepared statement
+ADL_UPSERT_SQL = f'''
+    INSERT INTO adl_chart (resident_id, date, {', '.join(ADL_KEYS)})
+    VALUES ({', '.join(['?'] * (len(ADL_KEYS) + 2))})
+    ON CONFLICT(resident_id, date) DO UPDATE SET
+    {', '.join(f'{key} = excluded.{key}' for key in ADL_KEYS)}
+'''
+
+
+def save_adl_rows(resident_id, day_rows):
+    """
+    Upsert several days of ADL data for one resident in a single transaction.
 
-    with sqlite3.connect('resident_data.db') as conn:
+    The stored rows for the covered dates are read once, and days whose stored values
+    match are skipped. A day with no stored row is always written, even all blank, so
+    does_adl_chart_data_exist() still sees a month that was saved blank.
+
+    Args:
+    resident_id (int): The ID of the resident.
+    day_rows (list): (date, adl_data) pairs, date in 'YYYY-MM-DD' format and adl_data keyed by ADL_KEYS.
+
+    Returns:
+    int: The number of days written.
+    """
+    if resident_id is None or not day_rows:
+        return 0
+
+    dates = [date for date, _ in day_rows]
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
-        # Construct the SQL statement with all the columns
-        sql = '''
-            INSERT INTO adl_chart (resident_id, date, first_shift_sp, second_shift_sp, 
-            first_shift_activity1, first_shift_activity2, first_shift_activity3, second_shift_activity4, 
-            first_shift_bm, second_shift_bm, shower, shampoo, sponge_bath, peri_care_am, 
-            peri_care_pm, oral_care_am, oral_care_pm, nail_care, skin_care, shave, 
-            breakfast, lunch, dinner, snack_am, snack_pm, water_intake)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(resident_id, date) DO UPDATE SET
-            first_shift_sp = excluded.first_shift_sp, second_shift_sp = excluded.second_shift_sp, 
-            first_shift_activity1 = excluded.first_shift_activity1, first_shift_activity2 = excluded.first_shift_activity2,
-            first_shift_activity3 = excluded.first_shift_activity3, second_shift_activity4 = excluded.second_shift_activity4,
-            first_shift_bm = excluded.first_shift_bm, second_shift_bm = excluded.second_shift_bm, shower = excluded.shower,
-            shampoo = excluded.shampoo,sponge_bath = excluded.sponge_bath, peri_care_am = excluded.peri_care_am, 
-            peri_care_pm = excluded.peri_care_pm, oral_care_am = excluded.oral_care_am, oral_care_pm = excluded.oral_care_pm,
-            nail_care = excluded.nail_care, skin_care = excluded.skin_care, shave = excluded.shave, breakfast = excluded.breakfast,
-            lunch = excluded.lunch, dinner = excluded.dinner, snack_am = excluded.snack_am, snack_pm = excluded.snack_pm,
-            water_intake = excluded.water_intake
-        '''
-        
-        data_tuple = (
-            resident_id, 
-            datetime.now().strftime("%Y-%m-%d"),
-            adl_data.get('first_shift_sp', ''),
-            adl_data.get('second_shift_sp', ''),
-            adl_data.get('first_shift_activity1', ''),
-            adl_data.get('first_shift_activity2', ''),
-            adl_data.get('first_shift_activity3', ''),
-            adl_data.get('second_shift_activity4', ''),
-            adl_data.get('first_shift_bm', ''),
-            adl_data.get('second_shift_bm', ''),
-            adl_data.get('shower', ''),
-            adl_data.get('shampoo', ''),
-            adl_data.get('sponge_bath', ''),
-            adl_data.get('peri_care_am', ''),
-            adl_data.get('peri_care_pm', ''),
-            adl_data.get('oral_care_am', ''),
-            adl_data.get('oral_care_pm', ''),
-            adl_data.get('nail_care', ''),
-            adl_data.get('skin_care', ''),
-            adl_data.get('shave', ''),
-            adl_data.get('breakfast', ''),
-            adl_data.get('lunch', ''),
-            adl_data.get('dinner', ''),
-            adl_data.get('snack_am', ''),
-            adl_data.get('snack_pm', ''),
-            adl_data.get('water_intake', '')
-        )
-        cursor.execute(sql, data_tuple)
-        conn.commit()
+        cursor.execute(f'''
+            SELECT date, {', '.join(ADL_KEYS)} FROM adl_chart
+            WHERE resident_id = ? AND date >= ? AND date <= ?
+        ''', (resident_id, min(dates), max(dates)))
+        stored = {row[0]: tuple(value or '' for value in row[1:]) for row in cursor.fetchall()}
+
+        changed_rows = []
+        for date, adl_data in day_rows:
+            values = tuple(adl_data.get(key) or '' for key in ADL_KEYS)
+            if stored.get(date) != values:
+                changed_rows.append((resident_id, date, *values))
+
+        cursor.executemany(ADL_UPSERT_SQL, changed_rows)
+    return len(changed_rows)
+
+
+def save_adl_data_from_management_window(resident_name, adl_data):
+    resident_id = get_resident_id(resident_name)
+    save_adl_rows(resident_id, [(datetime.now().strftime("%Y-%m-%d"), adl_data)])
 
 
 def save_adl_data_from_chart_window(resident_name, year_month, window_values):
+    if not is_valid_year_month(year_month):
+        raise ValueError(f'Invalid chart month: {year_month!r}')
+
     resident_id = get_resident_id(resident_name)
-    with sqlite3.connect('resident_data.db') as conn:
-        cursor = conn.cursor()
-        # Define the number of days
-        num_days = 31
-
-        # Loop over each day of the month
-        for day in range(1, num_days + 1):
-            # Extract values for each ADL key for the day
-            adl_data = [window_values[f'-{key}-{day}-'] for key in ADL_KEYS]
-            
-            # Construct the date string for the specific day
-            date_str = f"{year_month}-{str(day).zfill(2)}"
-            
-            # Prepare the SQL statement
-            sql = '''
-                INSERT INTO adl_chart (resident_id, date, first_shift_sp, second_shift_sp, 
-                first_shift_activity1, first_shift_activity2, first_shift_activity3, second_shift_activity4, 
-                first_shift_bm, second_shift_bm, shower, shampoo, sponge_bath, peri_care_am, 
-                peri_care_pm, oral_care_am, oral_care_pm, nail_care, skin_care, shave, 
-                breakfast, lunch, dinner, snack_am, snack_pm, water_intake)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ON CONFLICT(resident_id, date) DO UPDATE SET
-                first_shift_sp = excluded.first_shift_sp, second_shift_sp = excluded.second_shift_sp, 
-                first_shift_activity1 = excluded.first_shift_activity1, first_shift_activity2 = excluded.first_shift_activity2,
-                first_shift_activity3 = excluded.first_shift_activity3, second_shift_activity4 = excluded.second_shift_activity4,
-                first_shift_bm = excluded.first_shift_bm, second_shift_bm = excluded.second_shift_bm, shower = excluded.shower,
-                shampoo = excluded.shampoo,sponge_bath = excluded.sponge_bath, peri_care_am = excluded.peri_care_am, 
-                peri_care_pm = excluded.peri_care_pm, oral_care_am = excluded.oral_care_am, oral_care_pm = excluded.oral_care_pm,
-                nail_care = excluded.nail_care, skin_care = excluded.skin_care, shave = excluded.shave, breakfast = excluded.breakfast,
-                lunch = excluded.lunch, dinner = excluded.dinner, snack_am = excluded.snack_am, snack_pm = excluded.snack_pm,
-                water_intake = excluded.water_intake
-            '''
-            
-            # Execute the SQL statement
-            cursor.execute(sql, (resident_id, date_str, *adl_data))
-            
-        # Commit the changes to the database
-        conn.commit()
+    # Define the number of days
+    num_days = 31
+    # Same 'YYYY-MM' form month_window() reads back, also for a one-digit month
+    year, month = (int(part) for part in year_month.strip().split('-'))
+
+    # Collect every day of the chart, then write the changed ones in one batch
+    day_rows = []
+    for day in range(1, num_days + 1):
+        date_str = f"{year:04d}-{month:02d}-{day:02d}"
+        day_rows.append((date_str, {key: window_values[f'-{key}-{day}-'] for key in ADL_KEYS}))
+
+    return save_adl_rows(resident_id, day_rows)
 
 
 def save_prn_administration_data(resident_name, medication_name, admin_data):
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
 
         # Retrieve resident ID and medication ID
@@ -1235,87 +1479,181 @@ def save_prn_administration_data(resident_name, medication_name, admin_data):
         medication_id = cursor.fetchone()[0]
 
         # Insert administration data into emar_chart
+        admin_date, admin_time = split_admin_datetime(admin_data['datetime'])
         cursor.execute('''
-            INSERT INTO emar_chart (resident_id, medication_id, date, administered, notes)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (resident_id, medication_id, admin_data['datetime'], admin_data['initials'], admin_data['notes']))
+            INSERT INTO emar_chart (resident_id, medication_id, date, admin_date, admin_time, administered, notes)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (resident_id, medication_id, admin_data['datetime'], admin_date, admin_time, admin_data['initials'], admin_data['notes']))
 
-        conn.commit()
 
+EMAR_TIME_SLOTS = ('Morning', 'Noon', 'Evening', 'Night')
 
-def save_emar_data_from_chart_window(resident_name, year_month, window_values):
-    with sqlite3.connect('resident_data.db') as conn:
+# Shared upsert for scheduled doses; date and admin_date carry the same 'YYYY-MM-DD' value
+EMAR_UPSERT_SQL = '''
+    INSERT INTO emar_chart (resident_id, medication_id, date, admin_date, time_slot, administered)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(resident_id, medication_id, date, time_slot)
+    DO UPDATE SET administered = excluded.administered
+'''
+
+
+def parse_emar_chart_cells(window_values):
+    """
+    Pick the scheduled-dose cells out of the monthly eMAR chart's window values.
+
+    Cell keys look like '-{medication name}_{time slot}-{day}-'; PRN, controlled
+    and other widget keys are ignored.
+
+    Returns:
+    list: (medication_name, time_slot, day, value) tuples.
+    """
+    cells = []
+    for key, value in window_values.items():
+        if not isinstance(key, str) or len(key) < 2 or key[0] != '-' or key[-1] != '-':
+            continue
+        name_and_slot, _, day = key[1:-1].rpartition('-')
+        medication_name, _, time_slot = name_and_slot.rpartition('_')
+        if day.isdigit() and medication_name and time_slot in EMAR_TIME_SLOTS:
+            cells.append((medication_name, time_slot, int(day), value))
+    return cells
+
+
+def save_emar_chart_cells(resident_id, year_month, cells):
+    """
+    Write a month of scheduled-dose cells for one resident in a single transaction.
+
+    Medication IDs for the resident are resolved in one query and the month's stored
+    values are read once, so only cells that actually changed are upserted.
+
+    Args:
+    resident_id (int): The ID of the resident.
+    year_month (str): The chart month in 'YYYY-MM' format.
+    cells (list): (medication_name, time_slot, day, value) tuples, as from parse_emar_chart_cells.
+
+    Returns:
+    int: The number of cells written.
+    """
+    if resident_id is None or not cells:
+        return 0
+    if not is_valid_year_month(year_month):
+        raise ValueError(f'Invalid chart month: {year_month!r}')
+
+    start_date, end_date = month_window(year_month)
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
-        num_days = 31
+        cursor.execute('SELECT medication_name, id FROM medications WHERE resident_id = ? ORDER BY id', (resident_id,))
+        medication_ids = dict(cursor.fetchall())
 
-        for day in range(1, num_days + 1):
+        cursor.execute('''
+            SELECT medication_id, admin_date, time_slot, administered FROM emar_chart
+            WHERE resident_id = ? AND admin_date >= ? AND admin_date < ? AND admin_time IS NULL
+        ''', (resident_id, start_date, end_date))
+        stored = {(medication_id, admin_date, time_slot): administered or ''
+                  for medication_id, admin_date, time_slot, administered in cursor.fetchall()}
+
+        changed_rows = []
+        for medication_name, time_slot, day, value in cells:
+            medication_id = medication_ids.get(medication_name)
+            if medication_id is None:
+                continue
             date_str = f"{year_month}-{str(day).zfill(2)}"
-            
-            for key, value in window_values.items():
-                if key.startswith('-') and key.endswith(f'-{day}-'):
-                    # Extract medication name and time slot from the key
-                    parts = key.strip('-').split('_')
-                    medication_name = '_'.join(parts[:-1])  # Rejoin all parts except the last one
-                    time_slot = parts[-1].split('-')[0]
-
-                    sql = '''
-                        INSERT INTO emar_chart (resident_id, medication_id, date, time_slot, administered)
-                        SELECT residents.id, medications.id, ?, ?, ?
-                        FROM residents, medications
-                        WHERE residents.name = ? AND medications.medication_name = ?
-                        ON CONFLICT(resident_id, medication_id, date, time_slot) DO UPDATE SET
-                        administered = excluded.administered
-                    '''
-                    cursor.execute(sql, (date_str, time_slot, value, resident_name, medication_name))
-
-        conn.commit()
+            if stored.get((medication_id, date_str, time_slot), '') == (value or ''):
+                continue
+            changed_rows.append((resident_id, medication_id, date_str, date_str, time_slot, value))
+
+        cursor.executemany(EMAR_UPSERT_SQL, changed_rows)
+    return len(changed_rows)
+
+
+# Resident names per ID lookup query, kept well under SQLite's bound-parameter limit
+EMAR_LOOKUP_CHUNK_SIZE = 500
+
+
+def resolve_emar_ids(cursor, resident_names):
+    """
+    Resolve resident and medication IDs for a set of residents in one query per chunk.
+
+    Args:
+    cursor (sqlite3.Cursor): Cursor on the open transaction.
+    resident_names (iterable): Names of the residents being charted.
+
+    Returns:
+    dict: (resident_name, medication_name) -> (resident_id, medication_id).
+    """
+    names = sorted(set(resident_names))
+    ids = {}
+    for i in range(0, len(names), EMAR_LOOKUP_CHUNK_SIZE):
+        chunk = names[i:i + EMAR_LOOKUP_CHUNK_SIZE]
+        placeholders = ', '.join('?' * len(chunk))
+        cursor.execute(f'''
+            SELECT r.name, m.medication_name, r.id, m.id
+            FROM residents r
+            JOIN medications m ON m.resident_id = r.id
+            WHERE r.name IN ({placeholders})
+            ORDER BY m.id
+        ''', chunk)
+        for resident_name, medication_name, resident_id, medication_id in cursor.fetchall():
+            ids[(resident_name, medication_name)] = (resident_id, medication_id)
+    return ids
+
+
+def save_emar_entries(entries):
+    """
+    Upsert scheduled-dose entries for any number of residents in a single transaction.
+
+    Works for one resident's day from the management window as well as a
+    facility-wide medication pass covering every resident on a time slot.
+    Entries whose resident or medication no longer exists are skipped.
+
+    Args:
+    entries (list): Dicts with resident_name, medication_name, date, time_slot and administered.
+
+    Returns:
+    int: The number of entries written.
+    """
+    if not entries:
+        return 0
+
+    with db_connection.transaction() as conn:
+        cursor = conn.cursor()
+        ids = resolve_emar_ids(cursor, (entry['resident_name'] for entry in entries))
+
+        rows = []
+        for entry in entries:
+            resolved = ids.get((entry['resident_name'], entry['medication_name']))
+            if resolved is None:
+                continue
+            resident_id, medication_id = resolved
+            rows.append((resident_id, medication_id, entry['date'], entry['date'], entry['time_slot'], entry['administered']))
+
+        cursor.executemany(EMAR_UPSERT_SQL, rows)
+    return len(rows)
+
+
+def save_emar_data_from_chart_window(resident_name, year_month, window_values):
+    resident_id = get_resident_id(resident_name)
+    return save_emar_chart_cells(resident_id, year_month, parse_emar_chart_cells(window_values))
 
 
 def fetch_current_emar_data_for_resident_date(resident_name, date):
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
-        cursor.execute('''SELECT m.medication_name, ec.time_slot, ec.administered, ec.date
+        cursor.execute('''SELECT m.medication_name, ec.time_slot, ec.administered, ec.admin_date
                           FROM emar_chart ec
                           JOIN residents r ON ec.resident_id = r.id
                           JOIN medications m ON ec.medication_id = m.id
-                          WHERE r.name = ? AND ec.date = ?''', (resident_name, date))
+                          WHERE r.name = ? AND ec.admin_date = ? AND ec.admin_time IS NULL''', (resident_name, date))
         rows = cursor.fetchall()
         return [{'resident_name': resident_name, 'medication_name': row[0], 'time_slot': row[1], 'administered': row[2], 'date': row[3]} for row in rows]
 
 
 def save_emar_data_from_management_window(emar_data):
-    with sqlite3.connect('resident_data.db') as conn:
-        cursor = conn.cursor()
-
-        for entry in emar_data:
-            # Fetch the resident_id
-            cursor.execute("SELECT id FROM residents WHERE name = ?", (entry['resident_name'],))
-            resident_id_result = cursor.fetchone()
-            if resident_id_result is None:
-                continue  # Skip if resident not found
-            resident_id = resident_id_result[0]
-
-            # Fetch medication_id based on resident_id and unencrypted medication_name
-            cursor.execute("SELECT id FROM medications WHERE resident_id = ? AND medication_name = ?", (resident_id, entry['medication_name']))
-            medication_id_result = cursor.fetchone()
-            if medication_id_result is None:
-                continue  # Skip if medication not found
-            medication_id = medication_id_result[0]
-
-            # Insert or update emar_chart data
-            cursor.execute('''
-                INSERT INTO emar_chart (resident_id, medication_id, date, time_slot, administered)
-                VALUES (?, ?, ?, ?, ?)
-                ON CONFLICT(resident_id, medication_id, date, time_slot) 
-                DO UPDATE SET administered = excluded.administered
-            ''', (resident_id, medication_id, entry['date'], entry['time_slot'], entry['administered']))
-
-        conn.commit()
+    return save_emar_entries(emar_data)
 
 
 def fetch_emar_data_for_resident(resident_name):
     today = datetime.now().strftime("%Y-%m-%d")
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
 
         # Get the resident ID
@@ -1330,7 +1668,7 @@ def fetch_emar_data_for_resident(resident_name):
             SELECT m.medication_name, e.time_slot, e.administered
             FROM emar_chart e
             JOIN medications m ON e.medication_id = m.id
-            WHERE e.resident_id = ? AND e.date = ?
+            WHERE e.resident_id = ? AND e.admin_date = ? AND e.admin_time IS NULL
         """, (resident_id, today))
 
         results = cursor.fetchall()
@@ -1346,16 +1684,17 @@ def fetch_emar_data_for_resident(resident_name):
 
 
 def fetch_emar_data_for_month(resident_name, year_month):
-    with sqlite3.connect('resident_data.db') as conn:
+    start_date, end_date = month_window(year_month)
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         # Query to fetch eMAR data for the given month and resident
         cursor.execute('''
-            SELECT m.medication_name, e.date, e.time_slot, e.administered
+            SELECT m.medication_name, e.admin_date, e.time_slot, e.administered
             FROM emar_chart e
             JOIN residents r ON e.resident_id = r.id
             JOIN medications m ON e.medication_id = m.id
-            WHERE r.name = ? AND strftime('%Y-%m', e.date) = ?
-        ''', (resident_name, year_month))
+            WHERE r.name = ? AND e.admin_date >= ? AND e.admin_date < ?
+        ''', (resident_name, start_date, end_date))
         return cursor.fetchall()
 
 
@@ -1369,16 +1708,17 @@ def fetch_prn_data_for_day(event_key, resident_name, year_month):
     # Debugging: Print the values
     # print(f"Medication Name: {med_name}, Date Query: {date_query}")
 
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         query = '''
             SELECT e.date, e.administered, e.notes
             FROM emar_chart e
             JOIN residents r ON e.resident_id = r.id
             JOIN medications m ON e.medication_id = m.id
-            WHERE r.name = ? AND m.medication_name = ? AND e.date LIKE ?
+            WHERE r.name = ? AND m.medication_name = ? AND e.admin_date = ?
+            ORDER BY e.admin_time
         '''
-        cursor.execute(query, (resident_name, med_name, date_query + '%'))
+        cursor.execute(query, (resident_name, med_name, date_query))
         result = cursor.fetchall()
         
         # Debugging: Print the SQL result
@@ -1394,20 +1734,21 @@ def fetch_controlled_data_for_day(event_key, resident_name, year_month):
     day = day.zfill(2)  # Ensure day is two digits
     date_query = f'{year_month}-{day}'
 
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             SELECT e.date, e.administered, e.notes, e.current_count
             FROM emar_chart e
             JOIN residents r ON e.resident_id = r.id
             JOIN medications m ON e.medication_id = m.id
-            WHERE r.name = ? AND m.medication_name = ? AND e.date LIKE ? AND m.medication_type = 'Controlled'
-        ''', (resident_name, med_name, date_query + '%'))
+            WHERE r.name = ? AND m.medication_name = ? AND e.admin_date = ? AND m.medication_type = 'Controlled'
+            ORDER BY e.admin_time
+        ''', (resident_name, med_name, date_query))
         return cursor.fetchall()
 
 
 def fetch_monthly_medication_data(resident_name, medication_name, year_month, medication_type):
-    with sqlite3.connect('resident_data.db') as conn:
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
 
         resident_id = get_resident_id(resident_name)
@@ -1420,40 +1761,39 @@ def fetch_monthly_medication_data(resident_name, medication_name, year_month, me
         medication_id = medication_id_result[0]
 
         # Query for the entire month
-        year, month = year_month.split('-')
-        start_date = f"{year}-{month}-01"
-        end_date = f"{year}-{month}-{calendar.monthrange(int(year), int(month))[1]}"
+        start_date, end_date = month_window(year_month)
 
         if medication_type == 'Control':
             # For Controlled medications, include count information
             cursor.execute('''
                 SELECT date, administered, notes, current_count
                 FROM emar_chart
-                WHERE resident_id = ? AND medication_id = ? AND date BETWEEN ? AND ?
-                ORDER BY date
+                WHERE resident_id = ? AND medication_id = ? AND admin_date >= ? AND admin_date < ?
+                ORDER BY admin_date, admin_time
             ''', (resident_id, medication_id, start_date, end_date))
         else:
             # For PRN medications
             cursor.execute('''
                 SELECT date, administered, notes
                 FROM emar_chart
-                WHERE resident_id = ? AND medication_id = ? AND date BETWEEN ? AND ?
-                ORDER BY date
+                WHERE resident_id = ? AND medication_id = ? AND admin_date >= ? AND admin_date < ?
+                ORDER BY admin_date, admin_time
             ''', (resident_id, medication_id, start_date, end_date))
 
         return cursor.fetchall()
 
 
 def does_emars_chart_data_exist(resident_name, year_month):
-    with sqlite3.connect('resident_data.db') as conn:
+    start_date, end_date = month_window(year_month)
+    with db_connection.transaction() as conn:
         cursor = conn.cursor()
         # Query to check if there is any eMAR chart data for the resident in the given month
         cursor.execute('''
             SELECT EXISTS(
                 SELECT 1 FROM emar_chart
                 JOIN residents ON emar_chart.resident_id = residents.id
-                WHERE residents.name = ? AND strftime('%Y-%m', emar_chart.date) = ?
+                WHERE residents.name = ? AND emar_chart.admin_date >= ? AND emar_chart.admin_date < ?
             )
-        ''', (resident_name, year_month))
+        ''', (resident_name, start_date, end_date))
         return cursor.fetchone()[0] == 1
 
@@ -537,6 +537,9 @@ def open_non_med_order_chart(resident_name, order_id, initial_month=None, initia
             break
         elif event == '-REFRESH-':
             month, year = values['-MONTH-'], values['-YEAR-']
+            if not db_functions.is_valid_year_month(f'{year}-{month}'):
+                sg.popup("Please enter a valid month (1-12) and four-digit year.")
+                continue
             chart_data = fetch_chart_data(order_id, month, year)
             window['-CHART-'].update(values=chart_data)
 
@@ -624,13 +627,8 @@ def edit_non_med_order_window(selected_resident):
 def get_emar_tab_layout(resident_name):
     # Fetch medications for the resident, including both scheduled and PRN
     all_medications_data = db_functions.fetch_medications_for_resident(resident_name)
-    # Extracting medication names and removing duplicates
-    scheduled_meds = [med_name for time_slot in all_medications_data['Scheduled'].values() for med_name in time_slot]
-    prn_meds = list(all_medications_data['PRN'].keys())
-    controlled_meds = list(all_medications_data['Controlled'].keys())
-    all_meds = list(set(scheduled_meds + prn_meds + controlled_meds))
     # Filter out discontinued medications
-    active_medications = db_functions.filter_active_medications(all_meds, resident_name)
+    active_medications = db_functions.fetch_active_medications(resident_name).get(resident_name, {})
     
     filtered_medications_data = filter_medications_data(all_medications_data, active_medications)
     
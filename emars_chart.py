@@ -311,12 +311,12 @@ def show_emar_chart(resident_name, year_month):
     # Convert the eMAR data into a more convenient structure
     emar_data_dict = {}
     
-    for med_name, date, time_slot, administered in emar_data:
+    for med_name, admin_date, time_slot, administered in emar_data:
         if med_name not in emar_data_dict:
             emar_data_dict[med_name] = {}
-        if date not in emar_data_dict[med_name]:
-            emar_data_dict[med_name][date] = {}
-        emar_data_dict[med_name][date][time_slot] = administered
+        if admin_date not in emar_data_dict[med_name]:
+            emar_data_dict[med_name][admin_date] = {}
+        emar_data_dict[med_name][admin_date][time_slot] = administered
     
     # # print(original_structure)
     
@@ -330,8 +330,8 @@ def show_emar_chart(resident_name, year_month):
     for med_name, med_info in filtered_new_structure.items():
         if med_info['type'] == 'Scheduled':
             # Handle scheduled medications
-            for date, slots in emar_data_dict.get(med_name, {}).items():
-                day = int(date.split('-')[2])  # Extract the day from 'YYYY-MM-DD'
+            for admin_date, slots in emar_data_dict.get(med_name, {}).items():
+                day = int(admin_date[8:10])  # Extract the day from 'YYYY-MM-DD'
                 for time_slot, administered in slots.items():
                     key = f'-{med_name}_{time_slot}-{day}-'
                     if window[key]:
@@ -339,10 +339,8 @@ def show_emar_chart(resident_name, year_month):
 
         # Update layout for PRN medications
     for med_name in filtered_prn_structure.keys():
-        for datetime_string, slots in emar_data_dict.get(med_name, {}).items():
-            # Split the date and time, and then extract the day
-            date_part = datetime_string.split()[0]  # Get the 'YYYY-MM-DD' part
-            day = int(date_part.split('-')[2])  # Extract the day
+        for admin_date, slots in emar_data_dict.get(med_name, {}).items():
+            day = int(admin_date[8:10])  # admin_date is always 'YYYY-MM-DD'
 
             control_key = f'-PRN_{med_name}-{day}-'
             # Check if there is any administration data for the day
@@ -353,10 +351,8 @@ def show_emar_chart(resident_name, year_month):
 
     # Update layout for Controlled medications
     for med_name in filtered_control_structure.keys():
-        for datetime_string, slots in emar_data_dict.get(med_name, {}).items():
-            # Split the date and time, and then extract the day
-            date_part = datetime_string.split()[0]  # Get the 'YYYY-MM-DD' part
-            day = int(date_part.split('-')[2])  # Extract the day
+        for admin_date, slots in emar_data_dict.get(med_name, {}).items():
+            day = int(admin_date[8:10])  # admin_date is always 'YYYY-MM-DD'
 
             control_key = f'-Control_{med_name}-{day}-'
             # Check if there is any administration data for the day
@@ -419,8 +415,8 @@ def show_emar_chart(resident_name, year_month):
             window['-INSTRUCTIONS-'].update(visible=False)
             window['-LEGEND-'].update(visible=False)
         elif event == 'Save Changes Made':
-            db_functions.save_emar_data_from_chart_window(resident_name,year_month,values)
-            sg.popup("Changes Have Been Saved")
+            cells_written = db_functions.save_emar_data_from_chart_window(resident_name,year_month,values)
+            sg.popup(f"Changes Have Been Saved ({cells_written} cell(s) updated)")
         elif event.startswith('-PRN'):
             _, med_name, _, _ = event.split('-')
             parts = med_name.split('_')
@@ -0,0 +1,309 @@
+"""
+Maintenance commands for the encrypted PHI columns.
+
+    python encryption_maintenance.py migrate-format
+    python encryption_maintenance.py rotate-key [--workers N]
+
+migrate-format rewrites legacy Fernet tokens in the compact AES-GCM BLOB format. It
+walks each table in rowid order and commits one chunk at a time, so it can be stopped
+and rerun at any point; values that are already compact are left alone.
+
+Both commands also process the monthly audit archives (audit_YYYY_MM.db) next to the
+database, one file at a time.
+
+rotate-key re-encrypts everything under a new passphrase. Set RESIDENT_MGMT_DB_KEY to the
+new passphrase and RESIDENT_MGMT_DB_PREVIOUS_KEY to the old one on every workstation
+first; the app then reads with either key while the rotation runs. Progress is
+checkpointed per chunk in key_rotation_progress, so an interrupted rotation resumes
+where it stopped. Once it reports completion, remove RESIDENT_MGMT_DB_PREVIOUS_KEY.
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import audit_archive
+import audit_writer
+import crypto_context
+import database_setup
+import db_connection
+import db_functions
+
+
+# Columns written through encrypt_data(), per table
+ENCRYPTED_COLUMNS = {
+    'residents': ('date_of_birth', 'level_of_care'),
+    'medications': ('dosage', 'instructions'),
+    'audit_logs': ('description',),
+}
+
+CHUNK_SIZE = 2000
+
+# Blind index columns recomputed alongside their encrypted column, per table
+BLIND_INDEX_COLUMNS = {'residents': db_functions.RESIDENT_BLIND_INDEXES}
+
+# Compression threshold used when re-encrypting, per table; see encode_audit_payload()
+COMPRESS_OVER = {'audit_logs': audit_writer.AUDIT_COMPRESS_THRESHOLD}
+
+
+def iter_chunks(table, columns, chunk_size=CHUNK_SIZE, after_rowid=0):
+    """
+    Yield a table's rows in rowid order, one chunk at a time.
+
+    Each chunk is yielded inside its own write transaction, which commits when the
+    caller asks for the next chunk, so updates made to a chunk cannot race the app.
+
+    Yields:
+    list: (rowid, *columns) tuples.
+    """
+    column_list = ', '.join(columns)
+    while True:
+        with db_connection.transaction() as conn:
+            # Take the write lock before reading so the app cannot change the chunk in between
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute(f'SELECT rowid, {column_list} FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?',
+                                (after_rowid, chunk_size)).fetchall()
+            if not rows:
+                return
+            yield rows
+        after_rowid = rows[-1][0]
+
+
+def migrate_to_compact(context=None, chunk_size=CHUNK_SIZE, report=print, tables=ENCRYPTED_COLUMNS):
+    """
+    Re-encrypt every Fernet field of `tables` in the compact format.
+
+    Values that cannot be decrypted (for example plain text written by older code)
+    are left untouched and counted as skipped.
+
+    Returns:
+    dict: converted, skipped and rows counts plus elapsed seconds.
+    """
+    context = context or crypto_context.get_context()
+    totals = {'rows': 0, 'converted': 0, 'skipped': 0}
+    start = time.perf_counter()
+    for table, columns in tables.items():
+        for rows in iter_chunks(table, columns, chunk_size):
+            updates = []
+            for rowid, *values in rows:
+                new_values = []
+                for value in values:
+                    if not value or crypto_context.is_compact(value):
+                        new_values.append(value)
+                        continue
+                    try:
+                        new_values.append(context.encrypt_compact(context.decrypt(value, cache=False), COMPRESS_OVER.get(table)))
+                        totals['converted'] += 1
+                    except crypto_context.DECRYPT_ERRORS:
+                        new_values.append(value)
+                        totals['skipped'] += 1
+                if new_values != values:
+                    updates.append((*new_values, rowid))
+            assignments = ', '.join(f'{column} = ?' for column in columns)
+            with db_connection.transaction() as conn:
+                conn.executemany(f'UPDATE {table} SET {assignments} WHERE rowid = ?', updates)
+            totals['rows'] += len(rows)
+        report(f'{table}: done')
+    totals['seconds'] = time.perf_counter() - start
+    rate = totals['rows'] / totals['seconds'] if totals['seconds'] else 0
+    report(f"{totals['rows']} rows, {totals['converted']} fields converted, {totals['skipped']} skipped "
+           f"in {totals['seconds']:.1f} s ({rate:,.0f} rows/s)")
+    return totals
+
+
+_rotation_contexts = None
+
+
+def _init_rotation_worker(new_key, old_key, field_format):
+    """ Set up a rotation worker from already derived keys, so workers never run the KDF. """
+    global _rotation_contexts
+    _rotation_contexts = (crypto_context.CryptoContext(key=new_key, cache_bytes=0, field_format=field_format),
+                          crypto_context.CryptoContext(key=old_key, cache_bytes=0))
+
+
+def rotate_rows(table, columns, rows):
+    """
+    Re-encrypt one chunk of rows under the new key. Runs in a rotation worker.
+
+    Returns:
+    tuple: (update parameters, counts). Each update sets the new values and blind
+    indexes and only applies if the row still holds the values that were read.
+    """
+    new_context, old_context = _rotation_contexts
+    index_columns = BLIND_INDEX_COLUMNS.get(table, {})
+    counts = {'rotated': 0, 'current': 0, 'unreadable': 0}
+    updates = []
+    for rowid, *values in rows:
+        new_values = []
+        plaintexts = {}
+        for column, value in zip(columns, values):
+            if not value:
+                new_values.append(value)
+                continue
+            try:
+                plaintexts[column] = new_context.decrypt_own(value)
+                new_values.append(value)
+                counts['current'] += 1
+                continue
+            except crypto_context.DECRYPT_ERRORS:
+                pass
+            try:
+                plaintexts[column] = old_context.decrypt_own(value)
+            except crypto_context.DECRYPT_ERRORS:
+                new_values.append(value)
+                counts['unreadable'] += 1
+                continue
+            new_values.append(new_context.encrypt(plaintexts[column], COMPRESS_OVER.get(table)))
+            counts['rotated'] += 1
+        if new_values == values:
+            continue
+        indexes = [new_context.blind_index(plaintexts[column]) if column in plaintexts else b''
+                   for column in index_columns]
+        updates.append((*new_values, *indexes, rowid, *values))
+    return updates, counts
+
+
+def _rotation_update_sql(table, columns):
+    index_columns = list(BLIND_INDEX_COLUMNS.get(table, {}).values())
+    assignments = ', '.join(f'{column} = ?' for column in list(columns) + index_columns)
+    # Compare-and-set: a row the app rewrote since it was read already uses the new key
+    unchanged = ' AND '.join(f'{column} IS ?' for column in columns)
+    return f'UPDATE {table} SET {assignments} WHERE rowid = ? AND {unchanged}'
+
+
+def _read_rotation_progress(table, key_id):
+    with db_connection.transaction() as conn:
+        row = conn.execute('SELECT key_id, last_rowid, rows_done, completed FROM key_rotation_progress WHERE table_name = ?',
+                           (table,)).fetchone()
+    if row is None or row[0] != key_id:
+        return 0, 0, False  # Nothing recorded for this key, start from the beginning
+    return row[1], row[2], bool(row[3])
+
+
+def _save_rotation_progress(conn, table, key_id, last_rowid, rows_done, completed=False):
+    conn.execute('''
+        INSERT INTO key_rotation_progress (table_name, key_id, last_rowid, rows_done, completed, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(table_name) DO UPDATE SET key_id = excluded.key_id, last_rowid = excluded.last_rowid,
+            rows_done = excluded.rows_done, completed = excluded.completed, updated_at = excluded.updated_at
+    ''', (table, key_id, last_rowid, rows_done, int(completed), datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+
+def _read_chunk(table, columns, after_rowid, chunk_size):
+    with db_connection.transaction() as conn:
+        return conn.execute(f'SELECT rowid, {", ".join(columns)} FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?',
+                            (after_rowid, chunk_size)).fetchall()
+
+
+def rotate_key(new_context, old_context, workers=None, chunk_size=CHUNK_SIZE, report=print, tables=ENCRYPTED_COLUMNS):
+    """
+    Re-encrypt the encrypted columns of `tables` from `old_context`'s key to `new_context`'s key.
+
+    Chunks are read in rowid order and re-encrypted across a process pool, at most two
+    chunks per worker in flight, so memory stays bounded. Results are written back in
+    order, each chunk in one transaction together with its checkpoint.
+
+    Returns:
+    dict: rows, rotated, current and unreadable counts plus elapsed seconds.
+    """
+    workers = workers or crypto_context.DECRYPT_WORKERS
+    key_id = new_context.key_id
+    init_args = (new_context.key, old_context.key, new_context.field_format)
+    totals = {'rows': 0, 'rotated': 0, 'current': 0, 'unreadable': 0}
+
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_init_rotation_worker, initargs=init_args)
+    else:
+        pool = None
+        _init_rotation_worker(*init_args)
+
+    start = time.perf_counter()
+    try:
+        for table, columns in tables.items():
+            after_rowid, rows_done, completed = _read_rotation_progress(table, key_id)
+            if completed:
+                report(f'{table}: already rotated')
+                continue
+            update_sql = _rotation_update_sql(table, columns)
+            table_start = time.perf_counter()
+            table_rows = 0
+            pending = deque()
+
+            def write_oldest():
+                nonlocal rows_done, table_rows
+                future, chunk_rows, last_rowid = pending.popleft()
+                updates, counts = future.result() if pool else future
+                with db_connection.transaction() as conn:
+                    conn.executemany(update_sql, updates)
+                    rows_done += chunk_rows
+                    _save_rotation_progress(conn, table, key_id, last_rowid, rows_done)
+                table_rows += chunk_rows
+                for counter, value in counts.items():
+                    totals[counter] += value
+
+            while True:
+                rows = _read_chunk(table, columns, after_rowid, chunk_size)
+                if not rows:
+                    break
+                after_rowid = rows[-1][0]
+                work = pool.submit(rotate_rows, table, columns, rows) if pool else rotate_rows(table, columns, rows)
+                pending.append((work, len(rows), after_rowid))
+                if len(pending) >= workers * 2:
+                    write_oldest()
+            while pending:
+                write_oldest()
+
+            with db_connection.transaction() as conn:
+                _save_rotation_progress(conn, table, key_id, after_rowid, rows_done, completed=True)
+            elapsed = time.perf_counter() - table_start
+            totals['rows'] += table_rows
+            report(f'{table}: {table_rows} rows in {elapsed:.1f} s ({table_rows / elapsed if elapsed else 0:,.0f} rows/s)')
+    finally:
+        if pool:
+            pool.shutdown()
+
+    totals['seconds'] = time.perf_counter() - start
+    rate = totals['rows'] / totals['seconds'] if totals['seconds'] else 0
+    report(f"{totals['rows']} rows, {totals['rotated']} fields re-encrypted, {totals['current']} already current, "
+           f"{totals['unreadable']} unreadable in {totals['seconds']:.1f} s ({rate:,.0f} rows/s)")
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain the encrypted columns of resident_data.db.')
+    parser.add_argument('command', choices=['migrate-format', 'rotate-key'])
+    parser.add_argument('--database', default=db_connection.DATABASE_PATH, help='Database file (default: %(default)s)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=None, help='Processes used by rotate-key (default: one per CPU)')
+    args = parser.parse_args()
+
+    db_connection.set_database_path(args.database)
+    database_setup.initialize_database()  # Brings an older file up to the schema these commands expect
+    context = crypto_context.get_context()
+    if args.command == 'rotate-key' and context.previous is None:
+        parser.error(f'Set {crypto_context.PREVIOUS_PASSPHRASE_ENV_VAR} to the passphrase being retired '
+                     f'and {crypto_context.PASSPHRASE_ENV_VAR} to the new one.')
+
+    # The main database first, then each audit archive on its own
+    databases = [(args.database, ENCRYPTED_COLUMNS)]
+    databases += [(path, {'audit_logs': ENCRYPTED_COLUMNS['audit_logs']}) for _, path in audit_archive.list_archives()]
+    for path, tables in databases:
+        print(f'== {os.path.basename(path)} ==')
+        db_connection.set_database_path(path)
+        if path != args.database:
+            database_setup.initialize_audit_archive(path)
+        if args.command == 'migrate-format':
+            migrate_to_compact(context, chunk_size=args.chunk_size, tables=tables)
+        else:
+            rotate_key(context, context.previous, workers=args.workers, chunk_size=args.chunk_size, tables=tables)
+    db_connection.set_database_path(args.database)
+    if args.command == 'rotate-key':
+        print(f'Key rotation complete. Remove {crypto_context.PREVIOUS_PASSPHRASE_ENV_VAR} from every workstation.')
+
+
+if __name__ == '__main__':
+    main()
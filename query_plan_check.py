@@ -0,0 +1,164 @@
+"""
+Check that every filtered query in db_functions is served by an index.
+
+The SQL literals are read straight out of db_functions.py, so the check runs without
+the encryption key. Each one is planned with EXPLAIN QUERY PLAN against a freshly
+migrated schema and any full table or index scan, or a strftime() wrapped around a
+filtered column, is reported. Exits non-zero on failure:
+
+    python query_plan_check.py
+"""
+import ast
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+import database_setup
+import db_connection
+
+
+SOURCE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db_functions.py')
+
+SQL_KEYWORDS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+SQL_CLAUSES = {'WHERE', 'ON', 'JOIN', 'LEFT', 'INNER', 'SET', 'ORDER', 'GROUP', 'VALUES', 'SELECT', 'LIMIT', 'AS', 'USING'}
+
+# Queries assembled at runtime from fragments; the variants the UI actually issues
+DYNAMIC_QUERIES = {
+    'audit_username_filter': [
+        "SELECT username FROM main.audit_logs WHERE username >= ? COLLATE NOCASE AND username < ? COLLATE NOCASE ORDER BY username COLLATE NOCASE LIMIT 1",
+        "SELECT 1 FROM main.audit_logs WHERE username > ? COLLATE NOCASE AND username < ? COLLATE NOCASE LIMIT 1",
+    ],
+    'fetch_audit_rows': [
+        "SELECT log_id, timestamp, username, action, description FROM audit_logs WHERE 1=1 AND (timestamp, log_id) < (?, ?) ORDER BY timestamp DESC, log_id DESC LIMIT ?",
+        "SELECT log_id, timestamp, username, action, description FROM audit_logs WHERE 1=1 AND username >= ? COLLATE NOCASE AND username < ? COLLATE NOCASE AND (timestamp, log_id) < (?, ?) ORDER BY timestamp DESC, log_id DESC LIMIT ?",
+        "SELECT log_id, timestamp, username, action, description FROM audit_logs WHERE 1=1 AND username = ? COLLATE NOCASE AND timestamp >= ? ORDER BY timestamp DESC, log_id DESC LIMIT ?",
+        "SELECT log_id, timestamp, username, action, description FROM audit_logs WHERE 1=1 AND action = ? AND timestamp >= ? ORDER BY timestamp DESC, log_id DESC LIMIT ?",
+        "SELECT log_id, timestamp, username, action, description FROM audit_logs WHERE 1=1 AND timestamp >= ? AND timestamp < ? AND timestamp >= ? ORDER BY timestamp DESC, log_id DESC LIMIT ?",
+    ],
+    'fetch_active_medications': [
+        "SELECT r.name, m.medication_name, m.id FROM medications m JOIN residents r ON m.resident_id = r.id WHERE (m.discontinued_date IS NULL OR m.discontinued_date = '' OR m.discontinued_date > date('now', 'localtime')) AND r.name = ? ORDER BY r.name, m.id",
+        "SELECT r.name, m.medication_name, m.id FROM medications m JOIN residents r ON m.resident_id = r.id WHERE (m.discontinued_date IS NULL OR m.discontinued_date = '') AND r.name = ? ORDER BY r.name, m.id",
+    ],
+    'find_residents': [
+        "SELECT name, date_of_birth, level_of_care FROM residents WHERE 1=1 AND level_of_care_index IN (?) ORDER BY name",
+        "SELECT name, date_of_birth, level_of_care FROM residents WHERE 1=1 AND date_of_birth_index IN (?, ?) AND level_of_care_index IN (?, ?) ORDER BY name",
+    ],
+    'resident_has_care_level': [
+        "SELECT 1 FROM residents WHERE name = ? AND level_of_care_index IN (?, ?)",
+    ],
+    'resolve_emar_ids': [
+        "SELECT r.name, m.medication_name, r.id, m.id FROM residents r JOIN medications m ON m.resident_id = r.id WHERE r.name IN (?, ?, ?) ORDER BY m.id",
+    ],
+}
+
+# (function name, table) pairs allowed to scan, with the reason
+ALLOWED_SCANS = {
+    ('fetch_audit_rows', 'audit_logs'): 'first page without filters walks the (timestamp, log_id) index and stops after one page',
+    ('find_residents', 'residents'): 'base query without filters; the filtered variants are checked separately',
+    ('fetch_active_medications', 'medications'): 'facility-wide variant reads every medication; the per-resident variant is checked separately',
+}
+
+
+def extract_queries(source_file=SOURCE_FILE):
+    """
+    Collect the SQL string literals in each function of a module.
+
+    Returns:
+    list: (function name, sql) tuples in source order.
+    """
+    with open(source_file, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+
+    queries = []
+    for node in tree.body:
+        if not isinstance(node, ast.FunctionDef):
+            continue
+        # Docstrings and f-string pieces are prose, not SQL
+        skipped = {id(part) for child in ast.walk(node) if isinstance(child, ast.JoinedStr) for part in child.values}
+        if ast.get_docstring(node, clean=False) is not None:
+            skipped.add(id(node.body[0].value))
+        for child in ast.walk(node):
+            if isinstance(child, ast.Constant) and isinstance(child.value, str) and id(child) not in skipped:
+                sql = ' '.join(child.value.split())
+                if sql.startswith(SQL_KEYWORDS):
+                    queries.append((node.name, sql))
+        for sql in DYNAMIC_QUERIES.get(node.name, []):
+            queries.append((node.name, sql))
+    return queries
+
+
+def explain(conn, sql):
+    params = [None] * sql.count('?')
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()]
+
+
+def scanned_tables(plan, sql):
+    """ Return the real table names a plan scans, resolving aliases from the query text. """
+    words = sql.split()
+    aliases = {}
+    for i, word in enumerate(words[:-1]):
+        if word.upper() in ('FROM', 'JOIN', 'INTO', 'UPDATE') and not words[i + 1].endswith(','):
+            table = words[i + 1]
+            if i + 2 < len(words) and words[i + 2].isidentifier() and words[i + 2].upper() not in SQL_CLAUSES:
+                aliases[words[i + 2]] = table
+
+    tables = []
+    for detail in plan:
+        if detail.startswith('SCAN ') and not detail.startswith('SCAN CONSTANT ROW'):
+            name = detail.split()[1]
+            tables.append(aliases.get(name, name))
+    return tables
+
+
+def check_query_plans(verbose=False):
+    """
+    Plan every db_functions query and report filtered queries that still scan.
+
+    Returns:
+    list: Failure messages, empty when every hot query uses an index.
+    """
+    folder = tempfile.mkdtemp(prefix='resident_plan_')
+    previous_path = db_connection.DATABASE_PATH
+    db_connection.set_database_path(os.path.join(folder, 'resident_data.db'))
+    failures = []
+    try:
+        database_setup.initialize_database()
+        conn = sqlite3.connect(db_connection.DATABASE_PATH)
+        for function_name, sql in extract_queries():
+            try:
+                plan = explain(conn, sql)
+            except sqlite3.Error as e:
+                failures.append(f'{function_name}: cannot plan query ({e}): {sql}')
+                continue
+            if verbose:
+                print(f'{function_name}: {sql}')
+                for detail in plan:
+                    print(f'    {detail}')
+            if ' WHERE ' not in f' {sql.upper()} ':
+                continue  # Whole-table reads are expected to scan
+            if 'STRFTIME(' in sql.upper().split(' WHERE ', 1)[1]:
+                failures.append(f'{function_name}: filters on strftime() of a column, use month_window(): {sql}')
+            for table in scanned_tables(plan, sql):
+                if (function_name, table) in ALLOWED_SCANS:
+                    continue
+                failures.append(f'{function_name}: full scan of {table}: {sql}')
+        conn.close()
+    finally:
+        db_connection.set_database_path(previous_path)
+        shutil.rmtree(folder, ignore_errors=True)
+    return failures
+
+
+def main():
+    failures = check_query_plans(verbose='-v' in sys.argv)
+    for failure in failures:
+        print(f'FAIL {failure}')
+    if failures:
+        sys.exit(1)
+    print('All filtered queries use an index.')
+
+
+if __name__ == '__main__':
+    main()
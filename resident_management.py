@@ -48,29 +48,12 @@ def create_management_window(resident_names, selected_resident, default_tab_inde
 
 
 def open_discontinue_medication_window(resident_name):
-    # Fetch the list of medications for the resident
-    medications = db_functions.fetch_medications_for_resident(resident_name)
-    discontinued_medications = db_functions.fetch_discontinued_medications(resident_name).keys()
-    
-    # Extracting medication names from both Scheduled and PRN categories
-    scheduled_meds = [med_name for time_slot in medications['Scheduled'].values() for med_name in time_slot]
-    prn_meds = list(medications['PRN'].keys())
-    control_meds = list(medications['Controlled'].keys())
-    
-
-    # Combine both lists
-    all_meds = scheduled_meds + prn_meds + control_meds
-    # Remove Duplicates From Scheduled Medications
-    unique = set(all_meds)
-    # print(unique)
-    unique_list = list(unique)
-
-    # Exclude discontinued medications
-    active_meds = [med for med in unique_list if med not in discontinued_medications]
-
+    # Medications already set to stop, today or on a future date, have nothing left to discontinue
+    active_meds = list(db_functions.fetch_active_medications(resident_name, include_pending_discontinuations=False)
+                       .get(resident_name, {}))
 
     # Check if there are medications to discontinue
-    if not medications:
+    if not active_meds:
         sg.popup("No medications available to discontinue for this resident.")
         return
 
@@ -177,8 +160,9 @@ def main():
             month = values['-ADL_MONTH-'].zfill(2)
             year = values['-ADL_YEAR-']
             month_year = f'{year}-{month}'
-            print(month_year)
-            if db_functions.does_adl_chart_data_exist(selected_resident, month_year):
+            if not db_functions.is_valid_year_month(month_year):
+                sg.popup("Please enter a valid month (1-12) and four-digit year.")
+            elif db_functions.does_adl_chart_data_exist(selected_resident, month_year):
                 window.hide()
                 show_adl_chart(selected_resident, month_year)
                 window.un_hide()
@@ -189,7 +173,9 @@ def main():
             month = values['-EMAR_MONTH-'].zfill(2)
             year = values['-EMAR_YEAR-']
             month_year = f'{year}-{month}'
-            if db_functions.does_emars_chart_data_exist(selected_resident, month_year):
+            if not db_functions.is_valid_year_month(month_year):
+                sg.popup("Please enter a valid month (1-12) and four-digit year.")
+            elif db_functions.does_emars_chart_data_exist(selected_resident, month_year):
                 window.hide()
                 show_emar_chart(selected_resident, month_year)
                 window.un_hide()
@@ -234,23 +220,7 @@ def main():
             info_management.open_resident_info_window(selected_resident)
             window.un_hide()
         elif event == '-DC_MEDICATION-':
-            # Fetch the list of medications for the resident
-            medications = db_functions.fetch_medications_for_resident(selected_resident)
-            discontinued_medications = db_functions.fetch_discontinued_medications(selected_resident).keys()
-            
-            # Extracting medication names from both Scheduled and PRN categories
-            scheduled_meds = [med_name for time_slot in medications['Scheduled'].values() for med_name in time_slot]
-            prn_meds = list(medications['PRN'].keys())
-
-            # Combine both lists
-            all_meds = scheduled_meds + prn_meds
-            # Remove Duplicates From Scheduled Medications
-            unique = set(all_meds)
-            # print(unique)
-            unique_list = list(unique)
-
-            # Exclude discontinued medications
-            active_meds = [med for med in unique_list if med not in discontinued_medications]
+            active_meds = db_functions.fetch_active_medications(selected_resident, include_pending_discontinuations=False).get(selected_resident, {})
             if len(active_meds) > 0:
                 open_discontinue_medication_window(selected_resident)
             else:
@@ -0,0 +1,78 @@
+"""
+Audit archiving interrupted between its copy and its delete.
+
+    python -m pytest test_audit_archive.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import contextmanager
+from unittest import mock
+
+os.environ.setdefault('RESIDENT_MGMT_DB_KEY', 'test')
+
+import audit_archive
+import audit_writer
+import database_setup
+import db_connection
+import db_functions
+
+
+class InterruptedArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='resident_test_')
+        self.previous_path = db_connection.DATABASE_PATH
+        db_connection.set_database_path(os.path.join(self.folder, 'resident_data.db'))
+        database_setup.initialize_database()
+        rows = [('nurse', 'Login', audit_writer.encode_audit_payload(f'entry {i}'), f'2024-01-{i % 28 + 1:02d} 08:00:{i % 60:02d}')
+                for i in range(50)]
+        with db_connection.transaction() as conn:
+            conn.executemany(audit_writer.INSERT_SQL, rows)
+
+    def tearDown(self):
+        db_connection.close_all_connections()
+        db_connection.set_database_path(self.previous_path)
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def _archive_interrupted_before_delete(self, year_month):
+        transaction = db_connection.transaction
+        scopes = []
+
+        @contextmanager
+        def interrupted():
+            scopes.append(None)
+            if len(scopes) == 2:
+                raise KeyboardInterrupt  # The copy is committed, the delete never starts
+            with transaction() as conn:
+                yield conn
+
+        with mock.patch.object(db_connection, 'transaction', interrupted):
+            with self.assertRaises(KeyboardInterrupt):
+                audit_archive.archive_month(year_month)
+
+    def _all_log_ids(self, page_size=7):
+        log_ids, before = [], None
+        while True:
+            logs, before = db_functions.fetch_audit_log_page(before, page_size)
+            log_ids += [log['log_id'] for log in logs]
+            if before is None:
+                return log_ids
+
+    def test_pages_show_each_row_once(self):
+        expected = self._all_log_ids()
+        self._archive_interrupted_before_delete('2024-01')
+
+        with db_connection.transaction() as conn:
+            in_main = conn.execute('SELECT COUNT(*) FROM audit_logs').fetchone()[0]
+        self.assertEqual(in_main, 50)  # Copied but not yet deleted
+        self.assertEqual(self._all_log_ids(), expected)
+
+        # The next run finishes the month
+        self.assertEqual(audit_archive.archive_month('2024-01'), 50)
+        self.assertEqual(self._all_log_ids(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
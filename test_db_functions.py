@@ -0,0 +1,50 @@
+"""
+ADL chart saves through save_adl_rows().
+
+    python -m pytest test_db_functions.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+os.environ.setdefault('RESIDENT_MGMT_DB_KEY', 'test')
+
+import database_setup
+import db_connection
+import db_functions
+
+
+class AdlChartSaveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='resident_test_')
+        self.previous_path = db_connection.DATABASE_PATH
+        db_connection.set_database_path(os.path.join(self.folder, 'resident_data.db'))
+        database_setup.initialize_database()
+        with db_connection.transaction() as conn:
+            conn.execute("INSERT INTO residents (name, date_of_birth, level_of_care) VALUES ('Resident', '', '')")
+
+    def tearDown(self):
+        db_connection.close_all_connections()
+        db_connection.set_database_path(self.previous_path)
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_blank_management_save_still_records_the_day(self):
+        db_functions.save_adl_data_from_management_window('Resident', {})
+        self.assertTrue(db_functions.does_adl_chart_data_exist('Resident', db_functions.datetime.now().strftime('%Y-%m')))
+
+    def test_chart_save_writes_blank_days_once(self):
+        blank = {f'-{key}-{day}-': '' for key in db_functions.ADL_KEYS for day in range(1, 32)}
+        self.assertEqual(db_functions.save_adl_data_from_chart_window('Resident', '2024-6', blank), 31)
+        self.assertTrue(db_functions.does_adl_chart_data_exist('Resident', '2024-06'))
+        self.assertEqual(db_functions.save_adl_data_from_chart_window('Resident', '2024-06', blank), 0)
+
+    def test_chart_save_rejects_invalid_month(self):
+        for year_month in ('', '2024-13', '-00', '2024-ab'):
+            with self.assertRaises(ValueError):
+                db_functions.save_adl_data_from_chart_window('Resident', year_month, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
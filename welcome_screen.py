@@ -2,12 +2,13 @@ import PySimpleGUI as sg
 import resident_management
 import db_functions
 import os
-import shutil
 from datetime import datetime, timedelta, date
 from tkinter import font
 import sys
 import database_setup
 import config
+import crypto_context
+import backup_scheduler
 import secrets
 import string
 import pyperclip
@@ -26,10 +27,20 @@ apply_user_theme()
 FONT = db_functions.get_user_font()
 FONT_BOLD = 'Arial Bold'
 
+# Milliseconds between refreshes of the backup status line in the welcome window
+STATUS_REFRESH_MS = 1000
+
 def backup_configuration_window():
+    current = db_functions.get_backup_configuration() or {'backup_folder': '', 'backup_frequency': 'Weekly',
+                                                          'keep_daily': 7, 'keep_weekly': 4, 'keep_monthly': 12}
     layout = [
-        [sg.Text("Backup Folder:"), sg.InputText(key='BackupFolder'), sg.FolderBrowse()],
-        [sg.Text("Backup Frequency:"), sg.Combo(['Daily', 'Weekly'], default_value='Weekly', key='BackupFrequency')],
+        [sg.Text("Backup Folder:"), sg.InputText(current['backup_folder'], key='BackupFolder'), sg.FolderBrowse()],
+        [sg.Text("Backup Frequency:"), sg.Combo(['Daily', 'Weekly'], default_value=current['backup_frequency'], key='BackupFrequency')],
+        [sg.Text("Keep Backups:"),
+         sg.Spin(list(range(0, 366)), initial_value=current['keep_daily'], key='KeepDaily', size=(4, 1)), sg.Text("daily"),
+         sg.Spin(list(range(0, 105)), initial_value=current['keep_weekly'], key='KeepWeekly', size=(4, 1)), sg.Text("weekly"),
+         sg.Spin(list(range(0, 121)), initial_value=current['keep_monthly'], key='KeepMonthly', size=(4, 1)), sg.Text("monthly")],
+        [sg.Text("Older backups are deleted after each new backup. The most recent backup is always kept.", size=(60, 1))],
         [sg.Text("It's highly recommended to choose a backup location that is external to your computer, such as a cloud storage service or an external hard drive. This ensures that your data remains safe even in the event of hardware failure, theft, or other physical damages to your computer.", size=(60, 4))],
         [sg.Button("Save"), sg.Button("Cancel")]
     ]
@@ -41,58 +52,62 @@ def backup_configuration_window():
         if event == sg.WINDOW_CLOSED or event == "Cancel":
             break
         elif event == "Save":
-            
-            db_functions.save_backup_configuration(values['BackupFolder'], values['BackupFrequency'])
+            try:
+                keep = [int(values[key]) for key in ('KeepDaily', 'KeepWeekly', 'KeepMonthly')]
+            except ValueError:
+                sg.popup("Please enter whole numbers for the backups to keep.")
+                continue
+            if min(keep) < 0:
+                sg.popup("The number of backups to keep cannot be negative.")
+                continue
+            db_functions.save_backup_configuration(values['BackupFolder'], values['BackupFrequency'], *keep)
             sg.popup("Configuration Saved. Automatic backups will be performed accordingly.")
             break
 
     window.close()
 
-def is_backup_due():
-    backup_config = db_functions.get_backup_configuration()
-    if not backup_config:
-        return False
+def passphrase_setup_window():
+    """ Show how to set the database passphrase when it is missing from the environment. """
+    passphrase = db_functions.generate_strong_passphrase()
+
+    detailed_instructions = (
+        f"Passphrase: {passphrase}\n\n"
+        "Setting the Environment Variable\n\n"
+        "For Windows:\n"
+        "1. Open the Start Search, type in 'env', and choose 'Edit the system environment variables'.\n"
+        "2. In the System Properties window, click on the 'Environment Variables…' button.\n"
+        "3. In the Environment Variables window, click 'New…' under the 'System variables' section.\n"
+        f"4. Set the variable name as {crypto_context.PASSPHRASE_ENV_VAR} and paste the passphrase in the variable value. Click OK.\n\n"
+        "For macOS and Linux:\n"
+        "1. Open a terminal window.\n"
+        "2. Enter the following command, replacing <passphrase> with the actual passphrase:\n"
+        f"   echo 'export {crypto_context.PASSPHRASE_ENV_VAR}=\"<passphrase>\"' >> ~/.bash_profile\n"
+        "3. For the change to take effect, you might need to reload the profile with source ~/.bash_profile or simply restart the terminal."
+    )
 
-    last_backup_date = backup_config['last_backup_date']
-    today = datetime.now().date()
+    layout = [
+        [sg.Text("Passphrase not found. Please follow the instructions below to set it up.")],
+        [sg.Multiline(detailed_instructions, size=(80, 15), disabled=True)],
+        [sg.Button("Copy Passphrase")]
+    ]
 
-    if backup_config['backup_frequency'] == 'Daily' and (today - last_backup_date).days >= 1:
-        return True
-    elif backup_config['backup_frequency'] == 'Weekly' and (today - last_backup_date).days >= 7:
-        return True
+    window = sg.Window("Setup Passphrase", layout)
+
+    while True:
+        event, values = window.read()
 
-    return False
+        if event == sg.WINDOW_CLOSED:
+            break
+        elif event == "Copy Passphrase":
+            pyperclip.copy(passphrase)
+            sg.popup("Passphrase copied to clipboard. Please follow the instructions to set it as an environment variable.", keep_on_top=True)
 
+    window.close()
 
-def perform_backup():
-    # Retrieve backup configuration
-    backup_config = db_functions.get_backup_configuration()
-    if not backup_config:
-        print("Backup configuration not found.")
-        return
-    
-    backup_folder = backup_config['backup_folder']
-    database_path = 'resident_data.db'  # Path to your SQLite database
-    current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_filename = f"backup_{current_time}.db"
-    
-    # Construct the full path for the backup file
-    backup_path = os.path.join(backup_folder, backup_filename)
-    
-    try:
-        # Copy the database file to the backup folder
-        shutil.copyfile(database_path, backup_path)
-        print(f"Backup successful: {backup_path}")
-    except Exception as e:
-        print(f"Error during backup: {e}")
 
 def startup_routine():
-    if is_backup_due():
-        perform_backup()
-        db_functions.update_last_backup_date()
-    #     print("Backup performed successfully.")
-    # else:
-    #     print("No backup needed at this time.")
+    # Due backups and audit log archiving run on a background thread, so login doesn't wait for them
+    backup_scheduler.start()
 
 
 def enter_resident_info():
@@ -425,6 +440,9 @@ def login_window():
             if db_functions.validate_login(username, password):
                 # Log the successful login action
                 config.global_config['logged_in_user'] = username
+                db_functions.clear_session_caches()
+                # Index residents added since by older builds, so searches and care level checks can find them
+                db_functions.backfill_resident_blind_indexes()
                 db_functions.log_action(username, "Login", f"{username}")
                 if db_functions.needs_password_reset(username):
                     window.close()
@@ -446,23 +464,43 @@ def audit_logs_window():
     # Define the layout for the audit logs window
     layout = [
         [sg.Text('', expand_x=True), sg.Text('Admin Audit Logs', font=(db_functions.get_user_font(), 23)), sg.Text('', expand_x=True)],
-        [sg.Text("Filter by Username:"), sg.InputText(key='-USERNAME_FILTER-', size=14)],
+        [sg.Text("Filter by Username (starts with):"), sg.InputText(key='-USERNAME_FILTER-', size=14)],
         [sg.Text("Filter by Action:"), sg.Combo(['Login', 'Logout', 'Resident Added', 'User Created', 'New Medication', 'Add Non-Medication Order', 'Non-Medication Order Administered'], key='-ACTION_FILTER-', readonly=True)],
         [sg.Text("Filter by Date (YYYY-MM-DD):"), sg.InputText(key='-DATE_FILTER-', enable_events=True, size=10), sg.CalendarButton("Choose Date", target='-DATE_FILTER-', close_when_date_chosen=True, format='%Y-%m-%d')],
         [sg.Button("Apply Filters"), sg.Button("Reset Filters")],
         [sg.Table(headings=['Date', 'Username', 'Action', 'Description'], values=[], key='-AUDIT_LOGS_TABLE-', auto_size_columns=False, display_row_numbers=True, num_rows=20, col_widths=col_widths, enable_click_events=True, select_mode=sg.TABLE_SELECT_MODE_BROWSE)],
-        [sg.Button("Close")]
+        [sg.Button("Newer", disabled=True), sg.Text('Page 1', key='-PAGE-'), sg.Button("Older", disabled=True), sg.Text('', expand_x=True), sg.Button("Close")]
     ]
 
     window = sg.Window("Audit Logs", layout, finalize=True)
+    pager = None
 
-    # Function to load audit logs
-    def load_audit_logs(username_filter='', action_filter='', date_filter=''):
-        logs = db_functions.fetch_audit_logs(last_10_days=True, username=username_filter, action=action_filter, date=date_filter)
+    def show_page(logs):
         table_data = [[log['date'], log['username'], log['action'], log['description']] for log in logs]
-        window['-AUDIT_LOGS_TABLE-'].update(values=[[log['date'], log['username'], log['action'], log['description']] for log in logs])
+        window['-AUDIT_LOGS_TABLE-'].update(values=table_data)
+        window['-PAGE-'].update(f'Page {pager.page_number}')
+        window['Newer'].update(disabled=pager.page_number <= 1)
+        window['Older'].update(disabled=not pager.has_next)
         return table_data
 
+    # Function to load audit logs; only the first page is read and decrypted
+    def load_audit_logs(username_filter='', action_filter='', date_filter=''):
+        nonlocal pager
+        db_functions.flush_audit_log()  # Include actions still queued for the audit writer
+        # Without a specific date, show the last 10 days as before
+        since = '' if date_filter else (datetime.now() - timedelta(days=10)).strftime('%Y-%m-%d')
+        new_pager = db_functions.AuditLogPager(username=username_filter, action=action_filter, date=date_filter, since=since)
+        try:
+            logs = new_pager.first_page()
+        except ValueError:
+            sg.popup("Please enter the date as YYYY-MM-DD.", title="Error")
+            return original_table_data
+        if pager:
+            pager.close()
+        pager = new_pager
+        return show_page(logs)
+
+    original_table_data = []
     original_table_data = load_audit_logs()  # Initial loading of logs
 
     while True:
@@ -475,6 +513,10 @@ def audit_logs_window():
             clicked_row_data = original_table_data[row_index]
             description = clicked_row_data[3]  # Assuming the description is in the fourth column.
             sg.popup_scrolled(description, title='Detailed Description', size=(50, 10))
+        elif event == "Older":
+            original_table_data = show_page(pager.next_page())
+        elif event == "Newer":
+            original_table_data = show_page(pager.previous_page())
         elif event == "Apply Filters":
             original_table_data = load_audit_logs(username_filter=values['-USERNAME_FILTER-'], action_filter=values['-ACTION_FILTER-'], date_filter=values['-DATE_FILTER-'])
         elif event == "Reset Filters":
@@ -483,6 +525,7 @@ def audit_logs_window():
             window['-DATE_FILTER-'].update('')
             original_table_data = load_audit_logs()  # Reload logs without filters
 
+    pager.close()
     window.close()
 
 
@@ -519,15 +562,23 @@ def display_welcome_window(num_of_residents_local, show_login=False):
                  font=(FONT, 16), justification='center', pad=(10,10))],
         [sg.Text(text='', expand_x=True), sg.Button(key='Enter Resident Management', pad=((30,30),(10,10)), image_filename='enter.png'),
           sg.Button(key="Change Theme", pad=((30,30),(10,10)), image_filename='style.png'), sg.Text(text='', expand_x=True)],
-          [admin_panel]
+          [admin_panel],
+        [sg.Text(backup_scheduler.status_text(), key='-BACKUP_STATUS-', size=(70, 1), font=(FONT, 10), justification='center')]
     ]
 
     window = sg.Window('CareTech Resident Manager', layout, element_justification='c')
+    backup_status = None
 
     while True:
-        event, values = window.read()
+        event, values = window.read(timeout=STATUS_REFRESH_MS)
         if event == sg.WIN_CLOSED:
             break
+        status = backup_scheduler.status_text()
+        if status != backup_status:
+            backup_status = status
+            window['-BACKUP_STATUS-'].update(status)
+        if event == sg.TIMEOUT_EVENT:
+            continue
         elif event == 'Add Resident':
             window.close()
             enter_resident_info()
@@ -572,9 +623,14 @@ def display_welcome_window(num_of_residents_local, show_login=False):
             window.un_hide()
             
     db_functions.log_action(logged_in_user, 'Logout', f'{logged_in_user} logout')
+    db_functions.flush_audit_log()
     config.global_config['logged_in_user'] = None
+    db_functions.clear_session_caches()
     window.close()
 
 if __name__ == "__main__":
+    if not crypto_context.has_passphrase():
+        passphrase_setup_window()
+        sys.exit()  # Exit after displaying the instructions
     startup_routine()
     display_welcome_window(db_functions.get_resident_count(), show_login=True)